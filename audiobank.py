@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Pre-rendered audio bank for performance scripts.
+
+Most lines of a show are known ahead of time. The build step renders every
+line of a script with every voice into one packed file: a contiguous float32
+PCM blob followed by an offset index keyed by a hash of (voice, text). At
+runtime the bank is memory-mapped, so a known line is a slice of the mapping,
+the model is not involved, and pages are only read from disk when played.
+Lines that are not in the bank fall back to live synthesis (see
+VoiceSynth.load_bank).
+
+File layout:
+    header      magic (8 bytes), index offset (uint64), index length (uint64), padding to DATA_OFFSET
+    data        float32 PCM of all lines, back to back
+    index       JSON {"version": 1, "entries": {key: [offset, length, sr, voice, text]}}
+                offsets and lengths in samples
+
+python audiobank.py build --model-path ../outputs/checkpoints/efam48_220k/ --script show.txt --output show.bank
+python audiobank.py info show.bank
+"""
+import os
+import json
+import struct
+import hashlib
+import logging
+import threading
+from logging import Logger
+from pathlib import Path
+from typing import List, Tuple, Dict, Union, Iterable
+
+import numpy as np
+
+MAGIC = b"SHIBBANK"
+HEADER = struct.Struct("<8sQQ")
+DATA_OFFSET = 64
+VERSION = 1
+
+Voice = Tuple[str, str, str] # (model_id, speaker_name, language_name)
+
+
+def voice_id(voice: Voice) -> str:
+    model_id, speaker_name, language_name = voice
+    return f"{model_id}|{speaker_name or ''}|{language_name or ''}"
+
+
+def parse_voice(spec: str) -> Voice:
+    """model_id[:speaker_name[:language_name]] -> (model_id, speaker_name, language_name)"""
+    parts = spec.split(":") + [None, None]
+    return parts[0], parts[1] or None, parts[2] or None
+
+
+def line_key(text: str, voice: Voice) -> str:
+    """Index key of a line, lines that only differ in spacing share a key."""
+    text = " ".join(text.split())
+    return hashlib.sha1(f"{voice_id(voice)}\n{text}".encode("utf-8")).hexdigest()
+
+
+def load_script(path: Union[str, Path]) -> List[str]:
+    """One line of the script per text line, blank lines and #comments are skipped."""
+    lines = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line != "" and not line.startswith("#"):
+                lines.append(line)
+    return lines
+
+
+class AudioBankWriter:
+    """
+    Packs rendered lines into a bank file. Use as a context manager, the
+    index is written on close().
+        path        Bank file to write (written to path.tmp, moved into place on close)
+    """
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        self.tmp_path = self.path.with_name(self.path.name + ".tmp")
+        self.file = open(self.tmp_path, "wb")
+        self.file.write(b"\0" * DATA_OFFSET)
+        self.offset = 0 # in samples
+        self.entries = dict()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def add(self, text: str, voice: Voice, wav: np.ndarray, sr: int) -> str:
+        """Append a rendered line, returns its key. A line already in the bank is not added twice."""
+        key = line_key(text, voice)
+        if key in self.entries:
+            return key
+        wav = np.ascontiguousarray(wav, dtype=np.float32)
+        self.file.write(wav.tobytes())
+        self.entries[key] = [self.offset, len(wav), int(sr), voice_id(voice), text]
+        self.offset += len(wav)
+        return key
+
+    def close(self) -> None:
+        if self.file is None:
+            return
+        index = json.dumps({"version": VERSION, "entries": self.entries}).encode("utf-8")
+        index_offset = self.file.tell()
+        self.file.write(index)
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, index_offset, len(index)))
+        self.file.close()
+        self.file = None
+        os.replace(self.tmp_path, self.path)
+
+    def __enter__(self) -> "AudioBankWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+            self.file = None
+            os.remove(self.tmp_path)
+
+
+class AudioBank:
+    """
+    A memory-mapped bank of pre-rendered lines.
+        path        Bank file written by AudioBankWriter / build_bank()
+    """
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            magic, index_offset, index_length = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{self.path} is not an audio bank")
+            f.seek(index_offset)
+            index = json.loads(f.read(index_length).decode("utf-8"))
+        if index["version"] != VERSION:
+            raise ValueError(f"Unsupported audio bank version {index['version']} in {self.path}")
+        self.entries = index["entries"]
+
+        num_samples = (index_offset - DATA_OFFSET) // 4
+        if num_samples > 0:
+            self.data = np.memmap(self.path, dtype=np.float32, mode="r", offset=DATA_OFFSET, shape=(num_samples,))
+        else:
+            self.data = np.zeros(0, dtype=np.float32)
+
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def lookup(self, text: str, voice: Voice) -> Union[Tuple[np.ndarray, int], None]:
+        """
+        Returns (read-only view of the samples, sample rate) for a line in the bank, or None.
+        """
+        entry = self.entries.get(line_key(text, voice))
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        offset, length, sr = entry[0], entry[1], entry[2]
+        return self.data[offset:offset + length], sr
+
+    def lines(self) -> Iterable[Tuple[str, str, float]]:
+        """(voice, text, duration in seconds) of all lines in the bank"""
+        for offset, length, sr, voice, text in self.entries.values():
+            yield voice, text, length / sr
+
+    def stats(self) -> Dict:
+        return {
+            "lines": len(self.entries),
+            "bytes": int(self.data.nbytes),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def build_bank(voice_synth, script: List[str], voices: List[Voice], output_path: Union[str, Path],
+    clean_text: bool = False, rewrite_words: Dict[str, str] = None, logger: Logger = None) -> Path:
+    """
+    Render every line of a script with every voice into a bank file.
+    The text goes through the same preparation as VoiceSynth.synthesize(), so runtime lookups match
+    when clean_text and rewrite_words are the same as at runtime (the entry points use clean_text=False).
+    """
+    log = logger if logger is not None else logging.getLogger("AudioBank")
+    output_path = Path(output_path)
+    total = len(script) * len(voices)
+    with AudioBankWriter(output_path) as writer:
+        for voice in voices:
+            model_id, speaker_name, language_name = voice
+            voice_synth.require_model(model_id) # models of a manifest that are not preloaded
+            sr = voice_synth.tts[model_id]["sr"]
+            for line in script:
+                text = voice_synth.prepare_text(line, clean_text, rewrite_words)
+                if line_key(text, voice) in writer:
+                    continue
+                wav = voice_synth.pr_synthesize(voice_synth.tts[model_id]["tts"], text, speaker_name, language_name, None, None)
+                writer.add(text, voice, np.array(wav, dtype=np.float32), sr)
+                log.info(f"[{len(writer.entries)}/{total}] {voice_id(voice)}: {text}")
+    print(f"Wrote {len(writer.entries)} lines to {output_path}")
+    return output_path
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pre-rendered audio banks.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Render a script into a bank")
+    build_parser.add_argument("--model-path", type=Path, default=None, help="Path to root directory of TTS model (model_file.pth, config.json), loaded as model 'vits'")
+    build_parser.add_argument("--models", type=Path, default=None, help="Model manifest (see modelspec.py) instead of --model-path")
+    build_parser.add_argument("--script", type=Path, required=True, help="Script text file, one line per line")
+    build_parser.add_argument("--voice", type=str, nargs="+", default=None, help="Voices as model_id[:speaker[:language]] (default: the first preloaded model)")
+    build_parser.add_argument("--output", type=Path, required=True, help="Bank file to write")
+    build_parser.add_argument("--clean-text", action="store_true", help="Clean up the text (match clean_text=True at runtime)")
+    build_parser.add_argument("--output-path", type=Path, default="tmp/wav", help="Audio write / temp file output directory.")
+    build_parser.add_argument("--use-cuda", type=bool, help="Run model on CUDA.", default=False)
+    build_parser.add_argument("--torch-threads", type=int, default=None, help="Torch intra-op threads (default: all cores)")
+
+    info_parser = subparsers.add_parser("info", help="List the lines in a bank")
+    info_parser.add_argument("bank", type=Path)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "build":
+        if args.models is None and args.model_path is None:
+            build_parser.error("Either --model-path or --models is needed")
+
+        from voicesynth import VoiceSynth
+        import modelspec
+        import resources
+
+        # offline rendering: no audio to protect, give torch every core
+        resources.ResourceManager(torch_threads=args.torch_threads, reserve_cores=0, pin=False).apply()
+
+        model_specs = modelspec.specs_from_args(args, name="vits")
+        voices = args.voice or [modelspec.default_model(model_specs)]
+        voice_synth = VoiceSynth(args.output_path.resolve(), args.use_cuda, logging.getLogger("VoiceSynthesizer"))
+        voice_synth.load_specs(model_specs)
+        build_bank(voice_synth, load_script(args.script), [parse_voice(v) for v in voices], args.output,
+            clean_text=args.clean_text)
+
+    elif args.command == "info":
+        bank = AudioBank(args.bank)
+        total = 0.0
+        for voice, text, duration in bank.lines():
+            print(f"{duration:7.2f}s  {voice:24s}  {text}")
+            total += duration
+        print(f"{len(bank)} lines, {total:.1f}s, {bank.data.nbytes / 1e6:.1f} MB")
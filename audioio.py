@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+Shared audio file I/O.
+
+Long reference and example recordings are never decoded into memory up front:
+* PCM/float WAV files are memory-mapped, blocks are views into the file pages.
+* Formats libsndfile can decode (flac, ogg, aiff...) are read block by block.
+* Everything else (e.g. the .webm samples) is decoded by an ffmpeg subprocess
+    and read block by block from its stdout pipe.
+
+Blocks are float32 arrays of shape (frames, channels). Sample rate conversion
+is done on the stream as well, so playback or processing can begin as soon as
+the first block is decoded.
+
+python audioio.py --wav exampleaudio/test-sentence.webm --output-device 1
+"""
+import os
+import sys
+import queue
+import struct
+import shutil
+import threading
+import subprocess
+from pathlib import Path
+from typing import Iterator, Tuple, Union
+
+import numpy as np
+import soundfile
+
+try:
+    import soxr # streaming resampler, installed together with librosa >= 0.10
+except ImportError:
+    soxr = None
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+DEFAULT_BLOCKSIZE = 4096
+
+
+def wav_data_layout(path: Union[str, Path]) -> Union[Tuple[int, int, int, np.dtype, int], None]:
+    """
+    Parse the RIFF chunks of a WAV file.
+    Returns (data offset, number of frames, channels, numpy dtype, samplerate),
+    or None if the file is not a WAV file that can be memory-mapped as is.
+    """
+    with open(path, "rb") as f:
+        riff = f.read(12)
+        if len(riff) < 12 or riff[0:4] != b"RIFF" or riff[8:12] != b"WAVE":
+            return None
+
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return None
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                fmt = f.read(chunk_size)
+                if chunk_size % 2:
+                    f.seek(1, os.SEEK_CUR)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    return None
+                data_offset = f.tell()
+                break
+            else:
+                f.seek(chunk_size + (chunk_size % 2), os.SEEK_CUR)
+
+    format_tag, channels, samplerate, _, block_align, bits = struct.unpack("<HHIIHH", fmt[:16])
+    if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        format_tag = struct.unpack("<H", fmt[24:26])[0] # first two bytes of the subformat GUID
+
+    dtypes = {
+        (WAVE_FORMAT_PCM, 8): np.uint8,
+        (WAVE_FORMAT_PCM, 16): np.int16,
+        (WAVE_FORMAT_PCM, 32): np.int32,
+        (WAVE_FORMAT_IEEE_FLOAT, 32): np.float32,
+        (WAVE_FORMAT_IEEE_FLOAT, 64): np.float64,
+    }
+    dtype = dtypes.get((format_tag, bits))
+    if dtype is None: # e.g. 24 bit PCM, let libsndfile handle it
+        return None
+
+    # chunk_size can be bogus (0 or 0xFFFFFFFF) for streamed recordings, trust the file size instead
+    data_size = min(chunk_size, os.path.getsize(path) - data_offset)
+    num_frames = data_size // block_align
+    return data_offset, num_frames, channels, np.dtype(dtype), samplerate
+
+
+def to_float32(block: np.ndarray) -> np.ndarray:
+    """Convert integer PCM to float32 in [-1, 1]."""
+    if block.dtype == np.float32:
+        return block
+    if block.dtype == np.uint8:
+        return (block.astype(np.float32) - 128.0) / 128.0
+    if np.issubdtype(block.dtype, np.integer):
+        return block.astype(np.float32) / float(np.iinfo(block.dtype).max + 1)
+    return block.astype(np.float32)
+
+
+class AudioReader:
+    """
+    Block-wise reader for an audio file. Nothing is decoded until blocks are requested.
+
+        path        Audio file path
+        samplerate  Resample to this rate while reading (None keeps the file's rate)
+        mono        Mix down to a single channel
+    """
+    def __init__(self, path: Union[str, Path], samplerate: int = None, mono: bool = False) -> None:
+        self.path = Path(path)
+        self.mono = mono
+        self.memmap = None
+        self.backend = None
+
+        layout = wav_data_layout(self.path) if self.path.suffix.lower() in (".wav", ".wave") else None
+        if layout is not None:
+            offset, num_frames, channels, dtype, file_samplerate = layout
+            self.memmap = np.memmap(self.path, dtype=dtype, mode="r", offset=offset, shape=(num_frames, channels))
+            self.backend = "memmap"
+        else:
+            try:
+                info = soundfile.info(str(self.path))
+                num_frames, channels, file_samplerate = info.frames, info.channels, info.samplerate
+                self.backend = "soundfile"
+            except RuntimeError:
+                num_frames, channels, file_samplerate = ffmpeg_probe(self.path)
+                self.backend = "ffmpeg"
+
+        self.file_samplerate = file_samplerate
+        self.file_channels = channels
+        self.num_frames = num_frames # unknown (None) for some compressed streams
+        self.samplerate = samplerate if samplerate is not None else file_samplerate
+        self.channels = 1 if mono else channels
+
+    @property
+    def duration(self) -> Union[float, None]:
+        if self.num_frames is None:
+            return None
+        return self.num_frames / self.file_samplerate
+
+    def frames(self, start: int, stop: int) -> np.ndarray:
+        """Random access into a memory-mapped WAV (file sample rate, no copy for float32 files)."""
+        if self.memmap is None:
+            raise ValueError(f"Random access is only possible on memory-mapped WAV files, not {self.path}")
+        return to_float32(self.memmap[start:stop])
+
+    def _raw_blocks(self, blocksize: int) -> Iterator[np.ndarray]:
+        if self.backend == "memmap":
+            for start in range(0, self.num_frames, blocksize):
+                yield to_float32(self.memmap[start:start + blocksize])
+
+        elif self.backend == "soundfile":
+            for block in soundfile.blocks(str(self.path), blocksize=blocksize, dtype="float32", always_2d=True):
+                yield block
+
+        else:
+            yield from ffmpeg_blocks(self.path, blocksize, self.file_channels, self.file_samplerate)
+
+    def blocks(self, blocksize: int = DEFAULT_BLOCKSIZE) -> Iterator[np.ndarray]:
+        """Yield float32 blocks of shape (frames, channels) at the reader's sample rate."""
+        resampler = None
+        if self.samplerate != self.file_samplerate:
+            resampler = StreamResampler(self.file_samplerate, self.samplerate, self.channels)
+
+        for block in self._raw_blocks(blocksize):
+            if self.mono and block.shape[1] > 1:
+                block = block.mean(axis=1, keepdims=True)
+            if resampler is not None:
+                block = resampler.process(block)
+                if len(block) == 0:
+                    continue
+            yield block
+
+        if resampler is not None:
+            block = resampler.process(np.zeros((0, self.channels), dtype=np.float32), last=True)
+            if len(block) > 0:
+                yield block
+
+    def read(self) -> np.ndarray:
+        """Read the whole file (at the reader's sample rate). 1D if mono."""
+        wav = np.concatenate(list(self.blocks(1 << 16)) or [np.zeros((0, self.channels), dtype=np.float32)])
+        return wav[:, 0] if self.mono else wav
+
+
+class StreamResampler:
+    """
+    Block-wise sample rate conversion without edge artifacts between blocks.
+    Without soxr, every block is resampled with librosa together with `pad` input frames of
+    history and lookahead, and only the middle is kept (the output is `pad` frames late).
+    """
+    def __init__(self, in_rate: int, out_rate: int, channels: int, pad: int = 512) -> None:
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        if soxr is not None:
+            self.stream = soxr.ResampleStream(in_rate, out_rate, channels, dtype="float32")
+        else:
+            import librosa
+            self.stream = None
+            self.librosa = librosa
+            self.pad = pad
+            # segments start on input frames that fall exactly on an output frame, so they share one sample grid
+            self.step = in_rate // np.gcd(in_rate, out_rate)
+            self.buffer = np.zeros((0, channels), dtype=np.float32) # input from frame buffer_start on
+            self.buffer_start = 0
+            self.in_pos = 0 # input frames whose output has been returned
+            print("soxr not available, resampling with overlapping librosa blocks", file=sys.stderr)
+
+    def output_frames(self, in_frames: int) -> int:
+        """Output frames of the first in_frames input frames (rounded up, as librosa does for a whole file)."""
+        return -(-in_frames * self.out_rate // self.in_rate)
+
+    def resample(self, segment: np.ndarray) -> np.ndarray:
+        return self.librosa.resample(segment.T, orig_sr=self.in_rate, target_sr=self.out_rate).T.astype(np.float32)
+
+    def process(self, block: np.ndarray, last: bool = False) -> np.ndarray:
+        if self.stream is not None:
+            return self.stream.resample_chunk(np.ascontiguousarray(block, dtype=np.float32), last=last)
+
+        self.buffer = np.concatenate((self.buffer, block.astype(np.float32, copy=False)))
+        total = self.buffer_start + len(self.buffer)
+        end = total if last else total - self.pad # keep pad frames of lookahead
+        if end <= self.in_pos:
+            return np.zeros((0, self.buffer.shape[1]), dtype=np.float32)
+
+        start = max(0, self.in_pos - self.pad) // self.step * self.step
+        segment = self.buffer[start - self.buffer_start:]
+        offset = start * self.out_rate // self.in_rate # exact, start is a multiple of step
+        out = self.resample(segment)[self.output_frames(self.in_pos) - offset:self.output_frames(end) - offset]
+
+        self.in_pos = end
+        next_start = max(0, end - self.pad) // self.step * self.step
+        self.buffer = self.buffer[next_start - self.buffer_start:]
+        self.buffer_start = next_start
+        return out
+
+
+def ffmpeg_probe(path: Union[str, Path]) -> Tuple[Union[int, None], int, int]:
+    """Get (number of frames or None, channels, samplerate) of a file with ffprobe."""
+    if shutil.which("ffprobe") is None:
+        raise RuntimeError(f"Cannot decode {path}: not supported by libsndfile and ffprobe/ffmpeg is not installed")
+    out = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "a:0",
+         "-show_entries", "stream=channels,sample_rate,duration", "-of", "default=noprint_wrappers=1", str(path)],
+        capture_output=True, text=True, check=True
+    ).stdout
+    fields = dict(line.split("=", 1) for line in out.strip().splitlines() if "=" in line)
+    samplerate = int(fields["sample_rate"])
+    channels = int(fields["channels"])
+    try:
+        num_frames = int(float(fields.get("duration", "N/A")) * samplerate)
+    except ValueError:
+        num_frames = None # webm/opus often has no duration in the stream header
+    return num_frames, channels, samplerate
+
+
+def ffmpeg_blocks(path: Union[str, Path], blocksize: int, channels: int, samplerate: int) -> Iterator[np.ndarray]:
+    """Decode a file with an ffmpeg subprocess, yielding float32 blocks as they are decoded."""
+    proc = subprocess.Popen(
+        ["ffmpeg", "-v", "error", "-nostdin", "-i", str(path),
+         "-f", "f32le", "-acodec", "pcm_f32le", "-ac", str(channels), "-ar", str(samplerate), "-"],
+        stdout=subprocess.PIPE
+    )
+    blockbytes = blocksize * channels * 4
+    try:
+        while True:
+            data = proc.stdout.read(blockbytes)
+            if not data:
+                break
+            data = data[:len(data) - (len(data) % (channels * 4))]
+            yield np.frombuffer(data, dtype=np.float32).reshape(-1, channels)
+    finally:
+        proc.stdout.close()
+        proc.kill()
+        proc.wait()
+
+
+def load(path: Union[str, Path], samplerate: int = None, mono: bool = True) -> Tuple[np.ndarray, int]:
+    """Drop-in for librosa.load(path, sr=samplerate) without decoding through audioread."""
+    reader = AudioReader(path, samplerate=samplerate, mono=mono)
+    return reader.read(), reader.samplerate
+
+
+def play_stream(reader: AudioReader, device=None, blocksize: int = DEFAULT_BLOCKSIZE, prebuffer: int = 4) -> None:
+    """
+    Play an AudioReader on a sounddevice output, starting as soon as `prebuffer` blocks
+    have been decoded. Decoding continues in a background thread while playing.
+    """
+    import sounddevice as sd
+
+    blocks = queue.Queue(maxsize=prebuffer * 4)
+    finished = threading.Event()
+    started = threading.Event()
+
+    failure = []
+
+    def decode():
+        try:
+            for num, block in enumerate(reader.blocks(blocksize)):
+                blocks.put(block)
+                if num + 1 == prebuffer:
+                    started.set()
+        except Exception as e:
+            failure.append(e)
+        finally:
+            blocks.put(None) # the stream always ends
+            started.set()
+
+    pending = np.zeros((0, reader.channels), dtype=np.float32)
+
+    def callback(outdata, frames, time, status):
+        nonlocal pending
+        if status:
+            print(status, file=sys.stderr)
+        while len(pending) < frames:
+            try:
+                block = blocks.get_nowait()
+            except queue.Empty:
+                break # decoder fell behind: output silence for the rest of this buffer
+            if block is None:
+                outdata[:len(pending)] = pending
+                outdata[len(pending):] = 0
+                pending = pending[:0]
+                raise sd.CallbackStop()
+            pending = np.concatenate((pending, block))
+        num = min(frames, len(pending))
+        outdata[:num] = pending[:num]
+        outdata[num:] = 0
+        pending = pending[num:]
+
+    decoder = threading.Thread(target=decode, daemon=True)
+    decoder.start()
+    started.wait()
+    if failure and blocks.qsize() <= 1: # nothing but the end marker: do not open the device at all
+        raise failure[0]
+
+    with sd.OutputStream(samplerate=reader.samplerate, channels=reader.channels, dtype="float32",
+            device=device, callback=callback, finished_callback=finished.set):
+        finished.wait()
+    decoder.join()
+    if failure:
+        raise failure[0] # decoding failed part way, after playing what was decoded
+
+
+if __name__ == '__main__':
+    import argparse
+
+    def int_or_str(text):
+        """Helper function for argument parsing."""
+        try:
+            return int(text)
+        except ValueError:
+            return text
+
+    parser = argparse.ArgumentParser(description="Stream an audio file to an output device.")
+    parser.add_argument("--wav", type=Path, required=True, help="Path to audio file to play (wav, flac, webm...)")
+    parser.add_argument("-d", "--output-device", type=int_or_str, help="Output audio device (numeric ID or substring)")
+    parser.add_argument("-r", "--samplerate", type=int, default=None, help="Resample to this rate (default: device rate)")
+    args = parser.parse_args()
+
+    import sounddevice as sd
+    dev_info = sd.query_devices(args.output_device, kind="output")
+    samplerate = args.samplerate if args.samplerate else int(dev_info["default_samplerate"])
+    reader = AudioReader(args.wav, samplerate=samplerate)
+    print(f"Streaming {args.wav} ({reader.backend}, {reader.file_samplerate} Hz -> {samplerate} Hz) on device: {dev_info['name']}")
+    play_stream(reader, device=args.output_device)
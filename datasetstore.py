@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Dataset manifest store for collected recordings.
+
+Every clip that ends up in a dataset is recorded once in an append-only
+SQLite manifest (clip path, prompt, speaker, duration, hash), so metadata
+never has to be rebuilt by globbing directories. Lookups by speaker and
+prompt go through indexes, and the manifest can be exported directly to
+the metadata formats understood by the Coqui TTS dataset formatters.
+
+python datasetstore.py --dataset-path datasets/mydataset add clip.wav --speaker effi --prompt "Hello world"
+python datasetstore.py --dataset-path datasets/mydataset export --format ljspeech --output exports/mydataset
+"""
+import os
+import sys
+import csv
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import List, Dict, Iterator, Tuple, Union
+
+import soundfile
+
+MANIFEST_FILENAME = "manifest.sqlite"
+EXPORT_FORMATS = ("ljspeech", "coqui", "vctk")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clips (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    speaker TEXT NOT NULL,
+    duration REAL NOT NULL,
+    sample_rate INTEGER NOT NULL,
+    sha1 TEXT NOT NULL UNIQUE,
+    added REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS clips_speaker ON clips (speaker);
+CREATE INDEX IF NOT EXISTS clips_prompt ON clips (prompt);
+CREATE INDEX IF NOT EXISTS clips_speaker_prompt ON clips (speaker, prompt);
+"""
+
+CLIP_FIELDS = ("id", "path", "prompt", "speaker", "duration", "sample_rate", "sha1", "added")
+
+
+def clean_prompt(prompt: str) -> str:
+    """
+    Prompt text as stored in the manifest: whitespace (including newlines) collapsed.
+    Raises ValueError for prompts containing '|', the field separator of the exported metadata.
+    """
+    prompt = " ".join(prompt.split())
+    if "|" in prompt:
+        raise ValueError(f"Prompts cannot contain '|': {prompt}")
+    return prompt
+
+
+def file_sha1(path: Union[str, Path], blocksize: int = 1 << 20) -> str:
+    """Hash a file in fixed size blocks, so large clips are never read into memory at once."""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class DatasetStore:
+    """
+    Append-only manifest of the clips in a dataset directory.
+
+    Clip paths are stored relative to the dataset root so the whole directory
+    can be moved between machines. Rows are never updated or deleted, a clip
+    whose hash is already in the manifest is simply not added a second time.
+    """
+    def __init__(self, dataset_path: Union[str, Path]) -> None:
+        self.root = Path(dataset_path).resolve()
+        if not self.root.exists():
+            os.makedirs(self.root)
+
+        self.manifest_path = self.root / MANIFEST_FILENAME
+        self._lock = threading.Lock() # sqlite connection is shared between Flask worker threads
+        self._store_lock = threading.Lock() # one store_clip() at a time, clip names are assigned in order
+        self.db = sqlite3.connect(str(self.manifest_path), check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    def close(self) -> None:
+        self.db.close()
+
+    def relpath(self, path: Union[str, Path]) -> str:
+        """Path of a clip relative to the dataset root (absolute if the clip lives elsewhere)."""
+        path = Path(path).resolve()
+        try:
+            return str(path.relative_to(self.root))
+        except ValueError:
+            return str(path)
+
+    def abspath(self, path: str) -> Path:
+        return self.root / path
+
+    def add_clip(self, path: Union[str, Path], prompt: str, speaker: str) -> Dict:
+        """
+        Record a single clip in the manifest.
+        Returns the manifest row for the clip (the existing row if the clip was already recorded).
+        """
+        return self.insert_clip(path, clean_prompt(prompt), speaker, file_sha1(path), soundfile.info(str(path)))
+
+    def insert_clip(self, path: Union[str, Path], prompt: str, speaker: str, sha1: str, info) -> Dict:
+        """Record a clip whose prompt is cleaned and whose hash and soundfile.info() are known."""
+        row = (self.relpath(path), prompt, speaker, info.duration, info.samplerate, sha1, time.time())
+        with self._lock:
+            self.db.execute(
+                "INSERT OR IGNORE INTO clips (path, prompt, speaker, duration, sample_rate, sha1, added) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", row
+            )
+            self.db.commit()
+            return dict(self.db.execute("SELECT * FROM clips WHERE sha1 = ?", (sha1,)).fetchone())
+
+    def add_clips(self, clips: List[tuple]) -> int:
+        """
+        Bulk-record (path, prompt, speaker) tuples in a single transaction.
+        Returns the number of new clips added to the manifest.
+        """
+        rows = []
+        for path, prompt, speaker in clips:
+            info = soundfile.info(str(path))
+            rows.append((self.relpath(path), clean_prompt(prompt), speaker, info.duration, info.samplerate, file_sha1(path), time.time()))
+
+        with self._lock:
+            before = self.db.total_changes
+            self.db.executemany(
+                "INSERT OR IGNORE INTO clips (path, prompt, speaker, duration, sample_rate, sha1, added) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self.db.commit()
+            return self.db.total_changes - before
+
+    def store_clip(self, upload_path: Union[str, Path], prompt: str, speaker: str) -> Tuple[Dict, bool]:
+        """
+        Move an uploaded file into the dataset as wavs/<speaker>/<speaker>_<num>.wav and record it.
+        A file whose hash is already in the manifest is deleted instead of stored twice.
+        The upload is always consumed: on an error (ValueError for a bad prompt or a file that
+        is not audio) it is deleted, wherever it is by then.
+        Returns (manifest row, True if the clip is new).
+        """
+        path = Path(upload_path)
+        try:
+            prompt = clean_prompt(prompt) # reject before anything is moved
+            try:
+                info = soundfile.info(str(path))
+            except RuntimeError as e: # libsndfile cannot read it
+                raise ValueError(f"Not an audio file: {e}")
+            sha1 = file_sha1(path)
+            with self._store_lock:
+                with self._lock:
+                    existing = self.db.execute("SELECT * FROM clips WHERE sha1 = ?", (sha1,)).fetchone()
+                if existing is not None:
+                    os.remove(path)
+                    return dict(existing), False
+                clipdir = self.root / "wavs" / speaker
+                os.makedirs(clipdir, exist_ok=True)
+                num = self.count(speaker) + 1
+                while (clipdir / f"{speaker}_{num:06d}.wav").exists(): # files not (yet) in the manifest
+                    num += 1
+                savepath = clipdir / f"{speaker}_{num:06d}.wav"
+                os.replace(path, savepath)
+                path = savepath
+                return self.insert_clip(savepath, prompt, speaker, sha1, info), True
+        except Exception:
+            if path.exists():
+                os.remove(path)
+            raise
+
+    def has_hash(self, sha1: str) -> bool:
+        with self._lock:
+            return self.db.execute("SELECT 1 FROM clips WHERE sha1 = ?", (sha1,)).fetchone() is not None
+
+    def count(self, speaker: str = None) -> int:
+        with self._lock:
+            if speaker is None:
+                return self.db.execute("SELECT COUNT(*) FROM clips").fetchone()[0]
+            return self.db.execute("SELECT COUNT(*) FROM clips WHERE speaker = ?", (speaker,)).fetchone()[0]
+
+    def next_clip_name(self, speaker: str) -> str:
+        """Clip name based on the enumeration of the speaker's existing clips, e.g. effi_000042"""
+        return f"{speaker}_{self.count(speaker) + 1:06d}"
+
+    def query(self, speaker: str = None, prompt: str = None) -> Iterator[Dict]:
+        """Iterate manifest rows, optionally filtered by speaker and/or exact prompt text (both indexed)."""
+        sql = "SELECT * FROM clips"
+        where, params = [], []
+        if speaker is not None:
+            where.append("speaker = ?")
+            params.append(speaker)
+        if prompt is not None:
+            where.append("prompt = ?")
+            params.append(" ".join(prompt.split()))
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id"
+
+        with self._lock:
+            rows = self.db.execute(sql, params).fetchall()
+        for row in rows:
+            yield dict(row)
+
+    def speakers(self) -> Dict[str, int]:
+        """Number of clips per speaker."""
+        with self._lock:
+            rows = self.db.execute("SELECT speaker, COUNT(*) FROM clips GROUP BY speaker ORDER BY speaker").fetchall()
+        return {speaker: num for speaker, num in rows}
+
+    def prompt_counts(self) -> Dict[str, int]:
+        """Number of clips recorded per prompt, across all speakers."""
+        with self._lock:
+            rows = self.db.execute("SELECT prompt, COUNT(*) FROM clips GROUP BY prompt").fetchall()
+        return {prompt: num for prompt, num in rows}
+
+    def export(self, output_path: Union[str, Path], format: str = "ljspeech",
+        speaker: str = None, copy_audio: bool = False) -> Path:
+        """
+        Export the manifest as Coqui TTS training metadata.
+
+            output_path     Directory to write the export to
+            format          ljspeech: wavs/ + metadata.csv (id|text|text), single speaker
+                            coqui: metadata.csv (audio_file|text|speaker_name) with header
+                            vctk: txt/<speaker>/<id>.txt + wav48/<speaker>/<id>.wav
+            speaker         Only export clips of this speaker
+            copy_audio      Copy the audio files instead of symlinking them
+
+        Returns the path of the export directory.
+        """
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format '{format}', use one of {EXPORT_FORMATS}")
+
+        output_path = Path(output_path).resolve()
+        if not output_path.exists():
+            os.makedirs(output_path)
+
+        link = shutil.copyfile if copy_audio else os.symlink
+        made_dirs = set()
+
+        def ensure_dir(path: Path):
+            if path not in made_dirs:
+                os.makedirs(path, exist_ok=True)
+                made_dirs.add(path)
+
+        def place(src: Path, dst: Path):
+            ensure_dir(dst.parent)
+            if dst.exists() or dst.is_symlink():
+                dst.unlink()
+            link(str(src), str(dst))
+
+        clips = self.query(speaker=speaker)
+        if format == "ljspeech":
+            with open(output_path / "metadata.csv", "w", encoding="utf-8", newline="") as f:
+                writer = csv.writer(f, delimiter="|", quoting=csv.QUOTE_NONE, escapechar="\\", lineterminator="\n")
+                for clip in clips:
+                    clip_id = f"{clip['speaker']}_{clip['id']:06d}"
+                    place(self.abspath(clip["path"]), output_path / "wavs" / f"{clip_id}.wav")
+                    writer.writerow([clip_id, clip["prompt"], clip["prompt"]])
+
+        elif format == "coqui":
+            with open(output_path / "metadata.csv", "w", encoding="utf-8", newline="") as f:
+                writer = csv.writer(f, delimiter="|", quoting=csv.QUOTE_NONE, escapechar="\\")
+                writer.writerow(["audio_file", "text", "speaker_name"])
+                for clip in clips:
+                    audio_file = os.path.join("wavs", f"{clip['speaker']}_{clip['id']:06d}.wav")
+                    place(self.abspath(clip["path"]), output_path / audio_file)
+                    writer.writerow([audio_file, clip["prompt"], clip["speaker"]])
+
+        elif format == "vctk":
+            for clip in clips:
+                clip_id = f"{clip['speaker']}_{clip['id']:06d}"
+                place(self.abspath(clip["path"]), output_path / "wav48" / clip["speaker"] / f"{clip_id}.wav")
+                ensure_dir(output_path / "txt" / clip["speaker"])
+                with open(output_path / "txt" / clip["speaker"] / f"{clip_id}.txt", "w", encoding="utf-8") as f:
+                    f.write(clip["prompt"] + "\n")
+
+        return output_path
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Dataset manifest store for collected recordings.")
+    parser.add_argument("--dataset-path", type=Path, required=True, help="Dataset root directory (holds manifest.sqlite)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    add_parser = subparsers.add_parser("add", help="Add a clip to the manifest")
+    add_parser.add_argument("clip", type=Path)
+    add_parser.add_argument("--speaker", type=str, required=True)
+    add_parser.add_argument("--prompt", type=str, required=True)
+
+    import_parser = subparsers.add_parser("import", help="One-time import of a directory of <name>.wav + <name>.txt prompt files")
+    import_parser.add_argument("directory", type=Path)
+    import_parser.add_argument("--speaker", type=str, required=True)
+
+    query_parser = subparsers.add_parser("query", help="List clips")
+    query_parser.add_argument("--speaker", type=str, default=None)
+    query_parser.add_argument("--prompt", type=str, default=None)
+
+    subparsers.add_parser("stats", help="Show number of clips per speaker")
+
+    export_parser = subparsers.add_parser("export", help="Export to Coqui TTS training metadata")
+    export_parser.add_argument("--format", type=str, default="ljspeech", help=f"One of: {' | '.join(EXPORT_FORMATS)}")
+    export_parser.add_argument("--output", "-o", type=Path, required=True)
+    export_parser.add_argument("--speaker", type=str, default=None)
+    export_parser.add_argument("--copy-audio", action="store_true", help="Copy audio files instead of symlinking")
+
+    args = parser.parse_args()
+    store = DatasetStore(args.dataset_path)
+
+    if args.command == "add":
+        print(store.add_clip(args.clip, args.prompt, args.speaker))
+
+    elif args.command == "import":
+        clips = []
+        for wavfile in sorted(args.directory.glob("*.wav")):
+            txtfile = wavfile.with_suffix(".txt")
+            if not txtfile.exists():
+                print(f"No prompt file for {wavfile}, skipping", file=sys.stderr)
+                continue
+            clips.append((wavfile, txtfile.read_text(encoding="utf-8"), args.speaker))
+        print(f"Added {store.add_clips(clips)} of {len(clips)} clips")
+
+    elif args.command == "query":
+        for clip in store.query(speaker=args.speaker, prompt=args.prompt):
+            print("\t".join(str(clip[field]) for field in CLIP_FIELDS))
+
+    elif args.command == "stats":
+        for speaker, num in store.speakers().items():
+            print(f"{speaker}\t{num}")
+        print(f"TOTAL\t{store.count()}")
+
+    elif args.command == "export":
+        start_time = time.time()
+        outdir = store.export(args.output, format=args.format, speaker=args.speaker, copy_audio=args.copy_audio)
+        print(f"Exported {args.format} dataset to {outdir} in {time.time() - start_time:.2f}s")
+
+    store.close()
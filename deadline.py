@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Deadline-aware synthesis with quality fallback.
+
+Every request gets a deadline. A cost model estimates how long synthesizing
+the text will take on each available path (audio duration from the text
+length, times the measured real-time factor of that path), and the best
+quality path that still meets the deadline is used:
+    full            the requested voice, full vocoder path
+    light           a lighter configured voice
+    griffin_lim     the requested voice with Griffin-Lim instead of its vocoder
+                    (only for models with a separate vocoder)
+    cached          the closest line already rendered (audio bank or a recent utterance)
+    late            nothing fits: the cheapest path, counted as a deadline miss
+Timely lower quality speech beats late perfect speech in a live show. Every
+choice, and every deadline miss, is counted in metrics().
+
+The deadline runs from the arrival of a request, so servers have to stamp it
+when it is received, not when synthesis starts: lines queued behind a backlog
+then have less time left and go to the cheaper tiers. `burst` checks that with
+a simulated synthesizer, a burst of lines arriving at once, stamped on arrival
+and synthesized one at a time like ShibbolethWSS does (exit code 1 if nothing
+degrades):
+
+python deadline.py burst --lines 8 --deadline 2.0
+"""
+import sys
+import json
+import time
+import difflib
+import logging
+import threading
+from collections import OrderedDict
+from logging import Logger
+from pathlib import Path
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Tuple, Union, List
+
+import numpy as np
+
+import audiobank
+import modelspec
+
+TIERS = ("full", "light", "griffin_lim", "cached", "late")
+
+
+class CostModel:
+    """
+    Synthesis time estimates per (model, path), learned from measured runs.
+        alpha               Weight of the newest measurement in the moving averages
+        rtf                 Real-time factor assumed before the first measurement
+        seconds_per_char    Audio duration per character assumed before the first measurement
+        overhead            Fixed time per request (text processing, writing the wav)
+    """
+    def __init__(self, alpha: float = 0.2, rtf: float = 0.5, seconds_per_char: float = 0.07, overhead: float = 0.05) -> None:
+        self.alpha = alpha
+        self.default_rtf = rtf
+        self.default_seconds_per_char = seconds_per_char
+        self.overhead = overhead
+        self.rtf = dict()
+        self.seconds_per_char = dict()
+        self.lock = threading.Lock()
+
+    def estimate(self, text: str, model_id: str, griffin_lim: bool = False) -> float:
+        """Estimated seconds to synthesize text."""
+        key = (model_id, griffin_lim)
+        audio_duration = len(text) * self.seconds_per_char.get(model_id, self.default_seconds_per_char)
+        return self.overhead + audio_duration * self.rtf.get(key, self.default_rtf)
+
+    def update(self, text: str, model_id: str, griffin_lim: bool, synthesis_time: float, audio_duration: float) -> None:
+        if audio_duration <= 0 or len(text) == 0:
+            return
+        key = (model_id, griffin_lim)
+        rtf = max(0.0, synthesis_time - self.overhead) / audio_duration
+        with self.lock:
+            self.rtf[key] = rtf if key not in self.rtf else (1 - self.alpha) * self.rtf[key] + self.alpha * rtf
+            spc = audio_duration / len(text)
+            old = self.seconds_per_char.get(model_id)
+            self.seconds_per_char[model_id] = spc if old is None else (1 - self.alpha) * old + self.alpha * spc
+
+
+class DeadlineSynth:
+    """
+    Wraps a VoiceSynth and picks a synthesis path per request to meet its deadline.
+        voice_synth         A VoiceSynth
+        light_model_id      A lighter loaded model to fall back to (optional)
+        near_match          Minimum similarity (0..1) of a cached line to stand in for the text
+        recent_size         Number of recently rendered utterances kept for near matches
+    """
+    def __init__(self, voice_synth, cost_model: CostModel = None, light_model_id: str = None,
+        near_match: float = 0.75, recent_size: int = 200, logger: Logger = None) -> None:
+        self.voice_synth = voice_synth
+        self.cost_model = cost_model if cost_model is not None else CostModel()
+        self.light_model_id = light_model_id
+        self.near_match = near_match
+        self.recent_size = recent_size
+        self.recent = OrderedDict() # (voice, text) -> (wav, sr)
+        self.log = logger if logger is not None else logging.getLogger("DeadlineSynth")
+        self.lock = threading.Lock()
+        self.counts = {tier: 0 for tier in TIERS}
+        self.requests = 0
+        self.deadline_misses = 0
+        self.lateness = [] # seconds past the deadline of late requests
+
+    def has_vocoder(self, model_id: str) -> bool:
+        """False for models that are not loaded yet (they are loaded on first use, by the synthesis)."""
+        model = self.voice_synth.tts.get(model_id)
+        return model is not None and getattr(model["tts"], "vocoder_model", None) is not None
+
+    def in_bank(self, text: str, voice: audiobank.Voice) -> bool:
+        bank = self.voice_synth.audio_bank
+        return bank is not None and audiobank.line_key(text, voice) in bank
+
+    def find_near_match(self, text: str, voice: audiobank.Voice) -> Union[Tuple[np.ndarray, int, float], None]:
+        """Closest already rendered line for this voice: (wav, sr, similarity), or None below the threshold."""
+        best = None
+        with self.lock: # other synthesis threads insert into and evict from self.recent
+            recent = {t: rendered for (v, t), rendered in self.recent.items() if v == voice}
+        candidates = [(t, None) for t in recent]
+        bank = self.voice_synth.audio_bank
+        if bank is not None:
+            candidates += [(t, "bank") for v, t, _ in bank.lines() if v == audiobank.voice_id(voice)]
+        matcher = difflib.SequenceMatcher(a=text.lower(), autojunk=False)
+        for candidate, source in candidates:
+            matcher.set_seq2(candidate.lower())
+            if matcher.real_quick_ratio() < self.near_match or matcher.quick_ratio() < self.near_match:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= self.near_match and (best is None or ratio > best[2]):
+                best = (candidate, source, ratio)
+        if best is None:
+            return None
+        candidate, source, ratio = best
+        if source == "bank":
+            wav, sr = bank.lookup(candidate, voice)
+        else:
+            wav, sr = recent[candidate]
+        return wav, sr, ratio
+
+    def plan(self, text: str, voice: audiobank.Voice, remaining: float) -> Tuple[str, audiobank.Voice, bool]:
+        """Pick (tier, voice, griffin_lim) for a request with `remaining` seconds until its deadline."""
+        model_id = voice[0]
+        if self.in_bank(text, voice):
+            return "full", voice, False
+        options = [("full", voice, False)]
+        if self.light_model_id is not None and self.light_model_id != model_id:
+            options.append(("light", (self.light_model_id, None, None), False))
+        if self.has_vocoder(model_id):
+            options.append(("griffin_lim", voice, True))
+        for tier, option_voice, griffin_lim in options:
+            if self.cost_model.estimate(text, option_voice[0], griffin_lim) <= remaining:
+                return tier, option_voice, griffin_lim
+        if self.find_near_match(text, voice) is not None:
+            return "cached", voice, False
+        cheapest = min(options, key=lambda o: self.cost_model.estimate(text, o[1][0], o[2]))
+        return "late", cheapest[1], cheapest[2]
+
+    def synthesize(self, text: str, filename: str, model_id: str, deadline: float,
+        speaker_name: str = None, language_name: str = None, **kwargs):
+        """
+        Like VoiceSynth.synthesize(), for a request that has to be spoken by `deadline` (a time.time() value).
+        Returns (wav, sr, savepath, tier).
+        """
+        start_time = time.time()
+        voice = (model_id, speaker_name, language_name)
+        tier, use_voice, griffin_lim = self.plan(text, voice, deadline - start_time)
+
+        if tier == "cached":
+            wav, sr, ratio = self.find_near_match(text, voice)
+            self.log.info(f"Deadline: speaking a cached near match ({ratio:.2f}) for >{text}<")
+            savepath = None
+        else:
+            if tier != "full":
+                self.log.info(f"Deadline: {deadline - start_time:.2f}s left, degrading to '{tier}' for >{text}<")
+            use_model, speaker_name, language_name = use_voice
+            wav, sr, savepath = self.voice_synth.synthesize(text, filename, use_model,
+                speaker_name=speaker_name, language_name=language_name, griffin_lim=griffin_lim, **kwargs)
+            if not self.in_bank(text, use_voice):
+                self.cost_model.update(text, use_model, griffin_lim, time.time() - start_time, len(wav) / sr)
+            with self.lock:
+                self.recent[(use_voice, text)] = (wav, sr)
+                self.recent.move_to_end((use_voice, text))
+                while len(self.recent) > self.recent_size:
+                    self.recent.popitem(last=False)
+
+        finished = time.time()
+        with self.lock:
+            self.requests += 1
+            self.counts[tier] += 1
+            if finished > deadline:
+                self.deadline_misses += 1
+                self.lateness.append(finished - deadline)
+        return wav, sr, savepath, tier
+
+    def metrics(self) -> Dict:
+        with self.lock:
+            metrics = {
+                "requests": self.requests,
+                "tiers": dict(self.counts),
+                "degraded": self.requests - self.counts["full"],
+                "deadline_misses": self.deadline_misses,
+                "lateness_p95": float(np.percentile(self.lateness, 95)) if len(self.lateness) > 0 else 0.0,
+                "rtf": {f"{m}{'+gl' if gl else ''}": rtf for (m, gl), rtf in self.cost_model.rtf.items()},
+            }
+        return metrics
+
+
+def add_deadline_args(parser) -> None:
+    """Deadline command line options shared by the entry points."""
+    parser.add_argument("--deadline", type=float, default=None, help="Seconds from receiving text until it should be spoken; degrade quality to meet it")
+    parser.add_argument("--light-model-path", type=str, default=None, help="Lighter TTS model directory to fall back to under --deadline")
+    parser.add_argument("--near-match", type=float, default=0.75, help="Similarity (0..1) for a cached line to stand in under --deadline")
+
+
+def from_args(args, voice_synth, logger: Logger = None) -> Union[DeadlineSynth, None]:
+    """
+    A DeadlineSynth for voice_synth if --deadline was given. The --light-model-path model
+    directory is loaded into voice_synth as "light".
+    """
+    if args.deadline is None:
+        return None
+    light_model_id = None
+    if args.light_model_path is not None:
+        voice_synth.load_specs([modelspec.ModelSpec.from_model_dir("light", Path(args.light_model_path).resolve())])
+        light_model_id = "light"
+    return DeadlineSynth(voice_synth, light_model_id=light_model_id, near_match=args.near_match, logger=logger)
+
+
+class SimulatedSynth:
+    """
+    Stands in for a VoiceSynth in burst(): sleeps rtf * audio duration (estimated from the text length)
+    and returns silence. Models "full" (with a vocoder, so Griffin-Lim is an option) and "light".
+        rtfs        Real-time factor per model, and of "griffin_lim"
+    """
+    def __init__(self, rtfs: Dict[str, float] = None, seconds_per_char: float = 0.07, sr: int = 22050) -> None:
+        self.rtfs = rtfs if rtfs is not None else {"full": 0.4, "light": 0.15, "griffin_lim": 0.08}
+        self.seconds_per_char = seconds_per_char
+        self.sr = sr
+        self.tts = {
+            "full": {"tts": SimpleNamespace(vocoder_model=object())},
+            "light": {"tts": SimpleNamespace(vocoder_model=None)},
+        }
+        self.audio_bank = None
+
+    def synthesize(self, text: str, filename: str, model_id: str, speaker_name: str = None, language_name: str = None,
+        griffin_lim: bool = False, **kwargs):
+        duration = len(text) * self.seconds_per_char
+        time.sleep(duration * self.rtfs["griffin_lim" if griffin_lim else model_id])
+        return np.zeros(int(duration * self.sr), dtype=np.float32), self.sr, None
+
+
+def burst(lines: List[str], deadline: float, rtfs: Dict[str, float] = None) -> Dict:
+    """
+    Lines arriving at the same moment, each stamped on arrival and synthesized in order on one
+    thread with a SimulatedSynth. Returns the tier of every line and the DeadlineSynth metrics.
+    """
+    simulated = SimulatedSynth(rtfs)
+    cost_model = CostModel()
+    for model_id, griffin_lim in (("full", False), ("light", False), ("full", True)): # measured, like a warmed up server
+        start_time = time.time()
+        wav, sr, _ = simulated.synthesize(lines[0], "warmup.wav", model_id, griffin_lim=griffin_lim)
+        cost_model.update(lines[0], model_id, griffin_lim, time.time() - start_time, len(wav) / sr)
+    synth = DeadlineSynth(simulated, cost_model=cost_model, light_model_id="light")
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        futures = []
+        for idx, text in enumerate(lines):
+            received = time.time()
+            futures.append(pool.submit(synth.synthesize, text, f"burst{idx}.wav", "full", received + deadline))
+        tiers = [future.result()[3] for future in futures]
+    return {"tiers": tiers, "metrics": synth.metrics()}
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Deadline-aware synthesis checks.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    burst_parser = subparsers.add_parser("burst", help="A burst of queued lines has to move to the cheaper tiers")
+    burst_parser.add_argument("--lines", type=int, default=8, help="Lines in the burst")
+    burst_parser.add_argument("--deadline", type=float, default=2.0, help="Seconds from arrival until a line should be spoken")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    corpus = [
+        "Please say the words as I repeat them.",
+        "Shibboleths have been used as passwords.",
+        "Simple ways of self-identification.",
+        "Please say the words as I repeat them!",
+    ]
+    result = burst([corpus[idx % len(corpus)] for idx in range(args.lines)], args.deadline)
+    print(json.dumps(result, indent=2))
+    ok = result["tiers"][0] == "full" and any(tier != "full" for tier in result["tiers"][1:])
+    print("ok: the backlog degraded" if ok else "FAIL: the first line should be full quality and the backlog degraded")
+    sys.exit(0 if ok else 1)
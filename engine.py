@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+"""
+Headless speech loop engine: Vosk/Kaldi recognition -> VoiceSynth -> audio sink.
+
+This is the same recognize-and-speak loop as shibboleth-tkinter.py, without
+the GUI, so it can run (and be profiled / soak-tested) on a server or in CI.
+
+Audio sources yield (16 bit mono PCM block, capture time) tuples:
+    MicrophoneSource    a sounddevice input stream, through a PCMRingBuffer
+    WavFileSource       any file audioio can read, optionally paced in real time and looped
+    PcmPipeSource       raw 16 bit mono PCM from a pipe (e.g. stdin)
+
+Audio sinks receive every synthesized utterance:
+    DeviceSink          play on a sounddevice output
+    FileSink            append all utterances to a single wav file
+    NullSink            discard (for profiling recognition + synthesis only)
+
+For every utterance the engine reports the end-to-end latency, from the moment
+the last block of the utterance was captured until its synthesized audio was
+handed to the sink.
+"""
+import sys
+import json
+import time
+import queue
+import logging
+import threading
+from logging import Logger
+from pathlib import Path
+from typing import Iterator, List, Dict, Union, BinaryIO
+
+import numpy as np
+import soundfile
+
+import audioio
+import resources
+from ringbuffer import PCMRingBuffer, accept_waveform
+from vad import VoiceActivityGate, AUDIO, END
+
+STATS_FILE_LOCK = threading.Lock() # engines of a MultiStreamEngine append to the same stats file
+
+
+class MicrophoneSource:
+    """
+    Blocks from a sounddevice input stream, through a preallocated ring buffer.
+    Each block is timestamped when the PortAudio callback delivers it.
+    """
+    def __init__(self, device=None, samplerate: int = None, blocksize: int = None, buffer_seconds: float = 5.0) -> None:
+        import sounddevice as sd
+        self.sd = sd
+        self.device_info = sd.query_devices(device=device, kind="input")
+        self.samplerate = samplerate if samplerate else int(self.device_info["default_samplerate"])
+        self.blocksize = blocksize if blocksize else int(self.samplerate / 4) # 1/4 second
+        self.ring = PCMRingBuffer.for_stream(self.samplerate, self.blocksize, seconds=buffer_seconds)
+        self.running = True
+
+    def blocks(self) -> Iterator[tuple]:
+        with self.sd.RawInputStream(
+            samplerate=self.samplerate,
+            blocksize=self.blocksize,
+            device=self.device_info["name"],
+            dtype="int16",
+            channels=1,
+            callback=self.callback):
+            while self.running:
+                block = self.ring.read(timeout=0.5)
+                if block is not None:
+                    yield block
+
+    def callback(self, indata, frames, time_info, status) -> None:
+        resources.pin_audio_callback()
+        self.ring.callback(indata, frames, time_info, status)
+
+    def stats(self) -> Dict:
+        return self.ring.stats()
+
+    def close(self) -> None:
+        self.running = False
+
+
+class MultiChannelMicrophoneSource:
+    """
+    One multi-channel sounddevice input stream, split into a ChannelSource per channel
+    (e.g. one performer per microphone on a multi-input interface).
+    The callback copies every channel straight into its own ring buffer.
+    """
+    def __init__(self, device=None, channels: int = 2, samplerate: int = None, blocksize: int = None,
+        buffer_seconds: float = 5.0) -> None:
+        import sounddevice as sd
+        self.sd = sd
+        self.device_info = sd.query_devices(device=device, kind="input")
+        self.channels = channels
+        self.samplerate = samplerate if samplerate else int(self.device_info["default_samplerate"])
+        self.blocksize = blocksize if blocksize else int(self.samplerate / 4) # 1/4 second
+        self.rings = [PCMRingBuffer.for_stream(self.samplerate, self.blocksize, seconds=buffer_seconds) for _ in range(channels)]
+        self.sources = [ChannelSource(self, ring) for ring in self.rings]
+        self.stream = None
+        self.open_sources = channels
+        self.lock = threading.Lock()
+
+    def callback(self, indata, frames, time_info, status):
+        """This is called (from a separate thread) for each audio block."""
+        resources.pin_audio_callback()
+        if status:
+            print(status, file=sys.stderr)
+        timestamp = time.time()
+        samples = np.frombuffer(indata, dtype=np.int16).reshape(-1, self.channels)
+        for channel, ring in enumerate(self.rings):
+            ring.write_samples(samples[:, channel], timestamp)
+
+    def start(self) -> None:
+        with self.lock:
+            if self.stream is None:
+                self.stream = self.sd.RawInputStream(
+                    samplerate=self.samplerate,
+                    blocksize=self.blocksize,
+                    device=self.device_info["name"],
+                    dtype="int16",
+                    channels=self.channels,
+                    callback=self.callback)
+                self.stream.start()
+
+    def release(self) -> None:
+        """Called by each ChannelSource when it closes, the stream stops when the last one is gone."""
+        with self.lock:
+            self.open_sources -= 1
+            if self.open_sources == 0 and self.stream is not None:
+                self.stream.close()
+                self.stream = None
+
+
+class ChannelSource:
+    """A single channel of a MultiChannelMicrophoneSource."""
+    def __init__(self, parent: MultiChannelMicrophoneSource, ring: PCMRingBuffer) -> None:
+        self.parent = parent
+        self.ring = ring
+        self.samplerate = parent.samplerate
+        self.blocksize = parent.blocksize
+        self.running = True
+
+    def blocks(self) -> Iterator[tuple]:
+        self.parent.start()
+        while self.running:
+            block = self.ring.read(timeout=0.5)
+            if block is not None:
+                yield block
+
+    def stats(self) -> Dict:
+        return self.ring.stats()
+
+    def close(self) -> None:
+        if self.running:
+            self.running = False
+            self.parent.release()
+
+
+class WavFileSource:
+    """
+    Blocks from an audio file.
+        realtime    Pace the blocks at the rate they would arrive from a microphone
+        loop        Start again at the beginning of the file when it ends (soak tests)
+    """
+    def __init__(self, path: Union[str, Path], samplerate: int = 16000, blocksize: int = None,
+        realtime: bool = False, loop: bool = False) -> None:
+        self.path = Path(path)
+        self.samplerate = samplerate
+        self.blocksize = blocksize if blocksize else int(self.samplerate / 4)
+        self.realtime = realtime
+        self.loop = loop
+        self.running = True
+
+    def blocks(self) -> Iterator[tuple]:
+        block_duration = self.blocksize / self.samplerate
+        next_time = time.time()
+        while self.running:
+            reader = audioio.AudioReader(self.path, samplerate=self.samplerate, mono=True)
+            for block in reader.blocks(self.blocksize):
+                if not self.running:
+                    return
+                if self.realtime:
+                    next_time += block_duration
+                    delay = next_time - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                pcm = (np.clip(block[:, 0], -1.0, 1.0) * 32767).astype(np.int16)
+                yield pcm.tobytes(), time.time()
+            if not self.loop:
+                return
+            # a bit of silence between repeats, so the last utterance gets finalized
+            yield bytes(self.blocksize * 2), time.time()
+
+    def close(self) -> None:
+        self.running = False
+
+
+class PcmPipeSource:
+    """Blocks of raw 16 bit mono PCM read from a binary stream (stdin by default)."""
+    def __init__(self, stream: BinaryIO = None, samplerate: int = 16000, blocksize: int = None) -> None:
+        self.stream = stream if stream is not None else sys.stdin.buffer
+        self.samplerate = samplerate
+        self.blocksize = blocksize if blocksize else int(self.samplerate / 4)
+        self.running = True
+
+    def blocks(self) -> Iterator[tuple]:
+        nbytes = self.blocksize * 2
+        while self.running:
+            data = self.stream.read(nbytes)
+            if not data:
+                return
+            yield data[:len(data) - (len(data) % 2)], time.time()
+
+    def close(self) -> None:
+        self.running = False
+
+
+class DeviceSink:
+    """
+    Play utterances on a sounddevice output without blocking the engine.
+    Each sink has its own output stream and playback thread, so several
+    streams (see MultiStreamEngine) can speak at the same time.
+    """
+    def __init__(self, device=None) -> None:
+        import sounddevice as sd
+        self.sd = sd
+        self.device = device
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.playbackThread, daemon=True)
+        self.thread.start()
+
+    def playbackThread(self):
+        resources.pin_audio_callback() # the stream's host thread is created from this one
+        stream = None
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            wav, sr = item
+            if stream is None or stream.samplerate != sr:
+                if stream is not None:
+                    stream.close()
+                stream = self.sd.OutputStream(samplerate=sr, channels=1, dtype="float32", device=self.device)
+                stream.start()
+            stream.write(np.asarray(wav, dtype=np.float32).reshape(-1, 1))
+        if stream is not None:
+            stream.close()
+
+    def write(self, wav: np.ndarray, sr: int) -> None:
+        self.queue.put((wav, sr))
+
+    def close(self) -> None:
+        self.queue.put(None)
+        self.thread.join()
+
+
+class FileSink:
+    """Append every utterance to one wav file, with a short silence in between."""
+    def __init__(self, path: Union[str, Path], gap: float = 0.5) -> None:
+        self.path = Path(path)
+        self.gap = gap
+        self.file = None
+
+    def write(self, wav: np.ndarray, sr: int) -> None:
+        if self.file is None:
+            self.file = soundfile.SoundFile(str(self.path), mode="w", samplerate=sr, channels=1, subtype="PCM_16")
+        self.file.write(np.asarray(wav, dtype=np.float32))
+        self.file.write(np.zeros(int(self.gap * sr), dtype=np.float32))
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+
+
+class NullSink:
+    def write(self, wav: np.ndarray, sr: int) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class SpeechEngine:
+    """
+    Runs the recognize-and-speak loop over an audio source.
+
+        kaldi_recognizer    A vosk KaldiRecognizer created for the source's sample rate
+        voice_synth         A VoiceSynth with model_id loaded
+        sink                Where synthesized utterances go
+        stats_path          Optional CSV file to append per utterance latency stats to
+        vad                 Optional VoiceActivityGate: silent blocks are not recognized at all,
+                            and utterances are finalized on the gate's endpoint decision
+        name                Name of the stream, used in logs, stats and scratch file names
+        synth_lock          Lock shared by engines that share a VoiceSynth, so only one synthesizes at a time
+        deadline_synth      Optional deadline.DeadlineSynth wrapping voice_synth: utterances are spoken within
+                            `deadline` seconds of capture, at lower quality if need be
+    """
+    STATS_FIELDS = ("stream", "time", "text", "recognition_latency", "synthesis_time", "end_to_end_latency", "audio_duration", "rtf", "tier")
+
+    def __init__(self, kaldi_recognizer, voice_synth, sink, logger: Logger,
+        model_id: str = "vits", stats_path: Union[str, Path] = None, vad: VoiceActivityGate = None,
+        name: str = "headless", synth_lock: threading.Lock = None,
+        deadline_synth=None, deadline: float = None) -> None:
+        self.kaldi_recognizer = kaldi_recognizer
+        self.name = name
+        self.synth_lock = synth_lock if synth_lock is not None else threading.Lock()
+        self.vad = vad
+        self.voice_synth = voice_synth
+        self.deadline_synth = deadline_synth
+        self.deadline = deadline
+        self.model_id = model_id
+        self.sink = sink
+        self.log = logger
+        self.stats = [] # per utterance latency stats
+        self.stats_path = Path(stats_path) if stats_path is not None else None
+        self.filenum = 0
+        self.running = True
+
+        with STATS_FILE_LOCK:
+            if self.stats_path is not None and not self.stats_path.exists():
+                with open(self.stats_path, "w") as f:
+                    f.write(",".join(self.STATS_FIELDS) + "\n")
+
+    def run(self, source, max_duration: float = None) -> List[Dict]:
+        """Process the source until it ends, stop() is called or max_duration seconds have passed."""
+        start_time = time.time()
+        try:
+            for data, captured in source.blocks():
+                self.recognize(data, captured)
+                if not self.running:
+                    break
+                if max_duration is not None and time.time() - start_time > max_duration:
+                    self.log.info(f"Reached maximum run duration of {max_duration}s")
+                    break
+            else:
+                # source ended, flush whatever is left in the recognizer
+                txt = json.loads(self.kaldi_recognizer.FinalResult())['text']
+                self.speak(txt, time.time())
+        finally:
+            source.close()
+        return self.stats
+
+    def recognize(self, data, captured: float) -> None:
+        """Feed a block to the recognizer (through the VAD gate, if any) and speak finished utterances."""
+        if self.vad is None:
+            if accept_waveform(self.kaldi_recognizer, data):
+                self.speak(json.loads(self.kaldi_recognizer.Result())['text'], captured)
+            return
+
+        for action, audio in self.vad.process(data):
+            if action == AUDIO:
+                if accept_waveform(self.kaldi_recognizer, audio):
+                    self.speak(json.loads(self.kaldi_recognizer.Result())['text'], captured)
+            elif action == END:
+                self.speak(json.loads(self.kaldi_recognizer.FinalResult())['text'], captured)
+
+    def speak(self, txt: str, captured: float) -> Union[Dict, None]:
+        """Synthesize a recognized utterance and hand it to the sink. captured is the capture time of its last block."""
+        if len(txt) == 0:
+            return None
+
+        recognized = time.time()
+        filename = f"{self.name}{self.filenum % 100}.wav" # keep a small rolling set of files on long runs
+        self.filenum += 1
+        tier = "full"
+        with self.synth_lock:
+            if self.deadline_synth is not None:
+                # the deadline counts from capture, time spent waiting for the lock is part of it
+                wav, sr, outfile, tier = self.deadline_synth.synthesize(
+                    txt, filename, self.model_id, captured + self.deadline,
+                    speaker_name=None,
+                    language_name=None,
+                    clean_text=False,
+                    rewrite_words=None
+                )
+            else:
+                wav, sr, outfile = self.voice_synth.synthesize(
+                    txt, filename, self.model_id,
+                    speaker_name=None,
+                    language_name=None,
+                    clean_text=False,
+                    rewrite_words=None
+                )
+        synthesized = time.time()
+        self.sink.write(wav, sr)
+
+        audio_duration = len(wav) / sr
+        stat = {
+            "stream": self.name,
+            "time": recognized,
+            "text": txt,
+            "recognition_latency": recognized - captured,
+            "synthesis_time": synthesized - recognized,
+            "end_to_end_latency": time.time() - captured,
+            "audio_duration": audio_duration,
+            "rtf": (synthesized - recognized) / audio_duration if audio_duration > 0 else 0.0,
+            "tier": tier,
+        }
+        self.stats.append(stat)
+        self.log.info(
+            f"[{self.name}] Utterance {len(self.stats)}: '{txt}' end-to-end {stat['end_to_end_latency']:.3f}s "
+            f"(recognition {stat['recognition_latency']:.3f}s, synthesis {stat['synthesis_time']:.3f}s, rtf {stat['rtf']:.3f})"
+        )
+        if self.stats_path is not None:
+            with STATS_FILE_LOCK, open(self.stats_path, "a") as f:
+                f.write(",".join(json.dumps(stat[field]) for field in self.STATS_FIELDS) + "\n")
+        return stat
+
+    def stop(self) -> None:
+        self.running = False
+
+
+class MultiStreamEngine:
+    """
+    Recognize several input streams (microphones, channels, files) in one process.
+    All streams share one loaded vosk Model and one VoiceSynth, every stream gets its
+    own KaldiRecognizer and SpeechEngine, run on a thread pool (vosk releases the GIL
+    while decoding, so recognition of the streams runs in parallel).
+
+        vosk_model      The shared vosk Model
+        voice_synth     The shared VoiceSynth
+        make_sink       Called with the stream index, returns the sink for that stream
+        vad_options     If not None, every stream gets a VoiceActivityGate(samplerate, **vad_options)
+        deadline_synth  Optional deadline.DeadlineSynth shared by the streams, see SpeechEngine
+    """
+    def __init__(self, vosk_model, voice_synth, make_sink, logger: Logger, model_id: str = "vits",
+        stats_path: Union[str, Path] = None, vad_options: Dict = None,
+        deadline_synth=None, deadline: float = None) -> None:
+        self.vosk_model = vosk_model
+        self.voice_synth = voice_synth
+        self.make_sink = make_sink
+        self.log = logger
+        self.model_id = model_id
+        self.stats_path = stats_path
+        self.vad_options = vad_options
+        self.deadline_synth = deadline_synth
+        self.deadline = deadline
+        self.synth_lock = threading.Lock()
+        self.engines = []
+
+    def run(self, sources: List, max_duration: float = None) -> Dict[str, List[Dict]]:
+        """Run all sources until they end (or max_duration), returns the stats per stream."""
+        from vosk import KaldiRecognizer
+        from concurrent.futures import ThreadPoolExecutor
+
+        for idx, source in enumerate(sources):
+            kaldi_recognizer = KaldiRecognizer(self.vosk_model, source.samplerate)
+            kaldi_recognizer.SetWords(True)
+            gate = None
+            if self.vad_options is not None:
+                gate = VoiceActivityGate(source.samplerate, **self.vad_options)
+            self.engines.append(SpeechEngine(
+                kaldi_recognizer, self.voice_synth, self.make_sink(idx), self.log,
+                model_id=self.model_id, stats_path=self.stats_path, vad=gate,
+                name=f"stream{idx}", synth_lock=self.synth_lock,
+                deadline_synth=self.deadline_synth, deadline=self.deadline
+            ))
+
+        with ThreadPoolExecutor(max_workers=len(sources), thread_name_prefix="recognizer") as pool:
+            futures = [pool.submit(e.run, source, max_duration) for e, source in zip(self.engines, sources)]
+            try:
+                for future in futures:
+                    future.result()
+            finally:
+                self.stop()
+                for e in self.engines:
+                    e.sink.close()
+
+        return {e.name: e.stats for e in self.engines}
+
+    def stop(self) -> None:
+        for e in self.engines:
+            e.stop()
+
+
+def summarize(stats: List[Dict]) -> Dict:
+    """Latency percentiles over a run."""
+    if len(stats) == 0:
+        return {"utterances": 0}
+    latency = np.array([s["end_to_end_latency"] for s in stats])
+    rtf = np.array([s["rtf"] for s in stats])
+    return {
+        "utterances": len(stats),
+        "latency_mean": float(latency.mean()),
+        "latency_p50": float(np.percentile(latency, 50)),
+        "latency_p95": float(np.percentile(latency, 95)),
+        "latency_max": float(latency.max()),
+        "rtf_mean": float(rtf.mean()),
+    }
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Equivalence and speed gate for the forked synthesis code.
+
+VoiceSynth.pr_synthesize() is a copy of TTS.utils.synthesizer.Synthesizer.tts
+with our changes (fused mel renormalization, pipelined vocoder, ...), and
+windowed.vits_latents() a copy of the first half of Vits.inference(). Both
+have to be kept functionally equivalent with the TTS library in use. This
+script runs the library and the fork on the same text with the same random
+seed and fails (exit code 1) when
+    - the waveforms differ: different length, or a sample differs by more than --atol
+    - the fork is slower: median time of the fork > median time of the library * (1 + --speed-tolerance),
+      timed for at least --min-time seconds per path (real checkpoints only)
+
+Models with a separate vocoder are checked with and without the pipelined
+vocoder, and mel_bridge() against the denormalize/normalize round trip it
+replaces.
+
+Without a model it builds two tiny models with fixed random weights (seconds to
+run, no checkpoint needed), so it can run after every change to the fork, or
+after upgrading TTS:
+    tiny_vits       VITS, its own waveform decoder (vits_latents, windowed decoding)
+    tiny_vocoded    GlowTTS spectrogram model + HiFi-GAN vocoder, with a different sample rate
+                    and mel normalization than the GlowTTS model (mel_bridge, interpolation,
+                    pipelined_vocode)
+Their timings are printed but not gated, the tiny models run in milliseconds and
+their timings are mostly noise.
+
+python equivalence.py
+python equivalence.py --model-path ../outputs/checkpoints/efam48_220k/ --repeat 10
+python equivalence.py --models models.json --history equivalence-history.csv --label $(git rev-parse --short HEAD)
+"""
+import os
+import sys
+import csv
+import json
+import time
+import random
+import logging
+import tempfile
+from pathlib import Path
+from typing import List, Dict, Callable
+
+import numpy as np
+import torch
+
+import modelspec
+
+DEFAULT_TEXTS = [
+    "Please say the words as I repeat them.",
+    "Shibboleths have been used throughout history in many societies as passwords. "
+    "Simple ways of self-identification, signaling loyalty and affinity.",
+]
+HISTORY_FIELDS = ("time", "label", "model", "path", "text", "samples", "max_abs_difference", "snr_db",
+    "library_time", "fork_time", "relative_speed", "ok")
+
+
+def tiny_vits(model_dir: Path, name: str = "tiny", seed: int = 0) -> modelspec.ModelSpec:
+    """
+    Write a small VITS model with fixed random weights (and its config.json) to model_dir.
+    The audio is noise, but it exercises every code path of a real VITS model.
+    """
+    from TTS.tts.configs.vits_config import VitsConfig
+    from TTS.tts.models.vits import Vits, VitsArgs
+
+    model_args = VitsArgs(
+        hidden_channels=32,
+        hidden_channels_ffn_text_encoder=64,
+        num_heads_text_encoder=2,
+        num_layers_text_encoder=2,
+        num_layers_posterior_encoder=2,
+        num_layers_flow=2,
+        upsample_initial_channel_decoder=32,
+    )
+    config = VitsConfig(model_args=model_args, text_cleaner="basic_cleaners", use_phonemes=False)
+    torch.manual_seed(seed)
+    model = Vits.init_from_config(config) if hasattr(Vits, "init_from_config") else Vits(config) # TTS >= 0.7 / 0.6
+
+    os.makedirs(model_dir, exist_ok=True)
+    model_path = Path(model_dir) / "model_file.pth"
+    config_path = Path(model_dir) / "config.json"
+    torch.save({"model": model.state_dict(), "config": config.to_dict()}, model_path)
+    config.save_json(str(config_path))
+    return modelspec.ModelSpec(name, str(model_path), str(config_path))
+
+
+def tiny_vocoded(model_dir: Path, name: str = "tiny_vocoded", seed: int = 0) -> modelspec.ModelSpec:
+    """
+    Write a small GlowTTS spectrogram model and a small HiFi-GAN vocoder with fixed random weights
+    to model_dir. The vocoder's audio config deliberately differs from the GlowTTS model's (sample
+    rate, normalization range, reference level), so synthesis goes through mel_bridge() and the
+    vocoder input interpolation.
+    """
+    from TTS.config.shared_configs import BaseAudioConfig
+    from TTS.tts.configs.glow_tts_config import GlowTTSConfig
+    from TTS.tts.models import setup_model as setup_tts_model
+    from TTS.vocoder.configs import HifiganConfig
+    from TTS.vocoder.models import setup_model as setup_vocoder_model
+
+    tts_audio = BaseAudioConfig(sample_rate=22050, hop_length=256, win_length=1024, num_mels=80,
+        mel_fmin=0.0, mel_fmax=8000.0, signal_norm=True, symmetric_norm=True, max_norm=4.0, clip_norm=True,
+        ref_level_db=20, min_level_db=-100)
+    vocoder_audio = BaseAudioConfig(sample_rate=24000, hop_length=256, win_length=1024, num_mels=80,
+        mel_fmin=50.0, mel_fmax=12000.0, signal_norm=True, symmetric_norm=False, max_norm=1.0, clip_norm=True,
+        ref_level_db=25, min_level_db=-100)
+
+    tts_config = GlowTTSConfig(
+        audio=tts_audio,
+        hidden_channels_enc=32,
+        hidden_channels_dec=32,
+        hidden_channels_dp=32,
+        num_flow_blocks_dec=2,
+        num_block_layers=2,
+        encoder_params={"kernel_size": 3, "dropout_p": 0.1, "num_layers": 2, "num_heads": 2, "hidden_channels_ffn": 64},
+        text_cleaner="basic_cleaners",
+        use_phonemes=False,
+    )
+    vocoder_config = HifiganConfig(
+        audio=vocoder_audio,
+        generator_model_params={
+            "upsample_factors": [8, 8, 2, 2],
+            "upsample_kernel_sizes": [16, 16, 4, 4],
+            "upsample_initial_channel": 32,
+            "resblock_kernel_sizes": [3, 7, 11],
+            "resblock_dilation_sizes": [[1, 3, 5], [1, 3, 5], [1, 3, 5]],
+            "resblock_type": "1",
+        },
+    )
+
+    os.makedirs(model_dir, exist_ok=True)
+    paths = {}
+    for kind, config, setup in (("tts", tts_config, setup_tts_model), ("vocoder", vocoder_config, setup_vocoder_model)):
+        torch.manual_seed(seed)
+        model = setup(config)
+        paths[kind] = (Path(model_dir) / f"{kind}_model_file.pth", Path(model_dir) / f"{kind}_config.json")
+        torch.save({"model": model.state_dict(), "config": config.to_dict()}, paths[kind][0])
+        config.save_json(str(paths[kind][1]))
+    return modelspec.ModelSpec(name, str(paths["tts"][0]), str(paths["tts"][1]),
+        vocoder_path=str(paths["vocoder"][0]), vocoder_config_path=str(paths["vocoder"][1]))
+
+
+def seeded(seed: int, fn: Callable, *args, **kwargs):
+    """fn(*args, **kwargs) with all random generators seeded (VITS samples noise while decoding)."""
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    return fn(*args, **kwargs)
+
+
+def difference(reference: np.ndarray, candidate: np.ndarray) -> Dict:
+    n = min(len(reference), len(candidate))
+    error = reference[:n] - candidate[:n]
+    noise = float(np.sum(error ** 2))
+    return {
+        "samples": len(reference),
+        "length_difference": len(candidate) - len(reference),
+        "max_abs_difference": float(np.max(np.abs(error))) if n > 0 else 0.0,
+        "snr_db": float("inf") if noise == 0 else float(10 * np.log10(np.sum(reference[:n] ** 2) / noise)),
+    }
+
+
+def check_synthesis(voice_synth, model_id: str, text: str, speaker_name: str = None, language_name: str = None,
+    seed: int = 0, repeat: int = 5, atol: float = 1e-4, speed_tolerance: float = 0.1, min_time: float = 2.0) -> Dict:
+    """
+    Synthesizer.tts() against VoiceSynth.pr_synthesize() on one text: waveform difference
+    and median wall time of at least `repeat` runs of each (alternating, after one untimed run).
+        speed_tolerance Allowed slowdown of the fork, None to only report the timings
+        min_time        Keep timing until each path ran this long in total (when the speed is gated)
+    """
+    synth = voice_synth.tts[model_id]["tts"]
+    library = lambda: np.asarray(synth.tts(text, speaker_name=speaker_name, language_name=language_name), dtype=np.float32)
+    fork = lambda: np.asarray(voice_synth.pr_synthesize(synth, text, speaker_name, language_name, None, None), dtype=np.float32)
+
+    result = difference(seeded(seed, library), seeded(seed, fork))
+    library_times = []
+    fork_times = []
+    min_time = min_time if speed_tolerance is not None else 0.0
+    while len(fork_times) < repeat or min(sum(library_times), sum(fork_times)) < min_time:
+        for fn, times in ((library, library_times), (fork, fork_times)):
+            start_time = time.perf_counter()
+            seeded(seed, fn)
+            times.append(time.perf_counter() - start_time)
+    result["library_time"] = float(np.median(library_times))
+    result["fork_time"] = float(np.median(fork_times))
+    result["relative_speed"] = result["fork_time"] / result["library_time"] if result["library_time"] > 0 else 1.0
+    result["runs"] = len(fork_times)
+    result["speed_gated"] = speed_tolerance is not None
+
+    result["failures"] = []
+    if result["length_difference"] != 0:
+        result["failures"].append(f"length differs by {result['length_difference']} samples")
+    if result["max_abs_difference"] > atol:
+        result["failures"].append(f"max abs difference {result['max_abs_difference']:.2e} > {atol:.0e}")
+    if speed_tolerance is not None and result["relative_speed"] > 1.0 + speed_tolerance:
+        result["failures"].append(f"fork takes {result['relative_speed']:.2f}x the library's time")
+    return result
+
+
+def check_bridge(voice_synth, model_id: str, seed: int = 0, frames: int = 200, atol: float = 1e-4) -> Dict:
+    """
+    voicesynth.mel_bridge() against the vocoder_ap.normalize(tts_ap.denormalize()) round trip
+    it replaces (models with a separate vocoder), on spectrogram values across and beyond the
+    tts model's range, so the clipping of both sides is covered. None if the bridge is not used.
+    """
+    from voicesynth import mel_bridge
+
+    synth = voice_synth.tts[model_id]["tts"]
+    tts_ap = synth.tts_model.ap
+    bridge = mel_bridge(tts_ap, synth.vocoder_ap)
+    if bridge is None:
+        return None
+    a, b, low, high = bridge
+    rng = np.random.RandomState(seed)
+    if tts_ap.signal_norm:
+        mel = rng.uniform(-1.5 * tts_ap.max_norm, 1.5 * tts_ap.max_norm, (frames, tts_ap.num_mels))
+    else:
+        mel = rng.uniform(1.5 * tts_ap.min_level_db, 0.0, (frames, tts_ap.num_mels))
+    mel = mel.astype(np.float32)
+
+    reference = synth.vocoder_ap.normalize(tts_ap.denormalize(mel.T))
+    fused = np.clip(mel.T * a + b, low, high)
+    result = difference(np.asarray(reference, dtype=np.float32).flatten(), np.asarray(fused, dtype=np.float32).flatten())
+    result["failures"] = []
+    if result["max_abs_difference"] > atol:
+        result["failures"].append(f"mel_bridge() differs from the denormalize/normalize round trip: {result['max_abs_difference']:.2e}")
+    return result
+
+
+def check_latents(voice_synth, model_id: str, text: str, speaker_name: str = None, seed: int = 0,
+    atol: float = 1e-4) -> Dict:
+    """
+    Vits.inference() against windowed.vits_latents() + the waveform decoder (VITS models only).
+    """
+    import windowed
+    from TTS.tts.utils.synthesis import embedding_to_torch, id_to_torch
+
+    synth = voice_synth.tts[model_id]["tts"]
+    model = synth.tts_model
+    speaker_id, d_vector = voice_synth.speaker_condition(synth, speaker_name, None)
+    speaker_id = id_to_torch(speaker_id, cuda=synth.use_cuda) if speaker_id is not None else None
+    d_vector = embedding_to_torch(d_vector, cuda=synth.use_cuda) if d_vector is not None else None
+    x = windowed.text_inputs(synth, text)
+
+    def library():
+        outputs = model.inference(x, aux_input={"speaker_ids": speaker_id, "d_vectors": d_vector, "language_ids": None})
+        return outputs["model_outputs"][0, 0].detach().cpu().numpy()
+
+    def fork():
+        latents = windowed.vits_latents(model, x, speaker_id, d_vector)
+        return model.waveform_decoder(latents["z"], g=latents["g"])[0, 0].detach().cpu().numpy()
+
+    with torch.no_grad():
+        result = difference(seeded(seed, library), seeded(seed, fork))
+    result["failures"] = []
+    if result["length_difference"] != 0 or result["max_abs_difference"] > atol:
+        result["failures"].append(f"vits_latents() differs from Vits.inference(): {result['max_abs_difference']:.2e}, "
+            f"{result['length_difference']} samples")
+    return result
+
+
+if __name__ == '__main__':
+    import argparse
+    from voicesynth import VoiceSynth
+
+    parser = argparse.ArgumentParser(description="Check the forked synthesis code against the TTS library: same audio, no slower.")
+    parser.add_argument("--model-path", type=Path, default=None, help="TTS model directory (default: tiny random models, see above)")
+    parser.add_argument("--models", type=Path, default=None, help="Model manifest (see modelspec.py), every model is checked")
+    parser.add_argument("--text", type=str, nargs="+", default=DEFAULT_TEXTS, help="Texts to synthesize (use several sentences to cover the vocoder pipeline)")
+    parser.add_argument("--speaker", type=str, default=None, help="Speaker of multi-speaker models")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5, help="Least timed runs of each path per text")
+    parser.add_argument("--min-time", type=float, default=2.0, help="Least total seconds timed per path and text")
+    parser.add_argument("--atol", type=float, default=1e-4, help="Largest allowed sample difference")
+    parser.add_argument("--speed-tolerance", type=float, default=0.1, help="Allowed slowdown of the fork (0.1: 10%%), not gated for the tiny models")
+    parser.add_argument("--no-pipeline", action="store_true", help="Only check the fork without the pipelined vocoder (default: with and without)")
+    parser.add_argument("--history", type=Path, default=None, help="Append the results to this CSV file, to track the fork's speed over time")
+    parser.add_argument("--label", type=str, default="", help="Label for the run in the history file (e.g. a commit id)")
+    parser.add_argument("--use-cuda", type=bool, default=False)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    torch.set_grad_enabled(False)
+    tmpdir = tempfile.TemporaryDirectory()
+    tiny = args.models is None and args.model_path is None
+    if tiny:
+        specs = [
+            tiny_vits(Path(tmpdir.name) / "tiny_vits", name="tiny_vits", seed=args.seed),
+            tiny_vocoded(Path(tmpdir.name) / "tiny_vocoded", name="tiny_vocoded", seed=args.seed),
+        ]
+    else:
+        specs = modelspec.specs_from_args(args, name="vits")
+    speed_tolerance = None if tiny else args.speed_tolerance
+
+    voice_synth = VoiceSynth(tmpdir.name, args.use_cuda, logging.getLogger("VoiceSynthesizer"))
+    voice_synth.load_specs([modelspec.ModelSpec.from_dict(dict(spec.to_dict(), preload=True)) for spec in specs])
+
+    results = []
+    for spec in specs:
+        synth = voice_synth.tts[spec.name]["tts"]
+        model = voice_synth.tts[spec.name]["model"]
+        if synth.vocoder_model is not None:
+            result = check_bridge(voice_synth, spec.name, seed=args.seed, atol=args.atol)
+            if result is not None:
+                result.update(model=spec.name, path="mel_bridge", text="")
+                results.append(result)
+        for text in args.text:
+            # the vocoder pipeline only runs for models with a separate vocoder, on several sentences
+            pipelines = [False]
+            if synth.vocoder_model is not None and not args.no_pipeline and len(synth.split_into_sentences(text)) > 1:
+                pipelines.append(True)
+            for pipeline in pipelines:
+                voice_synth.pipeline_vocoder = pipeline
+                result = check_synthesis(voice_synth, spec.name, text, args.speaker, seed=args.seed, repeat=args.repeat,
+                    atol=args.atol, speed_tolerance=speed_tolerance, min_time=args.min_time)
+                result.update(model=spec.name, path="pipelined_vocode" if pipeline else "pr_synthesize", text=text)
+                results.append(result)
+            if hasattr(model, "waveform_decoder"):
+                result = check_latents(voice_synth, spec.name, text, args.speaker, seed=args.seed, atol=args.atol)
+                result.update(model=spec.name, path="vits_latents", text=text)
+                results.append(result)
+
+    failures = 0
+    for result in results:
+        result["ok"] = len(result["failures"]) == 0
+        failures += 0 if result["ok"] else 1
+        timing = ""
+        if "fork_time" in result:
+            timing = f", {result['fork_time']:.3f}s vs {result['library_time']:.3f}s ({result['relative_speed']:.2f}x"
+            timing += ")" if result["speed_gated"] else ", not gated)"
+        print(f"{'ok  ' if result['ok'] else 'FAIL'} {result['model']} {result['path']} '{result['text'][:40]}': "
+            f"max diff {result['max_abs_difference']:.2e}, snr {result['snr_db']:.1f} dB{timing}")
+        for failure in result["failures"]:
+            print(f"       {failure}")
+
+    if args.history is not None:
+        new_file = not args.history.exists()
+        with open(args.history, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=HISTORY_FIELDS, extrasaction="ignore")
+            if new_file:
+                writer.writeheader()
+            for result in results:
+                writer.writerow(dict(result, time=time.time(), label=args.label))
+
+    tmpdir.cleanup()
+    print(json.dumps({"checks": len(results), "failures": failures}))
+    sys.exit(1 if failures > 0 else 0)
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+Precomputed spectrogram features for collected datasets.
+
+Training computes the mel / linear spectrograms of every clip again on every
+run, one clip at a time. This extracts them once, with the AudioProcessor of
+the model's config.json (the same one VoiceSynth.tts[model]["ap"] uses), on a
+pool of worker processes, into a feature store directory:
+    index.sqlite    path -> sha1 of the clip (with size and mtime), sha1 -> offset, shape per feature
+    mel.f32         float32 mel spectrograms [channels, frames], back to back
+    linear.f32      float32 linear spectrograms, same layout
+
+Features are keyed by the hash of the clip, so updates are incremental: only
+clips whose size or mtime changed are hashed again, and only hashes without
+features are extracted. Duplicate clips share their features. The blobs are
+memory-mapped for reading, a lookup is a slice of the mapping.
+
+A store belongs to one audio config (sample rate, fft, mel settings...),
+updating it with a different one is refused, use a new store directory.
+
+python featurestore.py update --model-path ../outputs/checkpoints/efam48_220k/ --dataset-path datasets/mydataset --workers 8
+python featurestore.py update --config config.json --wavs recordings/ --store recordings/features
+python featurestore.py info datasets/mydataset/features
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from logging import Logger
+from pathlib import Path
+from typing import List, Dict, Tuple, Union, Iterable
+
+import numpy as np
+
+from datasetstore import file_sha1
+
+INDEX_FILENAME = "index.sqlite"
+FEATURES = ("mel", "linear")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS clips (
+    path TEXT PRIMARY KEY,
+    sha1 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    added REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS clips_sha1 ON clips (sha1);
+CREATE TABLE IF NOT EXISTS features (
+    sha1 TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    channels INTEGER NOT NULL,
+    frames INTEGER NOT NULL,
+    PRIMARY KEY (sha1, kind)
+);
+"""
+
+
+def audio_config_from_file(config_path: Union[str, Path]) -> Dict:
+    """The "audio" section of a TTS config.json."""
+    from TTS.config import load_config
+    audio = load_config(str(config_path)).audio
+    return audio.to_dict() if hasattr(audio, "to_dict") else dict(audio)
+
+
+def config_fingerprint(audio_config: Dict) -> str:
+    return hashlib.sha1(json.dumps(audio_config, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+# Worker process state, set up once per process by init_worker()
+_worker_ap = None
+_worker_kinds = None
+
+
+def init_worker(audio_config: Dict, kinds: Tuple[str, ...]) -> None:
+    global _worker_ap, _worker_kinds
+    from TTS.utils.audio import AudioProcessor
+    _worker_ap = AudioProcessor(verbose=False, **audio_config)
+    _worker_kinds = kinds
+
+
+def hash_clip(path: str) -> Tuple[str, Union[str, None], str]:
+    """(path, sha1, error) in a worker process."""
+    try:
+        return path, file_sha1(path), ""
+    except OSError as e:
+        return path, None, str(e)
+
+
+def extract_clip(path: str) -> Tuple[str, Union[Dict[str, np.ndarray], None], str]:
+    """(path, {kind: [channels, frames] float32}, error) in a worker process."""
+    try:
+        wav = _worker_ap.load_wav(path)
+        features = dict()
+        if "mel" in _worker_kinds:
+            features["mel"] = _worker_ap.melspectrogram(wav).astype(np.float32)
+        if "linear" in _worker_kinds:
+            features["linear"] = _worker_ap.spectrogram(wav).astype(np.float32)
+        return path, features, ""
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+class FeatureStore:
+    """
+    Spectrogram features of a set of clips, see the module docstring for the layout.
+        store_path      Store directory (created if it does not exist)
+        audio_config    The audio config the features are (to be) computed with, checked against
+                        the store's. None: use the store's (read only use)
+        kinds           Features to store, any of FEATURES
+    """
+    def __init__(self, store_path: Union[str, Path], audio_config: Dict = None, kinds: Iterable[str] = FEATURES) -> None:
+        self.root = Path(store_path).resolve()
+        if not self.root.exists():
+            os.makedirs(self.root)
+        self.kinds = tuple(kinds)
+        for kind in self.kinds:
+            if kind not in FEATURES:
+                raise ValueError(f"Unknown feature '{kind}', use any of {FEATURES}")
+
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(str(self.root / INDEX_FILENAME), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+        stored = self.db.execute("SELECT value FROM meta WHERE key = 'audio_config'").fetchone()
+        if stored is None and audio_config is not None:
+            self.db.execute("INSERT INTO meta (key, value) VALUES ('audio_config', ?)", (json.dumps(audio_config, sort_keys=True, default=str),))
+            self.db.commit()
+            stored = (json.dumps(audio_config, sort_keys=True, default=str),)
+        self.audio_config = json.loads(stored[0]) if stored is not None else None
+        if audio_config is not None and config_fingerprint(audio_config) != config_fingerprint(self.audio_config):
+            raise ValueError(f"{self.root} holds features of a different audio config, use a new store directory")
+
+        self.writers = dict() # kind -> blob file opened for appending
+        self.maps = dict() # kind -> np.memmap of the blob
+
+    def close(self) -> None:
+        for f in self.writers.values():
+            f.close()
+        self.writers.clear()
+        self.maps.clear()
+        self.db.close()
+
+    def blob_path(self, kind: str) -> Path:
+        return self.root / f"{kind}.f32"
+
+    def stale(self, paths: Iterable[Union[str, Path]]) -> List[str]:
+        """The paths that are not in the index or whose size / mtime changed since they were hashed."""
+        with self._lock:
+            known = {path: (size, mtime) for path, size, mtime in self.db.execute("SELECT path, size, mtime FROM clips")}
+        stale = []
+        for path in paths:
+            path = str(Path(path).resolve())
+            try:
+                st = os.stat(path)
+            except OSError:
+                stale.append(path) # reported when it is hashed / extracted
+                continue
+            if known.get(path) != (st.st_size, st.st_mtime):
+                stale.append(path)
+        return stale
+
+    def link(self, clips: List[Tuple[str, str]]) -> None:
+        """Record (path, sha1) of clips, with their current size and mtime."""
+        rows = []
+        for path, sha1 in clips:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            rows.append((path, sha1, st.st_size, st.st_mtime, time.time()))
+        with self._lock:
+            self.db.executemany("INSERT OR REPLACE INTO clips (path, sha1, size, mtime, added) VALUES (?, ?, ?, ?, ?)", rows)
+            self.db.commit()
+
+    def missing(self, sha1s: Iterable[str]) -> List[str]:
+        """The hashes that do not have every feature of self.kinds yet."""
+        with self._lock:
+            complete = {sha1 for sha1, num in self.db.execute(
+                f"SELECT sha1, COUNT(*) FROM features WHERE kind IN ({','.join('?' * len(self.kinds))}) GROUP BY sha1",
+                self.kinds) if num == len(self.kinds)}
+        return sorted(set(sha1s) - complete)
+
+    def add(self, sha1: str, features: Dict[str, np.ndarray]) -> None:
+        """Append the features of a clip to the blobs and index them (one writer at a time)."""
+        rows = []
+        with self._lock:
+            for kind, feature in features.items():
+                feature = np.ascontiguousarray(feature, dtype=np.float32)
+                if kind not in self.writers:
+                    self.writers[kind] = open(self.blob_path(kind), "ab")
+                f = self.writers[kind]
+                offset = f.tell() // 4
+                f.write(feature.tobytes())
+                f.flush() # data before index, a crash leaves unindexed bytes at worst
+                rows.append((sha1, kind, offset, feature.shape[0], feature.shape[1]))
+            self.db.executemany("INSERT OR REPLACE INTO features (sha1, kind, offset, channels, frames) VALUES (?, ?, ?, ?, ?)", rows)
+            self.db.commit()
+
+    def sha1_of(self, key: Union[str, Path]) -> str:
+        """sha1 for a clip path or a sha1."""
+        key = str(key)
+        if len(key) == 40 and all(c in "0123456789abcdef" for c in key):
+            return key
+        with self._lock:
+            row = self.db.execute("SELECT sha1 FROM clips WHERE path = ?", (str(Path(key).resolve()),)).fetchone()
+        if row is None:
+            raise KeyError(f"No features for {key}")
+        return row[0]
+
+    def get(self, key: Union[str, Path], kind: str = "mel") -> np.ndarray:
+        """Read-only [channels, frames] view of a feature of a clip (by path or sha1)."""
+        sha1 = self.sha1_of(key)
+        with self._lock:
+            row = self.db.execute("SELECT offset, channels, frames FROM features WHERE sha1 = ? AND kind = ?", (sha1, kind)).fetchone()
+        if row is None:
+            raise KeyError(f"No {kind} features for {key}")
+        offset, channels, frames = row
+        end = offset + channels * frames
+        data = self.maps.get(kind)
+        if data is None or len(data) < end: # (re)map once the blob has grown past the mapping
+            data = np.memmap(self.blob_path(kind), dtype=np.float32, mode="r")
+            self.maps[kind] = data
+        return data[offset:end].reshape(channels, frames)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            clips = self.db.execute("SELECT COUNT(*), COUNT(DISTINCT sha1) FROM clips").fetchone()
+            kinds = {kind: {"clips": num, "frames": frames or 0}
+                for kind, num, frames in self.db.execute("SELECT kind, COUNT(*), SUM(frames) FROM features GROUP BY kind")}
+        for kind in kinds:
+            path = self.blob_path(kind)
+            kinds[kind]["bytes"] = path.stat().st_size if path.exists() else 0
+        return {"clips": clips[0], "unique_clips": clips[1], "features": kinds}
+
+
+def update(store: FeatureStore, paths: Iterable[Union[str, Path]], known_hashes: Dict[str, str] = None,
+    workers: int = None, chunksize: int = 16, logger: Logger = None) -> Dict:
+    """
+    Bring the store up to date with paths: hash the stale clips and extract the features of new hashes,
+    both on a pool of worker processes.
+        known_hashes    path -> sha1 of clips whose hash is already known (e.g. from the dataset manifest)
+    Returns counts of what was done.
+    """
+    log = logger if logger is not None else logging.getLogger("FeatureStore")
+    if store.audio_config is None:
+        raise ValueError(f"{store.root} has no audio config yet, open it with the model's audio config")
+    known_hashes = {str(Path(path).resolve()): sha1 for path, sha1 in (known_hashes or dict()).items()}
+    start_time = time.time()
+    stale = store.stale(paths)
+    counts = {"stale": len(stale), "hashed": 0, "extracted": 0, "failed": 0}
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(store.audio_config, store.kinds)) as pool:
+        hashes = [(path, known_hashes[path]) for path in stale if path in known_hashes]
+        to_hash = [path for path in stale if path not in known_hashes]
+        for path, sha1, error in pool.map(hash_clip, to_hash, chunksize=chunksize):
+            if sha1 is None:
+                log.warning(f"Cannot read {path}: {error}")
+                counts["failed"] += 1
+                continue
+            hashes.append((path, sha1))
+        counts["hashed"] = len(to_hash)
+
+        # one clip per hash is enough, duplicates share the features
+        sources = dict()
+        for path, sha1 in hashes:
+            sources.setdefault(sha1, path)
+        missing = store.missing(sources)
+        log.info(f"{len(stale)} new or changed clips, {len(missing)} to extract")
+
+        sha1_of_path = {sources[sha1]: sha1 for sha1 in missing}
+        failed = set()
+        for num, (path, features, error) in enumerate(pool.map(extract_clip, list(sha1_of_path), chunksize=max(1, chunksize // 4))):
+            if features is None:
+                log.warning(f"Cannot extract features of {path}: {error}")
+                failed.add(sha1_of_path[path])
+                continue
+            store.add(sha1_of_path[path], features)
+            counts["extracted"] += 1
+            if (num + 1) % 100 == 0:
+                log.info(f"[{num + 1}/{len(missing)}] {time.time() - start_time:.0f}s")
+        counts["failed"] += len(failed)
+
+    # clips are only marked up to date once their features are in, failures are retried on the next update
+    store.link([(path, sha1) for path, sha1 in hashes if sha1 not in failed])
+    counts["time"] = time.time() - start_time
+    return counts
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Precompute spectrogram features of dataset clips.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    update_parser = subparsers.add_parser("update", help="Extract the features of new and changed clips")
+    update_parser.add_argument("--model-path", type=Path, default=None, help="TTS model directory, its config.json sets the audio parameters")
+    update_parser.add_argument("--config", type=Path, default=None, help="TTS config.json instead of --model-path")
+    update_parser.add_argument("--dataset-path", type=Path, default=None, help="Dataset with a manifest (see datasetstore.py)")
+    update_parser.add_argument("--wavs", type=Path, default=None, help="Directory of .wav files instead of --dataset-path")
+    update_parser.add_argument("--store", type=Path, default=None, help="Feature store directory (default: <dataset-path>/features)")
+    update_parser.add_argument("--features", type=str, nargs="+", default=list(FEATURES), help=f"Any of {' '.join(FEATURES)}")
+    update_parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+
+    info_parser = subparsers.add_parser("info", help="Show what a store holds")
+    info_parser.add_argument("store", type=Path)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "info":
+        store = FeatureStore(args.store)
+        print(json.dumps(dict(store.stats(), audio_config=store.audio_config), indent=2))
+        store.close()
+
+    elif args.command == "update":
+        if (args.model_path is None) == (args.config is None):
+            parser.error("give --model-path or --config")
+        if (args.dataset_path is None) == (args.wavs is None):
+            parser.error("give --dataset-path or --wavs")
+        if args.config is None:
+            import modelspec
+            args.config = modelspec.ModelSpec.from_model_dir("features", args.model_path.resolve()).config_path
+
+        known_hashes = dict()
+        if args.dataset_path is not None:
+            from datasetstore import DatasetStore
+            dataset = DatasetStore(args.dataset_path)
+            known_hashes = {str(dataset.abspath(clip["path"])): clip["sha1"] for clip in dataset.query()}
+            dataset.close()
+            paths = list(known_hashes)
+            store_path = args.store or args.dataset_path / "features"
+        else:
+            paths = sorted(str(p) for p in args.wavs.rglob("*.wav"))
+            store_path = args.store or args.wavs / "features"
+
+        store = FeatureStore(store_path, audio_config_from_file(args.config), kinds=args.features)
+        counts = update(store, paths, known_hashes, workers=args.workers, logger=logging.getLogger("FeatureStore"))
+        print(json.dumps(dict(counts, **store.stats()), indent=2))
+        store.close()
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+Synthesis gateway: one websocket endpoint in front of several synthesis nodes.
+
+Clients speak the ShibbolethWSS protocol to the gateway (send text, get the
+text echoed back once it has been spoken). Messages can also be JSON,
+{"text": ..., "voice": ...}, to pick a voice; plain text goes to the default
+voice. Admin commands ({"admin": ...}, see hotreload.py) are refused, never
+relayed: the nodes would see them coming from the gateway's host. Every node serves one voice (one shibboleth.py process, local or on
+another host). Requests are routed on a consistent hash ring per voice, keyed
+by the text, so the same line always lands on the same node and that node's
+caches (clause cache, audio bank, ...) stay hot. When a node stops answering
+health checks or its connection fails it is taken off its ring: only the keys
+it owned move to other nodes, and requests that failed on it are retried there.
+A request that times out is not retried by default, the slow node may still
+speak it and the line would be heard twice (--retry-timeouts to retry anyway).
+When a node comes back, it gets the same keys as before.
+
+Several nodes on one machine (stub nodes from loadtest.py, or shibboleth.py on different ports):
+python gateway.py --spawn-stubs 3 --port 8765
+python gateway.py --backend effiamir@ws://localhost:8801 effiamir@ws://localhost:8802 effi@ws://otherhost:8765
+"""
+import sys
+import json
+import time
+import bisect
+import asyncio
+import hashlib
+import logging
+import subprocess
+from collections import deque
+from pathlib import Path
+from logging import Logger
+from typing import List, Dict, Set, Union
+
+import websockets
+
+
+def ring_hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring with virtual nodes.
+        vnodes      Points per node on the ring, more points spread keys more evenly
+    """
+    def __init__(self, vnodes: int = 100) -> None:
+        self.vnodes = vnodes
+        self.points = [] # sorted hashes
+        self.owners = [] # node of each point
+        self.nodes = set()
+
+    def add(self, node: str) -> None:
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for idx in range(self.vnodes):
+            point = ring_hash(f"{node}#{idx}")
+            pos = bisect.bisect(self.points, point)
+            self.points.insert(pos, point)
+            self.owners.insert(pos, node)
+
+    def remove(self, node: str) -> None:
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        keep = [(p, o) for p, o in zip(self.points, self.owners) if o != node]
+        self.points = [p for p, o in keep]
+        self.owners = [o for p, o in keep]
+
+    def lookup(self, key: str, exclude: Set[str] = frozenset()) -> Union[str, None]:
+        """Node owning key: the first point clockwise from the key's hash, skipping excluded nodes."""
+        if len(self.points) == 0:
+            return None
+        start = bisect.bisect(self.points, ring_hash(key))
+        for offset in range(len(self.points)):
+            owner = self.owners[(start + offset) % len(self.points)]
+            if owner not in exclude:
+                return owner
+        return None
+
+
+class BackendNode:
+    """
+    Connection to one synthesis node. Requests are sent over one websocket;
+    the node answers in order, so replies are matched to requests first in, first out.
+    """
+    def __init__(self, voice: str, url: str, timeout: float, logger: Logger) -> None:
+        self.voice = voice
+        self.url = url
+        self.timeout = timeout
+        self.log = logger
+        self.ws = None
+        self.waiting = deque()
+        self.send_lock = asyncio.Lock()
+        self.reader = None
+        self.healthy = False
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def name(self) -> str:
+        return f"{self.voice}@{self.url}"
+
+    async def connect(self) -> None:
+        self.ws = await websockets.connect(self.url, open_timeout=self.timeout, max_queue=None)
+        await self.ws.send("Handshake!") # not answered by ShibbolethWSS
+        self.reader = asyncio.ensure_future(self.read_replies())
+        self.healthy = True
+
+    async def read_replies(self) -> None:
+        try:
+            async for message in self.ws:
+                if len(self.waiting) > 0:
+                    future = self.waiting.popleft()
+                    if not future.done():
+                        future.set_result(message)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self.fail_waiting(ConnectionError(f"{self.name} closed the connection"))
+
+    def fail_waiting(self, error: Exception) -> None:
+        self.healthy = False
+        while len(self.waiting) > 0:
+            future = self.waiting.popleft()
+            if not future.done():
+                future.set_exception(error)
+
+    async def request(self, text: str, timeout: float) -> str:
+        """Send text, return the node's echo once it has been spoken."""
+        future = asyncio.get_running_loop().create_future()
+        async with self.send_lock:
+            if self.ws is None or not self.healthy: # down, or a health check is reconnecting
+                raise ConnectionError(f"{self.name} is not connected")
+            self.waiting.append(future)
+            self.requests += 1
+            try:
+                await self.ws.send(text)
+            except Exception:
+                self.waiting.remove(future)
+                raise
+        return await asyncio.wait_for(future, timeout)
+
+    async def check(self) -> bool:
+        """
+        Health check: (re)connect if needed and ping. A node that is busy speaking is not pinged,
+        ShibbolethWSS does not answer pings while it synthesizes; a dead connection shows up
+        as a closed websocket or a request timeout instead.
+        """
+        try:
+            if self.ws is None or not self.healthy:
+                async with self.send_lock: # requests see either the old or the new connection, never none
+                    await self.close()
+                    await self.connect()
+            if len(self.waiting) > 0:
+                return True
+            pong_waiter = await self.ws.ping()
+            await asyncio.wait_for(pong_waiter, self.timeout)
+            return True
+        except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+            self.log.debug(f"Health check of {self.name} failed: {e}")
+            self.fail_waiting(ConnectionError(f"{self.name} failed its health check"))
+            return False
+
+    async def close(self) -> None:
+        if self.reader is not None:
+            self.reader.cancel()
+            self.reader = None
+        if self.ws is not None:
+            await self.ws.close()
+            self.ws = None
+
+
+class Gateway:
+    """
+        backends            List of voice@url node specs
+        default_voice       Voice for plain text messages (default: the voice of the first backend)
+        request_timeout     Seconds a node gets to speak a message
+        health_interval     Seconds between health checks
+        max_attempts        Nodes to try for one message
+        retry_timeouts      Also retry messages that timed out on another node (the slow node may still
+                            speak them, so they can be heard twice), by default only failed connections are retried
+    """
+    def __init__(self, backends: List[str], default_voice: str = None, request_timeout: float = 60.0,
+        health_interval: float = 2.0, connect_timeout: float = 5.0, max_attempts: int = 3,
+        retry_timeouts: bool = False, vnodes: int = 100, logger: Logger = None) -> None:
+        self.log = logger if logger is not None else logging.getLogger("Gateway")
+        self.nodes = dict()
+        self.rings = dict()
+        for spec in backends:
+            voice, url = spec.split("@", 1) if "@" in spec else ("default", spec)
+            node = BackendNode(voice, url, connect_timeout, self.log)
+            self.nodes[node.name] = node
+            self.rings.setdefault(voice, HashRing(vnodes))
+        self.default_voice = default_voice if default_voice is not None else next(iter(self.rings))
+        self.request_timeout = request_timeout
+        self.health_interval = health_interval
+        self.max_attempts = max_attempts
+        self.retry_timeouts = retry_timeouts
+        self.retries = 0
+        self.errors = 0
+
+    def parse(self, message: str):
+        """(voice, text) of a client message. Raises ValueError for admin commands, which are not relayed."""
+        voice, text = self.default_voice, message
+        if message.startswith("{"):
+            try:
+                data = json.loads(message)
+            except ValueError:
+                data = None
+            if isinstance(data, dict) and "admin" in data:
+                raise ValueError("admin commands are not relayed by the gateway, send them to the node")
+            if isinstance(data, dict) and "text" in data:
+                voice, text = data.get("voice", self.default_voice), str(data["text"])
+        if text.lstrip().startswith("{") and "\"admin\"" in text: # what ShibbolethWSS would take for an admin command
+            raise ValueError("admin commands are not relayed by the gateway, send them to the node")
+        return voice, text
+
+    def route(self, voice: str, text: str, exclude: Set[str] = frozenset()) -> Union[BackendNode, None]:
+        ring = self.rings.get(voice)
+        if ring is None:
+            return None
+        name = ring.lookup(" ".join(text.lower().split()), exclude)
+        return self.nodes[name] if name is not None else None
+
+    async def forward(self, message: str) -> str:
+        voice, text = self.parse(message)
+        tried = set()
+        for attempt in range(self.max_attempts):
+            node = self.route(voice, text, tried)
+            if node is None:
+                break
+            try:
+                await node.request(text, self.request_timeout)
+                return message
+            except asyncio.TimeoutError:
+                node.failures += 1
+                if not self.retry_timeouts:
+                    self.errors += 1
+                    raise ConnectionError(f"{node.name} did not speak '{text[:40]}' within {self.request_timeout}s")
+                tried.add(node.name)
+                self.retries += 1
+                self.log.warning(f"{node.name} timed out on '{text[:40]}', retrying elsewhere")
+            except (ConnectionError, websockets.exceptions.WebSocketException) as e:
+                node.failures += 1
+                tried.add(node.name)
+                self.retries += 1
+                self.log.warning(f"{node.name} failed on '{text[:40]}': {e}, retrying elsewhere")
+                self.take_down(node)
+        self.errors += 1
+        raise ConnectionError(f"No synthesis node for voice '{voice}' could handle the request")
+
+    def take_down(self, node: BackendNode) -> None:
+        if node.name in self.rings[node.voice].nodes:
+            self.rings[node.voice].remove(node.name)
+            self.log.warning(f"Node {node.name} is down, rebalanced voice '{node.voice}' over {len(self.rings[node.voice].nodes)} nodes")
+
+    def bring_up(self, node: BackendNode) -> None:
+        if node.name not in self.rings[node.voice].nodes:
+            self.rings[node.voice].add(node.name)
+            self.log.info(f"Node {node.name} is up, voice '{node.voice}' on {len(self.rings[node.voice].nodes)} nodes")
+
+    async def check_nodes(self) -> None:
+        results = await asyncio.gather(*(node.check() for node in self.nodes.values()))
+        for node, ok in zip(self.nodes.values(), results):
+            if ok:
+                self.bring_up(node)
+            else:
+                self.take_down(node)
+
+    async def health_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.check_nodes()
+
+    async def handler(self, websocket, path=None):
+        async for message in websocket:
+            if message == "Handshake!":
+                continue # not answered, like ShibbolethWSS
+            if message.strip() == "":
+                await websocket.send(message)
+                continue
+            try:
+                await websocket.send(await self.forward(message)) # echo once spoken, like ShibbolethWSS
+            except ValueError as e:
+                await websocket.send(json.dumps({"error": str(e)}))
+            except ConnectionError as e:
+                self.log.error(str(e))
+                await websocket.send(json.dumps({"error": str(e), "text": message}))
+
+    def stats(self) -> Dict:
+        return {
+            "nodes": {name: {"healthy": node.healthy, "requests": node.requests, "failures": node.failures}
+                for name, node in self.nodes.items()},
+            "retries": self.retries,
+            "errors": self.errors,
+        }
+
+    async def main(self, host: str, port: int) -> None:
+        await self.check_nodes()
+        health = asyncio.ensure_future(self.health_loop())
+        print(f"Gateway listening on ws://{host}:{port}, nodes: {list(self.nodes)}")
+        try:
+            async with websockets.serve(self.handler, host, port):
+                await asyncio.Future()  # run forever
+        finally:
+            health.cancel()
+
+
+def spawn_stubs(count: int, first_port: int, voice: str = "default") -> tuple:
+    """Start `count` stub synthesis nodes (loadtest.py stub) on consecutive ports. Returns (processes, backend specs)."""
+    processes = []
+    backends = []
+    for idx in range(count):
+        port = first_port + idx
+        loadtest = Path(__file__).resolve().parent / "loadtest.py"
+        processes.append(subprocess.Popen([sys.executable, str(loadtest), "stub", "--port", str(port)]))
+        backends.append(f"{voice}@ws://localhost:{port}")
+    return processes, backends
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Synthesis gateway over several ShibbolethWSS nodes.")
+    parser.add_argument("--backend", type=str, nargs="*", default=[], help="Synthesis nodes as voice@ws://host:port")
+    parser.add_argument("--spawn-stubs", type=int, default=0, help="Start this many local stub nodes (for testing)")
+    parser.add_argument("--stub-port", type=int, default=8801, help="First port for --spawn-stubs")
+    parser.add_argument("--host", type=str, default="localhost", help="Websockets Server Host (default is localhost)")
+    parser.add_argument("-p", "--port", type=int, default=8765, help="Websockets Server port (default is 8765)")
+    parser.add_argument("--default-voice", type=str, default=None, help="Voice for plain text messages")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds a node gets per message")
+    parser.add_argument("--retry-timeouts", action="store_true", help="Retry messages that timed out on another node (may be heard twice)")
+    parser.add_argument("--health-interval", type=float, default=2.0, help="Seconds between health checks")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    processes = []
+    backends = list(args.backend)
+    if args.spawn_stubs > 0:
+        processes, stub_backends = spawn_stubs(args.spawn_stubs, args.stub_port)
+        backends += stub_backends
+        time.sleep(1.0) # let the stubs start listening
+    if len(backends) == 0:
+        parser.error("No backends, use --backend or --spawn-stubs")
+
+    gateway = Gateway(backends, default_voice=args.default_voice, request_timeout=args.timeout,
+        health_interval=args.health_interval, retry_timeouts=args.retry_timeouts)
+    try:
+        asyncio.run(gateway.main(args.host, args.port))
+    except KeyboardInterrupt:
+        print("Received CTRL+C ... exit gateway.")
+    finally:
+        print(json.dumps(gateway.stats(), indent=2))
+        for process in processes:
+            process.terminate()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Hot model reload: switch a running server to a newer checkpoint.
+
+VoiceSynth.reload_model() loads and warms up the new checkpoint in the
+background and swaps it in atomically, requests in flight finish on the old
+model. A reload is triggered
+    - by an admin command: {"admin": "reload", "model": "vits", "path": "<checkpoint dir>", "token": ...}
+      to shibboleth.py's websocket, or POST /admin/reload (same JSON) to shibboleth-flask.py.
+      Reloading loads (unpickles) whatever the path points to, so it is only accepted with
+      the --admin-token, never just because the client is on this machine (it may be a proxy,
+      or the gateway relaying remote clients)
+    - or by a ModelWatcher, which polls a glob of checkpoint directories or files and reloads
+      the newest one once it has stopped changing (training writes checkpoints incrementally)
+
+python shibboleth.py --model-path ../outputs/checkpoints/efam48_220k/ --watch-models "../outputs/checkpoints/efam48_*"
+"""
+import os
+import glob
+import hmac
+import time
+import logging
+import threading
+from logging import Logger
+from pathlib import Path
+from typing import Union, Tuple, Dict
+
+import modelspec
+
+
+def spec_for_checkpoint(model_id: str, path: Union[str, Path]) -> modelspec.ModelSpec:
+    """
+    Spec for a checkpoint: a model directory (see ModelSpec.from_model_dir), or a .pth file
+    with the config.json next to it.
+    """
+    path = Path(path).resolve()
+    if path.is_dir():
+        return modelspec.ModelSpec.from_model_dir(model_id, path)
+    spec = modelspec.ModelSpec(model_id, str(path), str(path.parent / "config.json"))
+    modelspec.validate([spec])
+    return spec
+
+
+def reload_in_background(voice_synth, model_id: str, path: Union[str, Path], logger: Logger = None) -> threading.Thread:
+    """Start voice_synth.reload_model() for the checkpoint at path on its own thread."""
+    log = logger if logger is not None else logging.getLogger("HotReload")
+    spec = spec_for_checkpoint(model_id, path) # fail early, in the caller, on a bad path
+
+    def reload():
+        try:
+            voice_synth.reload_model(spec)
+        except Exception:
+            log.exception(f"Reloading {model_id} from {path} failed, keeping the old model")
+
+    thread = threading.Thread(target=reload, name=f"reload-{model_id}", daemon=True)
+    thread.start()
+    return thread
+
+
+class ModelWatcher:
+    """
+    Polls for new checkpoints of one model.
+        pattern     Glob of checkpoint directories or .pth files, e.g. "../outputs/checkpoints/efam48_*"
+        interval    Seconds between polls
+        settle      A checkpoint is only loaded once it has not changed for this many seconds
+    """
+    def __init__(self, voice_synth, model_id: str, pattern: str, interval: float = 10.0, settle: float = 10.0,
+        logger: Logger = None) -> None:
+        self.voice_synth = voice_synth
+        self.model_id = model_id
+        self.pattern = pattern
+        self.interval = interval
+        self.settle = settle
+        self.log = logger if logger is not None else logging.getLogger("ModelWatcher")
+        self.current = self.newest() # the checkpoint that is loaded at startup is not reloaded
+        self.running = False
+        self.thread = None
+        self.reloads = 0
+
+    def stamp(self, path: str) -> Tuple[float, int]:
+        """(mtime, size) of a checkpoint file, or of the checkpoint in a model directory."""
+        if os.path.isdir(path):
+            spec = modelspec.ModelSpec.from_model_dir(self.model_id, path)
+            path = spec.model_path
+        st = os.stat(path)
+        return st.st_mtime, st.st_size
+
+    def newest(self) -> Union[Tuple[str, Tuple[float, int]], None]:
+        candidates = []
+        for path in glob.glob(self.pattern):
+            try:
+                candidates.append((path, self.stamp(path)))
+            except (OSError, ValueError):
+                continue # incomplete model directory
+        if len(candidates) == 0:
+            return None
+        return max(candidates, key=lambda c: c[1][0])
+
+    def poll(self) -> bool:
+        """Reload if a new or changed checkpoint has settled. Returns True if a reload was done."""
+        newest = self.newest()
+        if newest is None or newest == self.current:
+            return False
+        path, (mtime, size) = newest
+        if time.time() - mtime < self.settle:
+            return False # still being written
+        self.log.info(f"New checkpoint for {self.model_id}: {path}")
+        try:
+            self.voice_synth.reload_model(spec_for_checkpoint(self.model_id, path))
+            self.reloads += 1
+        except Exception:
+            self.log.exception(f"Reloading {self.model_id} from {path} failed, keeping the old model")
+        self.current = newest # do not retry a broken checkpoint until it changes again
+        return True
+
+    def watchThread(self) -> None:
+        while self.running:
+            time.sleep(self.interval)
+            if self.running:
+                self.poll()
+
+    def start(self) -> None:
+        self.running = True
+        self.thread = threading.Thread(target=self.watchThread, name=f"watch-{self.model_id}", daemon=True)
+        self.thread.start()
+        self.log.info(f"Watching {self.pattern} for new {self.model_id} checkpoints every {self.interval}s")
+
+    def stop(self) -> None:
+        self.running = False
+
+
+def add_reload_args(parser) -> None:
+    """Hot reload command line options shared by the entry points."""
+    parser.add_argument("--watch-models", type=str, default=None, help="Glob of checkpoint directories / files, the newest one is hot reloaded when it appears")
+    parser.add_argument("--watch-interval", type=float, default=10.0, help="Seconds between checks for new checkpoints")
+    parser.add_argument("--admin-token", type=str, default=None, help="Token admin commands must carry (without it reload commands are refused and only local clients may list the models)")
+
+
+# Admin commands that load a checkpoint from a client supplied path, they always need the admin token
+PATH_COMMANDS = ("reload",)
+
+
+def authorized(command: Dict, remote_host: str, admin_token: str = None) -> bool:
+    """
+    Admin commands need the admin token if one is set. Without a token, commands that load a
+    checkpoint path are refused and the others must come from this machine.
+    """
+    if admin_token is not None:
+        return hmac.compare_digest(str(command.get("token", "")), admin_token)
+    if command.get("admin") in PATH_COMMANDS:
+        return False
+    return remote_host in ("127.0.0.1", "::1", "localhost")
+
+
+def handle_admin(command: Dict, voice_synth, default_model_id: str, logger: Logger = None) -> Dict:
+    """
+    Run an admin command, returns the reply. Commands:
+        {"admin": "reload", "model": <model id, default: the served model>, "path": <checkpoint>}
+        {"admin": "models"}     the loaded models and their checkpoints
+    """
+    action = command.get("admin")
+    if action == "reload":
+        model_id = command.get("model", default_model_id)
+        if "path" not in command:
+            return {"admin": action, "error": "reload needs a checkpoint path"}
+        try:
+            reload_in_background(voice_synth, model_id, command["path"], logger)
+        except ValueError as e:
+            return {"admin": action, "error": str(e)}
+        return {"admin": action, "model": model_id, "status": "loading"}
+    elif action == "models":
+        return {"admin": action, "models": {name: str(spec.model_path) for name, spec in voice_synth.model_specs.items()},
+            "loaded": list(voice_synth.tts)}
+    return {"admin": action, "error": f"unknown admin command '{action}'"}
+
+
+def watch_from_args(args, voice_synth, model_id: str, logger: Logger = None) -> Union[ModelWatcher, None]:
+    """Start a ModelWatcher for model_id if --watch-models was given."""
+    if args.watch_models is None:
+        return None
+    watcher = ModelWatcher(voice_synth, model_id, args.watch_models, interval=args.watch_interval,
+        settle=args.watch_interval, logger=logger)
+    watcher.start()
+    return watcher
@@ -41,6 +41,11 @@ const datasetmanager = new DatasetManager();
 
 // 3. Set up UI elements & plug them into Voice & Dataset callbacks...
 const recStopButton = document.querySelector('#recordStopButton');
+const speakerInput = document.querySelector('#speaker');
+
+const getSpeaker = ()=>{
+  return (speakerInput && speakerInput.value) ? speakerInput.value : "unknown";
+};
 
 var audiorecorder;
 
@@ -68,16 +73,8 @@ voicecore.getMicrophoneAccess((audioRecorders, visualizers)=>{
   audiorecorder.ondataavailable = (typedArray) => { // Recording complete, now what to do with the buffered audio data?
     console.log("Recorder stopped, new audio data available");
 
-    // The clip name should be generated based on enumeration in the existing dataset + label information...
-    let clipName = datasetmanager.generateAudioFileName();
-
-    if(clipName == '') {
-      //clipName = new Date().toISOString() + ".wav";
-      clipName = "MyRecording"
-      clipName = prompt('Enter a memorable name for your voiceprint', clipName);
-      nameInput.value = clipName;
-    }
-    clipName = clipName + '.wav';
+    // Local name until the clip is uploaded, the server names it by enumerating the speaker's clips
+    let clipName = datasetmanager.generateAudioFileName(getSpeaker()) + '.wav';
 
     const dataBlob = new Blob( [typedArray], { type: 'audio/wav' });
     const audioURL = window.URL.createObjectURL( dataBlob );
@@ -98,6 +95,8 @@ voicecore.getMicrophoneAccess((audioRecorders, visualizers)=>{
     deleteButton.textContent = 'Delete';
     deleteButton.className = 'delete';
     audio.clipName = clipName; // stash the clip name on the audio element...
+    audio.promptText = prompt ? prompt.textContent : ""; // ...and the prompt that was read
+    audio.promptIndex = prompt ? prompt.dataset.index : undefined;
     link.href = audioURL;
     link.download = clipName;
     link.innerHTML = link.download;
@@ -124,7 +123,6 @@ voicecore.getMicrophoneAccess((audioRecorders, visualizers)=>{
     clipContainer.appendChild(deleteButton);
     soundClips.appendChild(clipContainer);
 
-    // TODO: How to add it to the post request?
   }; // end recorder.ondataavailable
 
 });
@@ -144,135 +142,135 @@ recStopButton.addEventListener('click', ()=>{
 });
 
 // Set up recorded audio submission/upload...
-const submitButton = document.querySelector('#submitButton');
 const submitAudioForm = document.querySelector('#metadataForm');
 
-submitAudioForm.addEventListener('submit', (e)=>{
-  e.preventDefault();   // On form submission, prevent default
-  // Fetch the audio objects (if some recordings have been made)
-  const clipElements = soundClips.querySelectorAll('.clip');
-
-  for(let i=0; i < clipElements.length; i++) {
-
+// Upload every recorded clip with the prompt it was recorded for, uploaded clips are removed from the list.
+const uploadClips = ()=>{
+  const clipElements = Array.from(soundClips.querySelectorAll('.clip'));
+  const uploads = clipElements.map((clipElement)=>{
     const audioElement = clipElement.querySelector('audio');
-
-    if(!audioElement) {
-       userlog("Error: You need to make at least one recording before you can submit!")
-       console.log("Error: No audio recordings in soundClips", audioRecordings);
-       return;
-    } else {
-      // Construct a FormData object in which to store the audio data
-      const formData = new FormData(submitAudioForm);
-      const audioFileName = audioElement.clipName;
-      const request = new XMLHttpRequest();
-
-      console.log("Append audio data audioBlob and clipName from", audioElement);
-
-      // Append the file data & submit the form via xhr
-      formData.append('file', audioElement.audioBlob, audioFileName);
-
-      // More detailed information about the xhr process
-      // request.addEventListener('readystatechange', ()=>{ // Call a function when the state changes.
-      //     console.log("Ready State Change", request);
-      //     if (request.readyState === XMLHttpRequest.DONE && request.status === 200) {
-      //         // Request finished. Do processing here.
-      //         console.log("Request sent successfully, received response?", request)
-      //     }
-      // });
-
-      request.addEventListener('load', ()=>{
-        const response = request.response;
-        console.log("XHR response", request.response);
-        if(response == 'Success') {
-          // Delete uploaded clip...
-          soundClips.removeChild(clipElement);
-          userlog("Uploaded ", audioFileName);
-
-        } else { // Print error...
-          userlog("Error uploading recording '"+audioFileName+"': ", response);
-        }
+    return datasetmanager.upload(audioElement.audioBlob, audioElement.clipName, audioElement.promptText, getSpeaker(), audioElement.promptIndex)
+      .then((reply)=>{
+        soundClips.removeChild(clipElement);
+        userlog(reply.duplicate ? "Already uploaded " : "Uploaded ", audioElement.clipName + " as " + reply.path);
+        return reply;
+      })
+      .catch((e)=>{
+        userlog("Error uploading recording '" + audioElement.clipName + "': ", e.message);
+        throw e;
       });
-
-      request.open("POST", "/");
-      request.send(formData);
-
+  });
+  return Promise.all(uploads);
+};
+
+if(submitAudioForm) {
+  submitAudioForm.addEventListener('submit', (e)=>{
+    e.preventDefault();   // On form submission, prevent default
+    if(soundClips.querySelectorAll('.clip').length == 0) {
+      userlog("Error: You need to make at least one recording before you can submit!");
+      return;
     }
+    uploadClips().then(showNextFromUploads).catch(()=>{});
+  });
+}
 
-  }
-
-});
 
+// Set up dataset / prompt controls...
 
-////// TODO: Integrate this bit of code into the above... we need to add all the audio files to the form
-///////////  when it gets submitted....
+const skipButton = document.querySelector('#skipButton');
+const nextButton = document.querySelector('#nextButton');
 
-form.addEventListener('submit', (e)=>{
-  // On form submission, prevent default
-  e.preventDefault();
+// Prompts are scheduled by the server (see promptscheduler.py), the page only displays them.
 
+const showPrompt = (data)=>{
+  if(data && data.prompt) {
+    prompt.textContent = data.prompt;
+    prompt.dataset.index = data.index;
+  } else {
+    prompt.textContent = "All prompts recorded, thank you!";
+  }
+};
 
-  // Fetch the audio object (if a recording has been made)
-  let clipElement = soundClips.querySelector('.clip');
-  let audioElement = clipElement.querySelector('audio');
+// Uploads mark their prompt recorded, the last reply carries the speaker's next prompt.
+const showNextFromUploads = (replies)=>{
+  if(replies.length > 0 && replies[replies.length - 1].next !== undefined) {
+    showPrompt(replies[replies.length - 1].next);
+  }
+};
+
+const fetchNextPrompt = ()=>{
+  fetch("/prompt/next?speaker=" + encodeURIComponent(getSpeaker()))
+    .then((res) => res.json())
+    .then(showPrompt)
+    .catch((e) => userlog("Error fetching prompt: ", e.message));
+};
+
+const skipPrompt = ()=>{
+  const formData = new FormData();
+  formData.append('speaker', getSpeaker());
+  fetch("/prompt/skip", { method: "POST", body: formData })
+    .then((res) => res.json())
+    .then(showPrompt)
+    .catch((e) => userlog("Error skipping prompt: ", e.message));
+};
+
+if(skipButton) {
+  skipButton.addEventListener('click', skipPrompt);
+}
+// Next: upload the takes of the current prompt (marking it recorded), or skip it if nothing was recorded.
+const nextPrompt = ()=>{
+  if(soundClips.querySelectorAll('.clip').length == 0) {
+    skipPrompt();
+    return;
+  }
+  uploadClips().then(showNextFromUploads).catch(()=>{});
+};
 
-  if(audioElement) {
-    // Construct a FormData object
-    let formData = new FormData(form);
-    let fileName = audioElement.clipName;
-    console.log("Append audio data audioBlob and clipName from", audioElement);
+if(nextButton) {
+  nextButton.addEventListener('click', nextPrompt);
+}
+if(prompt) {
+  fetchNextPrompt();
+}
 
-    // Append the file data...
-    formData.append('file', audioElement.audioBlob, fileName);
 
-    // Submit the form via xhr
-    let request = new XMLHttpRequest();
 
-    // More detailed information about the xhr process
-    // request.addEventListener('readystatechange', ()=>{ // Call a function when the state changes.
-    //     console.log("Ready State Change", request);
-    //     if (request.readyState === XMLHttpRequest.DONE && request.status === 200) {
-    //         // Request finished. Do processing here.
-    //         console.log("Request sent successfully, received response?", request)
-    //     }
-    // });
+// Live streaming to server-side recognition (streamingest.py) -----------
+// The server url comes from the button's data-url attribute, by default port 8766 on this host.
 
-    request.addEventListener('load', ()=>{
-      let response = request.response;
-      console.log("XHR response", request.response);
-      if(response == 'Success') {
-        // Delete uploaded clip...
-        soundClips.removeChild(clipElement);
-        screenLogger("Uploaded ", fileName);
+const streamButton = document.querySelector('#streamButton');
+const partialText = document.querySelector('#partialText');
+let streamer = undefined;
 
-      } else {
-        // Print error...
-        screenLogger("Error uploading recording '"+fileName+"': ", response);
-      }
+const toggleStreaming = ()=>{
+  if(!streamer) {
+    const scheme = (window.location.protocol === "https:") ? "wss://" : "ws://";
+    streamer = voicecore.createStreamer({
+      url: streamButton.dataset.url || (scheme + window.location.hostname + ":8766"),
+      onPartial: (text)=>{ if(partialText) { partialText.textContent = text; } },
+      onFinal: (text, latency)=>{
+        if(partialText) { partialText.textContent = ""; }
+        userlog("Heard: ", text + " (" + Math.round(latency * 1000) + " ms)");
+      },
+      onAudio: (msg)=>{ console.log("Speaking", msg.text, "tier", msg.tier, "latency", msg.latency); },
     });
-
-    request.open("POST", "/");
-    request.send(formData);
-
-
+  }
+  if(streamer.isStreaming()) {
+    streamer.stop();
+    streamButton.style.background = "";
   } else {
-    // Throw an error or something? Cannot do anything...
-    screenLogger("You need to make a recording before you can save it to the list of voiceprints!")
-    console.log("No audio recordings", audioRecordings);
-    return;
+    streamer.start().then(()=>{
+      streamButton.style.background = "red";
+    }).catch((e)=>{
+      userlog("Could not connect to the streaming server: ", streamer.url);
+      streamer = undefined;
+    });
   }
+};
 
-});
-
-
-
-////// TODO
-
-
-
-// Set up dataset / prompt controls...
-
-const skipButton = document.querySelector('#skipButton');
-const nextButton = document.querySelector('#nextButton');
+if(streamButton) {
+  streamButton.addEventListener('click', toggleStreaming);
+}
 
 
 
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Load generation / soak testing for the ShibbolethWSS websocket server.
+
+N simulated stage clients connect to the server and send lines from a corpus
+at a fixed rate each (open loop: a client does not wait for the previous line
+to be spoken before sending the next one). The server echoes every message
+once it has been synthesized and played, so per message we record
+    ack latency         round trip of a websocket ping sent right after the message
+                        (how long the server's event loop takes to respond at all)
+    completion latency  until the echo of the message arrives (synthesis + playback queued)
+and count errors: failed connections, timeouts, wrong echoes, dropped connections.
+
+Run against a stub server (no model, synthesis time simulated from the text
+length), against a running server, or with --serve-tiny against shibboleth.py
+started with a tiny random VITS model (equivalence.tiny_vits, needs TTS and an
+audio output device), so the capacity numbers come from the real server:
+
+python loadtest.py stub --port 8765 --rtf 0.3
+python loadtest.py run --url ws://localhost:8765 --clients 8 --rate 0.5 --duration 60 --history loadtest-history.csv
+python loadtest.py run --serve-tiny --clients 4 --rate 0.2 --duration 60 --server-args="-d 3"
+"""
+import sys
+import csv
+import json
+import time
+import shlex
+import random
+import socket
+import asyncio
+import logging
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import List, Dict
+from urllib.parse import urlparse
+
+import numpy as np
+import websockets
+
+DEFAULT_CORPUS = [
+    "Please say the words as I repeat them.",
+    "Shibboleths have been used throughout history in many societies as passwords.",
+    "Simple ways of self-identification, signaling loyalty and affinity.",
+    "Maintaining traditional segregation, or protecting from real or perceived threats.",
+    "The quick brown fox jumps over the lazy dog.",
+    "How much wood would a woodchuck chuck?",
+]
+
+MESSAGE_FIELDS = ("client", "seq", "sent", "chars", "ack_latency", "completion_latency", "error")
+HISTORY_FIELDS = ("time", "label", "url", "clients", "rate", "duration", "messages", "completed", "errors", "error_rate",
+    "throughput", "ack_p50", "ack_p95", "ack_p99", "completion_p50", "completion_p95", "completion_p99")
+
+
+def load_corpus(path: Path = None) -> List[str]:
+    if path is None:
+        return DEFAULT_CORPUS
+    with open(path, "r", encoding="utf-8") as f:
+        lines = [line.strip() for line in f if line.strip() != ""]
+    if len(lines) == 0:
+        raise ValueError(f"Corpus {path} is empty")
+    return lines
+
+
+class LoadClient:
+    """
+    One simulated client.
+        idx         Client number, also its offset into the corpus
+        rate        Messages per second (0: send the next line as soon as the previous is echoed)
+        poisson     Exponentially distributed gaps instead of a fixed interval
+    """
+    def __init__(self, idx: int, url: str, corpus: List[str], rate: float, timeout: float, poisson: bool = False) -> None:
+        self.idx = idx
+        self.url = url
+        self.corpus = corpus
+        self.rate = rate
+        self.timeout = timeout
+        self.poisson = poisson
+        self.results = []
+        self.pending = dict() # seq -> result dict, in send order
+        self.echoed = None
+
+    def next_gap(self) -> float:
+        if self.rate <= 0:
+            return 0.0
+        return random.expovariate(self.rate) if self.poisson else 1.0 / self.rate
+
+    async def run(self, stop_time: float) -> List[Dict]:
+        try:
+            async with websockets.connect(self.url, open_timeout=self.timeout, max_queue=None) as ws:
+                await ws.send("Handshake!") # ShibbolethWSS does not reply to it
+                receiver = asyncio.ensure_future(self.receive(ws))
+                try:
+                    await self.send_loop(ws, stop_time)
+                    # wait for the outstanding echoes
+                    deadline = time.time() + self.timeout
+                    while len(self.pending) > 0 and time.time() < deadline and not receiver.done():
+                        await asyncio.sleep(0.05)
+                finally:
+                    receiver.cancel()
+        except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+            self.results.append(self.result(-1, "", error=f"connect: {type(e).__name__}: {e}"))
+
+        for result in self.pending.values():
+            result["error"] = result["error"] or "timeout"
+            self.results.append(result)
+        self.pending.clear()
+        return self.results
+
+    def result(self, seq: int, text: str, error: str = "") -> Dict:
+        return {"client": self.idx, "seq": seq, "sent": time.time(), "chars": len(text),
+            "ack_latency": None, "completion_latency": None, "error": error}
+
+    async def send_loop(self, ws, stop_time: float) -> None:
+        seq = 0
+        next_time = time.time()
+        while time.time() < stop_time:
+            text = self.corpus[(self.idx + seq) % len(self.corpus)]
+            result = self.result(seq, text)
+            result["text"] = text
+            self.pending[seq] = result
+            try:
+                await ws.send(text)
+                asyncio.ensure_future(self.measure_ack(ws, result))
+            except websockets.exceptions.ConnectionClosed as e:
+                result["error"] = f"closed: {e}"
+                return
+            seq += 1
+
+            if self.rate <= 0:
+                self.echoed = asyncio.get_running_loop().create_future()
+                try:
+                    await asyncio.wait_for(self.echoed, self.timeout)
+                except asyncio.TimeoutError:
+                    return
+            else:
+                next_time += self.next_gap()
+                await asyncio.sleep(max(0.0, next_time - time.time()))
+
+    async def measure_ack(self, ws, result: Dict) -> None:
+        start = time.time()
+        try:
+            pong_waiter = await ws.ping()
+            await asyncio.wait_for(pong_waiter, self.timeout)
+            result["ack_latency"] = time.time() - start
+        except (asyncio.TimeoutError, websockets.exceptions.ConnectionClosed):
+            pass
+
+    async def receive(self, ws) -> None:
+        """The server handles a connection's messages in order, so echoes arrive in send order."""
+        try:
+            async for message in ws:
+                if len(self.pending) == 0:
+                    continue
+                seq = next(iter(self.pending))
+                result = self.pending.pop(seq)
+                result["completion_latency"] = time.time() - result["sent"]
+                if message != result["text"]:
+                    result["error"] = "wrong echo"
+                self.results.append(result)
+                if self.echoed is not None and not self.echoed.done():
+                    self.echoed.set_result(True)
+        except websockets.exceptions.ConnectionClosed as e:
+            for result in self.pending.values():
+                result["error"] = f"closed: {e.code}"
+
+
+async def run_load(url: str, clients: int, rate: float, duration: float, corpus: List[str],
+    timeout: float = 30.0, ramp: float = 0.0, poisson: bool = False) -> List[Dict]:
+    """Run the clients (started evenly over `ramp` seconds) for `duration` seconds, returns per message results."""
+    start = time.time()
+    load_clients = [LoadClient(idx, url, corpus, rate, timeout, poisson) for idx in range(clients)]
+
+    async def start_client(client: LoadClient, delay: float):
+        await asyncio.sleep(delay)
+        return await client.run(start + ramp + duration)
+
+    delays = [ramp * idx / clients for idx in range(clients)]
+    per_client = await asyncio.gather(*(start_client(c, d) for c, d in zip(load_clients, delays)))
+    return sorted((r for results in per_client for r in results), key=lambda r: r["sent"])
+
+
+def summarize(results: List[Dict], elapsed: float) -> Dict:
+    """Latency percentiles, throughput and error rate of a run."""
+    messages = [r for r in results if r["seq"] >= 0]
+    completed = [r["completion_latency"] for r in messages if r["completion_latency"] is not None and not r["error"]]
+    acks = [r["ack_latency"] for r in messages if r["ack_latency"] is not None]
+    errors = [r for r in results if r["error"]]
+    summary = {
+        "messages": len(messages),
+        "completed": len(completed),
+        "errors": len(errors),
+        "error_rate": len(errors) / max(1, len(results)),
+        "throughput": len(completed) / elapsed if elapsed > 0 else 0.0,
+    }
+    for name, values in (("ack", acks), ("completion", completed)):
+        for p in (50, 95, 99):
+            summary[f"{name}_p{p}"] = float(np.percentile(values, p)) if len(values) > 0 else None
+    error_kinds = dict()
+    for r in errors:
+        kind = r["error"].split(":")[0]
+        error_kinds[kind] = error_kinds.get(kind, 0) + 1
+    summary["error_kinds"] = error_kinds
+    return summary
+
+
+class StubServer:
+    """
+    Speaks the ShibbolethWSS protocol without a model: every message is "synthesized"
+    for rtf * (audio duration estimated from the text length), then echoed back.
+        blocking    Block the event loop while synthesizing, like ShibbolethWSS does
+    """
+    def __init__(self, rtf: float = 0.3, chars_per_second: float = 15.0, blocking: bool = True, jitter: float = 0.1) -> None:
+        self.rtf = rtf
+        self.chars_per_second = chars_per_second
+        self.blocking = blocking
+        self.jitter = jitter
+        self.messages = 0
+
+    def synthesis_time(self, text: str) -> float:
+        audio_duration = len(text) / self.chars_per_second
+        return self.rtf * audio_duration * (1.0 + random.uniform(-self.jitter, self.jitter))
+
+    async def handler(self, websocket, path=None):
+        async for message in websocket:
+            if message == "Handshake!":
+                continue # not answered, like ShibbolethWSS
+            if message.strip() != "":
+                self.messages += 1
+                if self.blocking:
+                    time.sleep(self.synthesis_time(message))
+                else:
+                    await asyncio.sleep(self.synthesis_time(message))
+            await websocket.send(message) # echo message back to the client
+
+    async def main(self, host: str, port: int):
+        print(f"Stub synthesis server on ws://{host}:{port} (rtf {self.rtf}, {'blocking' if self.blocking else 'async'})")
+        async with websockets.serve(self.handler, host, port):
+            await asyncio.Future()  # run forever
+
+
+class TinyServer:
+    """
+    shibboleth.py with a tiny random VITS model (see equivalence.tiny_vits) in a subprocess.
+        server_args         Further shibboleth.py arguments (e.g. the output device)
+        startup_timeout     Seconds to wait for the server to accept connections
+    """
+    def __init__(self, host: str = "localhost", port: int = 8765, server_args: List[str] = (),
+        startup_timeout: float = 300.0) -> None:
+        self.host = host
+        self.port = port
+        self.server_args = list(server_args)
+        self.startup_timeout = startup_timeout
+        self.tmpdir = None
+        self.process = None
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}"
+
+    def start(self) -> str:
+        """Write the model, start the server and wait until it accepts connections. Returns its url."""
+        import equivalence
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        model_dir = Path(self.tmpdir.name) / "tiny"
+        equivalence.tiny_vits(model_dir)
+        server = Path(__file__).resolve().parent / "shibboleth.py"
+        cmd = [sys.executable, str(server), "--model-path", str(model_dir), "--host", self.host, "--port", str(self.port),
+            "--output-path", self.tmpdir.name] + self.server_args
+        print(f"Starting {' '.join(shlex.quote(c) for c in cmd)}")
+        self.process = subprocess.Popen(cmd, cwd=server.parent)
+
+        deadline = time.time() + self.startup_timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"shibboleth.py exited with code {self.process.returncode} during startup")
+            try:
+                socket.create_connection((self.host, self.port), timeout=1.0).close()
+                return self.url
+            except OSError:
+                time.sleep(0.5)
+        self.stop()
+        raise RuntimeError(f"shibboleth.py did not accept connections within {self.startup_timeout}s")
+
+    def stop(self) -> None:
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self.tmpdir is not None:
+            self.tmpdir.cleanup()
+            self.tmpdir = None
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Websocket load generation for ShibbolethWSS.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run simulated clients against a server")
+    run_parser.add_argument("--url", type=str, default="ws://localhost:8765")
+    run_parser.add_argument("--clients", type=int, default=4, help="Number of simulated clients")
+    run_parser.add_argument("--rate", type=float, default=0.5, help="Messages per second per client (0: closed loop, wait for each echo)")
+    run_parser.add_argument("--poisson", action="store_true", help="Random (exponential) gaps between messages instead of a fixed rate")
+    run_parser.add_argument("--duration", type=float, default=30.0, help="Seconds to send for (soak tests: hours)")
+    run_parser.add_argument("--ramp", type=float, default=0.0, help="Seconds over which the clients are started")
+    run_parser.add_argument("--timeout", type=float, default=30.0, help="Seconds to wait for an echo before counting a timeout")
+    run_parser.add_argument("--corpus", type=Path, default=None, help="Text file with one message per line")
+    run_parser.add_argument("--output", type=Path, default=None, help="Write per message results to this CSV file")
+    run_parser.add_argument("--history", type=Path, default=None, help="Append the run summary to this CSV file, to track capacity over time")
+    run_parser.add_argument("--label", type=str, default="", help="Label for the run in the history file (e.g. a commit id)")
+    run_parser.add_argument("--serve-tiny", action="store_true", help="Start shibboleth.py with a tiny random VITS model on the --url port and run against it")
+    run_parser.add_argument("--server-args", type=str, default="", help="Further shibboleth.py arguments for --serve-tiny (e.g. \"-d 3\")")
+
+    stub_parser = subparsers.add_parser("stub", help="Run a stub synthesis server")
+    stub_parser.add_argument("--host", type=str, default="localhost")
+    stub_parser.add_argument("--port", type=int, default=8765)
+    stub_parser.add_argument("--rtf", type=float, default=0.3, help="Simulated real-time factor of synthesis")
+    stub_parser.add_argument("--chars-per-second", type=float, default=15.0, help="Speaking rate used to estimate audio duration")
+    stub_parser.add_argument("--async", dest="async_synthesis", action="store_true", help="Do not block the event loop while synthesizing")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.command == "stub":
+        stub = StubServer(rtf=args.rtf, chars_per_second=args.chars_per_second, blocking=not args.async_synthesis)
+        try:
+            asyncio.run(stub.main(args.host, args.port))
+        except KeyboardInterrupt:
+            print(f"Stub server handled {stub.messages} messages")
+        sys.exit(0)
+
+    corpus = load_corpus(args.corpus)
+    server = None
+    if args.serve_tiny:
+        url = urlparse(args.url)
+        server = TinyServer(url.hostname or "localhost", url.port or 8765, shlex.split(args.server_args))
+        server.start()
+    print(f"{args.clients} clients x {args.rate} msg/s against {args.url} for {args.duration}s")
+    start = time.time()
+    try:
+        results = asyncio.run(run_load(args.url, args.clients, args.rate, args.duration, corpus,
+            timeout=args.timeout, ramp=args.ramp, poisson=args.poisson))
+    finally:
+        if server is not None:
+            server.stop()
+    elapsed = time.time() - start
+    summary = summarize(results, elapsed)
+    print(json.dumps(summary, indent=2))
+
+    if args.output is not None:
+        with open(args.output, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=MESSAGE_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(results)
+
+    if args.history is not None:
+        row = dict(summary, time=start, label=args.label, url=args.url, clients=args.clients, rate=args.rate, duration=args.duration)
+        new_file = not args.history.exists()
+        with open(args.history, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=HISTORY_FIELDS, extrasaction="ignore")
+            if new_file:
+                writer.writeheader()
+            writer.writerow(row)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Declarative model manifests.
+
+A manifest is a JSON file naming every model a process should load, with
+its files as named fields instead of VoiceSynth.load_models' positional
+lists, optional sha256 checksums per file, and a preload flag (models that
+are not preloaded are loaded on first use):
+
+{
+    "root": "../outputs/checkpoints",
+    "models": [
+        {"name": "effiamir", "model_path": "efam48_220k/model_file.pth", "config_path": "efam48_220k/config.json",
+         "sha256": {"model_path": "3f0c..."}},
+        {"name": "effi", "model_path": "effi50_160k/model_file.pth", "config_path": "effi50_160k/config.json",
+         "vocoder_path": "hifigan/model_file.pth", "vocoder_config_path": "hifigan/config.json", "preload": false}
+    ]
+}
+
+Relative paths are relative to "root", which itself is relative to the manifest file.
+Manifests are validated before anything is loaded, VoiceSynth.load_specs() loads
+the models concurrently.
+
+python modelspec.py init effiamir=../outputs/checkpoints/efam48_220k effi=../outputs/checkpoints/effi50_160k --checksums > models.json
+python modelspec.py check models.json
+"""
+import os
+import json
+import hashlib
+from pathlib import Path
+from typing import List, Dict, Union
+
+PATH_FIELDS = ("model_path", "config_path", "speakers_file", "language_ids_file",
+    "vocoder_path", "vocoder_config_path", "encoder_path", "encoder_config_path")
+PAIRED_FIELDS = (("vocoder_path", "vocoder_config_path"), ("encoder_path", "encoder_config_path"))
+
+
+def file_sha256(path: Union[str, Path], blocksize: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class ModelSpec:
+    """
+    One TTS model (and optionally its vocoder and speaker encoder).
+        name                Model id used with VoiceSynth.synthesize()
+        model_path          TTS checkpoint
+        config_path         TTS config.json
+        speakers_file       speakers.json / d-vector file of multi-speaker models
+        language_ids_file   language_ids.json of multi-lingual models
+        vocoder_path        Vocoder checkpoint (models without one use their own decoder / Griffin-Lim)
+        vocoder_config_path Vocoder config.json
+        encoder_path        Speaker encoder checkpoint
+        encoder_config_path Speaker encoder config.json
+        sha256              Expected sha256 per path field, checked before loading
+        preload             Load at startup, otherwise on first use
+    """
+    def __init__(self, name: str, model_path: str, config_path: str,
+        speakers_file: str = None, language_ids_file: str = None,
+        vocoder_path: str = None, vocoder_config_path: str = None,
+        encoder_path: str = None, encoder_config_path: str = None,
+        sha256: Dict[str, str] = None, preload: bool = True) -> None:
+        self.name = name
+        self.model_path = model_path
+        self.config_path = config_path
+        self.speakers_file = speakers_file
+        self.language_ids_file = language_ids_file
+        self.vocoder_path = vocoder_path
+        self.vocoder_config_path = vocoder_config_path
+        self.encoder_path = encoder_path
+        self.encoder_config_path = encoder_config_path
+        self.sha256 = dict(sha256) if sha256 is not None else dict()
+        self.preload = preload
+
+    def __repr__(self) -> str:
+        return f"ModelSpec({self.name}: {self.model_path})"
+
+    def paths(self) -> Dict[str, str]:
+        """The path fields that are set."""
+        return {field: getattr(self, field) for field in PATH_FIELDS if getattr(self, field) is not None}
+
+    def resolve(self, root: Union[str, Path]) -> "ModelSpec":
+        """A copy with all relative paths made relative to root."""
+        resolved = dict(self.to_dict())
+        for field, path in self.paths().items():
+            resolved[field] = os.path.join(root, path)
+        return ModelSpec(**resolved)
+
+    def problems(self, check_files: bool = True) -> List[str]:
+        """Everything wrong with the spec, without computing checksums."""
+        problems = []
+        if not self.name:
+            problems.append("model without a name")
+        for field in ("model_path", "config_path"):
+            if getattr(self, field) is None:
+                problems.append(f"{self.name}: {field} is required")
+        for a, b in PAIRED_FIELDS:
+            if (getattr(self, a) is None) != (getattr(self, b) is None):
+                problems.append(f"{self.name}: {a} and {b} go together")
+        for field, digest in self.sha256.items():
+            if field not in PATH_FIELDS:
+                problems.append(f"{self.name}: checksum for unknown field '{field}'")
+            elif getattr(self, field) is None:
+                problems.append(f"{self.name}: checksum for {field}, which is not set")
+            if not isinstance(digest, str) or len(digest) != 64:
+                problems.append(f"{self.name}: {field} checksum is not a sha256 hex digest")
+        if check_files:
+            for field, path in self.paths().items():
+                if not os.path.isfile(path):
+                    problems.append(f"{self.name}: {field} does not exist: {path}")
+        return problems
+
+    def verify_checksums(self) -> None:
+        """Raise ValueError if a file does not match its checksum."""
+        for field, digest in self.sha256.items():
+            actual = file_sha256(getattr(self, field))
+            if actual != digest.lower():
+                raise ValueError(f"{self.name}: checksum mismatch for {field} {getattr(self, field)}: {actual} != {digest}")
+
+    def fingerprint(self) -> str:
+        """
+        Short id of the checkpoint files: from their sha256 checksums if the spec has them, otherwise
+        from their paths, sizes and modification times (cheap, changes when a checkpoint is rewritten).
+        """
+        h = hashlib.sha256()
+        for field, path in sorted(self.paths().items()):
+            if field in self.sha256:
+                h.update(f"{field}={self.sha256[field].lower()}\n".encode("utf-8"))
+            else:
+                st = os.stat(path)
+                h.update(f"{field}={os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}\n".encode("utf-8"))
+        return h.hexdigest()[:16]
+
+    def to_dict(self) -> Dict:
+        data = {"name": self.name}
+        data.update(self.paths())
+        if len(self.sha256) > 0:
+            data["sha256"] = dict(self.sha256)
+        data["preload"] = self.preload
+        return data
+
+    def to_legacy(self) -> list:
+        """The positional spec list of VoiceSynth.load_models()."""
+        return [getattr(self, field) for field in PATH_FIELDS]
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ModelSpec":
+        unknown = set(data) - set(PATH_FIELDS) - {"name", "sha256", "preload"}
+        if len(unknown) > 0:
+            raise ValueError(f"Unknown model spec fields for '{data.get('name')}': {sorted(unknown)}")
+        return cls(**data)
+
+    @classmethod
+    def from_legacy(cls, name: str, spec: list, root: Union[str, Path] = None) -> "ModelSpec":
+        """From a load_models() spec list, relative paths joined to root."""
+        model_spec = cls(name, **dict(zip(PATH_FIELDS, spec)))
+        return model_spec.resolve(root) if root is not None else model_spec
+
+    @classmethod
+    def from_model_dir(cls, name: str, model_dir: Union[str, Path], checksums: bool = False) -> "ModelSpec":
+        """
+        Spec of a model directory as written by TTS training: model_file.pth (or a single other
+        checkpoint) and config.json, plus speakers.json / language_ids.json if present.
+        """
+        model_dir = Path(model_dir)
+        if not model_dir.is_dir():
+            raise ValueError(f"Model Path Does Not Exist: {model_dir}")
+        fields = dict()
+        for field, preferred, pattern in (("model_path", "model_file.pth", "*.pth"), ("config_path", "config.json", "config*.json")):
+            if (model_dir / preferred).exists():
+                fields[field] = str(model_dir / preferred)
+                continue
+            candidates = sorted(model_dir.glob(pattern))
+            if len(candidates) != 1:
+                raise ValueError(f"Expected {preferred} or exactly one {pattern} in {model_dir}, found {[c.name for c in candidates]}")
+            fields[field] = str(candidates[0])
+        for field, filename in (("speakers_file", "speakers.json"), ("language_ids_file", "language_ids.json")):
+            if (model_dir / filename).exists():
+                fields[field] = str(model_dir / filename)
+        spec = cls(name, **fields)
+        if checksums:
+            spec.sha256 = {field: file_sha256(path) for field, path in spec.paths().items()}
+        return spec
+
+
+def validate(specs: List[ModelSpec], check_files: bool = True) -> None:
+    """Raise ValueError listing every problem of the specs (checksums are checked when loading)."""
+    problems = []
+    names = [spec.name for spec in specs]
+    for name in sorted(set(names)):
+        if names.count(name) > 1:
+            problems.append(f"duplicate model name '{name}'")
+    for spec in specs:
+        problems += spec.problems(check_files)
+    if len(problems) > 0:
+        raise ValueError("Invalid model manifest:\n  " + "\n  ".join(problems))
+
+
+def load_manifest(path: Union[str, Path], check_files: bool = True) -> List[ModelSpec]:
+    """Read and validate a manifest. Returns its specs with resolved paths."""
+    path = Path(path)
+    with open(path) as f:
+        manifest = json.load(f)
+    root = path.parent / manifest.get("root", ".")
+    specs = [ModelSpec.from_dict(data).resolve(root) for data in manifest["models"]]
+    validate(specs, check_files)
+    return specs
+
+
+def save_manifest(specs: List[ModelSpec], path: Union[str, Path] = None) -> str:
+    """Manifest JSON of specs (paths as given), written to path if not None."""
+    text = json.dumps({"models": [spec.to_dict() for spec in specs]}, indent=2)
+    if path is not None:
+        with open(path, "w") as f:
+            f.write(text + "\n")
+    return text
+
+
+def specs_from_args(args, name: str = "vits") -> List[ModelSpec]:
+    """--models manifest if given, otherwise the --model-path directory as model `name`."""
+    if getattr(args, "models", None) is not None:
+        return load_manifest(args.models)
+    specs = [ModelSpec.from_model_dir(name, Path(args.model_path).resolve())]
+    validate(specs)
+    return specs
+
+
+def default_model(specs: List[ModelSpec], preferred: str = None) -> str:
+    """preferred if the specs have it, else the first preloaded model."""
+    names = [spec.name for spec in specs]
+    if preferred in names:
+        return preferred
+    preloaded = [spec.name for spec in specs if spec.preload]
+    return preloaded[0] if len(preloaded) > 0 else names[0]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Create and check model manifests.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    init_parser = subparsers.add_parser("init", help="Manifest for model directories, printed or written to --output")
+    init_parser.add_argument("models", type=str, nargs="+", help="Models as name=model_directory")
+    init_parser.add_argument("--checksums", action="store_true", help="Include sha256 checksums of all files")
+    init_parser.add_argument("--output", type=Path, default=None)
+    check_parser = subparsers.add_parser("check", help="Validate a manifest and verify its checksums")
+    check_parser.add_argument("manifest", type=Path)
+    args = parser.parse_args()
+
+    if args.command == "init":
+        specs = []
+        for item in args.models:
+            name, model_dir = item.split("=", 1) if "=" in item else (Path(item).name, item)
+            specs.append(ModelSpec.from_model_dir(name, Path(model_dir).resolve(), checksums=args.checksums))
+        validate(specs)
+        print(save_manifest(specs, args.output))
+    elif args.command == "check":
+        specs = load_manifest(args.manifest)
+        for spec in specs:
+            spec.verify_checksums()
+            print(f"{spec.name}: ok ({len(spec.sha256)} checksums, {'preload' if spec.preload else 'on demand'})")
@@ -9,6 +9,8 @@ import librosa # this is necessary for some reason...
 from datetime import datetime
 #import torch
 
+import audioio
+
 if __name__ == "__main__":
     import argparse
     import logging
@@ -62,16 +64,15 @@ if __name__ == "__main__":
     DEV_INFO = sd.query_devices(DEVICE)
     print(f"Device info: {DEV_INFO}")
     print(f"Device Sample Rate is: {DEV_INFO['default_samplerate']}")
-    # Load file...
-    DEV_SAMPLERATE=DEV_INFO['default_samplerate']
-    wavdata, sr = librosa.load(str(args.wav.resolve()))  #, sr=DEV_SR)
-    print(f"Loaded file: {args.wav.resolve()} with sr 22050 and data {wavdata.shape}")
+    # Open file... (nothing is decoded yet, WAVs are memory-mapped, other formats are streamed)
+    DEV_SAMPLERATE=int(DEV_INFO['default_samplerate'])
+    reader = audioio.AudioReader(args.wav.resolve(), samplerate=DEV_SAMPLERATE)
+    print(f"Opened file: {args.wav.resolve()} ({reader.backend}) with sr {reader.file_samplerate} and duration {reader.duration}")
 
-    # If DEV_SAMPLERATE != sr then we have a problem and need to resample...
-    if(DEV_SAMPLERATE != sr):
-        wavdata = librosa.resample(wavdata, orig_sr=sr, target_sr=DEV_SAMPLERATE)
+    # If DEV_SAMPLERATE != sr the file is resampled block by block while playing...
+    if(DEV_SAMPLERATE != reader.file_samplerate):
+        print(f"Resampling from {reader.file_samplerate} to {DEV_SAMPLERATE}")
 
     # PLay file...
-    print(f"Playing with SR: {sr} on device: {DEVICE}")
-    sd.play(wavdata, blocking=False, device=DEVICE)
-    sd.wait()
+    print(f"Playing with SR: {DEV_SAMPLERATE} on device: {DEVICE}")
+    audioio.play_stream(reader, device=DEVICE)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Opt-in memory and hot-path profiling for long running installations.
+
+A Profiler writes everything to one output directory, as files that can be
+diffed between runs:
+    memory.csv                  process RSS, traced python memory, torch allocator stats per snapshot
+    snapshot_0003.tracemalloc   raw tracemalloc snapshots (compare with `python profiling.py diff`)
+    top_0003.txt                top-N allocation sites, and the top-N growth since the previous
+                                and since the first snapshot
+    requests.csv                per request (e.g. pr_synthesize call): wall time, allocated blocks
+                                and traced memory growth
+    stacks_<time>.txt           stacks of all threads, on SIGUSR1 or dump_stacks()
+
+tracemalloc slows allocation down noticeably, so this is for finding leaks, not for production runs.
+
+python shibboleth.py --profile tmp/profile ...
+kill -USR1 <pid>                                    # dump stacks
+python profiling.py diff run1/snapshot_0001.tracemalloc run2/snapshot_0012.tracemalloc
+"""
+import os
+import sys
+import time
+import signal
+import logging
+import functools
+import threading
+import traceback
+import tracemalloc
+from contextlib import contextmanager
+from logging import Logger
+from pathlib import Path
+from typing import Union, Dict, List
+
+MEMORY_FIELDS = ("time", "snapshot", "rss_bytes", "traced_bytes", "traced_peak_bytes", "allocated_blocks",
+    "torch_allocated_bytes", "torch_reserved_bytes", "torch_num_alloc_retries")
+REQUEST_FIELDS = ("time", "name", "thread", "wall_time", "allocated_blocks", "traced_growth_bytes")
+
+
+def rss_bytes() -> int:
+    """Resident set size of this process (0 where it cannot be read)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        try:
+            import resource
+            scale = 1 if sys.platform == "darwin" else 1024 # ru_maxrss is in bytes on macOS, KiB on Linux
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+        except ImportError:
+            return 0
+
+
+def torch_allocator_stats() -> Dict:
+    """CUDA caching allocator stats, if torch is loaded and CUDA is in use."""
+    stats = {"torch_allocated_bytes": "", "torch_reserved_bytes": "", "torch_num_alloc_retries": ""}
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_available() or not torch.cuda.is_initialized():
+        return stats
+    memory_stats = torch.cuda.memory_stats()
+    stats["torch_allocated_bytes"] = memory_stats.get("allocated_bytes.all.current", 0)
+    stats["torch_reserved_bytes"] = memory_stats.get("reserved_bytes.all.current", 0)
+    stats["torch_num_alloc_retries"] = memory_stats.get("num_alloc_retries", 0)
+    return stats
+
+
+def format_stacks() -> str:
+    """Stacks of all running threads."""
+    names = {t.ident: t.name for t in threading.enumerate()}
+    lines = [f"# {time.strftime('%Y-%m-%d %H:%M:%S')} pid {os.getpid()}\n"]
+    for ident, frame in sys._current_frames().items():
+        lines.append(f"\n--- Thread {names.get(ident, '?')} ({ident}) ---\n")
+        lines.extend(traceback.format_stack(frame))
+    return "".join(lines)
+
+
+def format_top(stats: List, title: str) -> str:
+    lines = [f"{title}\n"]
+    for stat in stats:
+        lines.append(f"{stat}\n")
+    return "".join(lines) + "\n"
+
+
+class Profiler:
+    """
+        output_dir      Directory for all profiling output (created if needed)
+        interval        Seconds between tracemalloc snapshots (0: only on demand)
+        top_n           Number of allocation sites in the top lists
+        frames          Stack depth recorded per allocation
+    """
+    def __init__(self, output_dir: Union[str, Path], interval: float = 300.0, top_n: int = 25, frames: int = 1,
+        logger: Logger = None) -> None:
+        self.output_dir = Path(output_dir)
+        self.interval = interval
+        self.top_n = top_n
+        self.frames = frames
+        self.log = logger if logger is not None else logging.getLogger("Profiler")
+        self.lock = threading.Lock()
+        self.snapshot_num = 0
+        self.first_snapshot = None
+        self.last_snapshot = None
+        self.running = False
+        self.thread = None
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        for filename, fields in (("memory.csv", MEMORY_FIELDS), ("requests.csv", REQUEST_FIELDS)):
+            path = self.output_dir / filename
+            if not path.exists():
+                with open(path, "w") as f:
+                    f.write(",".join(fields) + "\n")
+
+    def start(self) -> None:
+        """Start tracing, take the first snapshot and start the snapshot thread."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self.running = True
+        self.snapshot()
+        if self.interval > 0:
+            self.thread = threading.Thread(target=self.snapshotThread, name="profiler", daemon=True)
+            self.thread.start()
+        self.log.info(f"Profiling to {self.output_dir}, snapshots every {self.interval}s")
+
+    def stop(self) -> None:
+        """Take a last snapshot and stop tracing."""
+        self.running = False
+        if tracemalloc.is_tracing():
+            self.snapshot()
+            tracemalloc.stop()
+
+    def snapshotThread(self) -> None:
+        next_time = time.time() + self.interval
+        while self.running:
+            time.sleep(min(1.0, max(0.0, next_time - time.time())))
+            if time.time() >= next_time and self.running:
+                self.snapshot()
+                next_time += self.interval
+
+    def snapshot(self) -> str:
+        """Take a tracemalloc snapshot, write it and its top-N / growth lists. Returns the lists as text."""
+        with self.lock:
+            self.snapshot_num += 1
+            num = self.snapshot_num
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            ))
+            snapshot.dump(str(self.output_dir / f"snapshot_{num:04d}.tracemalloc"))
+
+            report = format_top(snapshot.statistics("lineno")[:self.top_n], f"# Top {self.top_n} allocation sites, snapshot {num}")
+            if self.last_snapshot is not None:
+                report += format_top(snapshot.compare_to(self.last_snapshot, "lineno")[:self.top_n],
+                    f"# Top {self.top_n} changes since snapshot {num - 1}")
+            if self.first_snapshot is not None:
+                report += format_top(snapshot.compare_to(self.first_snapshot, "lineno")[:self.top_n],
+                    f"# Top {self.top_n} changes since snapshot 1")
+            with open(self.output_dir / f"top_{num:04d}.txt", "w") as f:
+                f.write(report)
+
+            if self.first_snapshot is None:
+                self.first_snapshot = snapshot
+            self.last_snapshot = snapshot
+
+            traced, peak = tracemalloc.get_traced_memory()
+            row = {
+                "time": time.time(),
+                "snapshot": num,
+                "rss_bytes": rss_bytes(),
+                "traced_bytes": traced,
+                "traced_peak_bytes": peak,
+                "allocated_blocks": sys.getallocatedblocks(),
+            }
+            row.update(torch_allocator_stats())
+            with open(self.output_dir / "memory.csv", "a") as f:
+                f.write(",".join(str(row[field]) for field in MEMORY_FIELDS) + "\n")
+        self.log.info(f"Memory snapshot {num}: rss {row['rss_bytes'] / 1e6:.1f} MB, traced {traced / 1e6:.1f} MB")
+        return report
+
+    @contextmanager
+    def request(self, name: str):
+        """
+        Count what a request allocates: allocated blocks and traced memory before/after.
+        Requests running in parallel are counted together (tracemalloc is process wide).
+        There is no per-request peak: resetting tracemalloc's peak would also reset it for
+        the snapshots and for requests running in parallel.
+        """
+        start_time = time.time()
+        start_blocks = sys.getallocatedblocks()
+        start_traced, _ = tracemalloc.get_traced_memory()
+        try:
+            yield
+        finally:
+            traced, _ = tracemalloc.get_traced_memory()
+            row = {
+                "time": start_time,
+                "name": name,
+                "thread": threading.current_thread().name,
+                "wall_time": time.time() - start_time,
+                "allocated_blocks": sys.getallocatedblocks() - start_blocks,
+                "traced_growth_bytes": traced - start_traced,
+            }
+            with self.lock, open(self.output_dir / "requests.csv", "a") as f:
+                f.write(",".join(str(row[field]) for field in REQUEST_FIELDS) + "\n")
+
+    def dump_stacks(self) -> str:
+        """Write the stacks of all threads to a stacks_<time>.txt file. Returns the text."""
+        text = format_stacks()
+        path = self.output_dir / f"stacks_{time.strftime('%Y%m%d-%H%M%S')}_{int(time.time() * 1000) % 1000:03d}.txt"
+        with open(path, "w") as f:
+            f.write(text)
+        self.log.info(f"Wrote thread stacks to {path}")
+        return text
+
+    def install_signal_handler(self, signum: int = None) -> None:
+        """Dump stacks on SIGUSR1 (where available)."""
+        if signum is None:
+            signum = getattr(signal, "SIGUSR1", None)
+        if signum is None:
+            self.log.warning("No SIGUSR1 on this platform, stack dumps only on request")
+            return
+        signal.signal(signum, lambda signum, frame: self.dump_stacks())
+
+
+def profiled(name: str):
+    """
+    Method decorator: count the call as a request on self.profiler, if it is set.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            profiler = getattr(self, "profiler", None)
+            if profiler is None:
+                return method(self, *args, **kwargs)
+            with profiler.request(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add_profile_args(parser) -> None:
+    """Profiling command line options shared by the entry points."""
+    parser.add_argument("--profile", type=Path, default=None, help="Write memory / allocation profiling output to this directory (slows things down)")
+    parser.add_argument("--profile-interval", type=float, default=300.0, help="Seconds between memory snapshots when profiling")
+    parser.add_argument("--profile-top", type=int, default=25, help="Number of allocation sites listed per snapshot")
+
+
+def start_from_args(args, logger: Logger = None) -> Union[Profiler, None]:
+    """Start a Profiler (with the SIGUSR1 stack dump) if --profile was given."""
+    if args.profile is None:
+        return None
+    profiler = Profiler(args.profile, interval=args.profile_interval, top_n=args.profile_top, logger=logger)
+    profiler.start()
+    if threading.current_thread() is threading.main_thread():
+        profiler.install_signal_handler()
+    return profiler
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare tracemalloc snapshots, e.g. from two runs.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    diff_parser = subparsers.add_parser("diff", help="Top allocation changes from one snapshot to another")
+    diff_parser.add_argument("old", type=Path)
+    diff_parser.add_argument("new", type=Path)
+    diff_parser.add_argument("--top", type=int, default=25)
+    diff_parser.add_argument("--group-by", type=str, default="lineno", choices=["lineno", "filename", "traceback"])
+    args = parser.parse_args()
+
+    old = tracemalloc.Snapshot.load(str(args.old))
+    new = tracemalloc.Snapshot.load(str(args.new))
+    print(format_top(new.compare_to(old, args.group_by)[:args.top], f"# Top {args.top} changes {args.old} -> {args.new}"))
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Server-side prompt scheduler for recording sessions.
+
+The prompt corpus is loaded into memory once and put into a word coverage
+order: every prompt in the ordered corpus adds as many words not yet seen in
+the prompts before it as possible. Each speaker walks through this order
+starting at a different offset, so the speakers together cover the corpus
+(and its vocabulary) as quickly as possible instead of all recording the
+same first few hundred lines.
+
+Recordings are balanced across the corpus: the next prompt is the least
+recorded one (across all speakers) among the first few of the speaker's
+queue, so prompts other speakers already recorded move back. Skipping is a
+deque append. Every speaker session has its own lock, only the shared
+per-prompt counters are guarded by a (very briefly held) global lock.
+
+python promptscheduler.py --prompts prompts.txt --speakers effi amir --num 5
+"""
+import re
+import heapq
+import threading
+from collections import deque
+from pathlib import Path
+from typing import List, Dict, Set, Union
+
+GOLDEN_RATIO = 0.6180339887498949
+
+WORD_REGEX = re.compile(r"[\w']+")
+
+
+def load_prompts(prompts_path: Union[str, Path]) -> List[str]:
+    """One prompt per line, blank lines and lines starting with # are ignored."""
+    prompts = []
+    with open(prompts_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line != "" and not line.startswith("#"):
+                prompts.append(line)
+    return prompts
+
+
+def prompt_units(prompt: str) -> Set[str]:
+    """The coverage units of a prompt (lowercased word types)."""
+    return set(WORD_REGEX.findall(prompt.lower()))
+
+
+def coverage_order(prompts: List[str]) -> List[int]:
+    """
+    Order prompt indices greedily by the number of new coverage units each prompt adds.
+    Uses lazy evaluation: a prompt's gain can only shrink as coverage grows, so stale
+    heap entries are re-scored only when they reach the top.
+    """
+    units = [prompt_units(p) for p in prompts]
+    heap = [(-len(u), idx) for idx, u in enumerate(units)]
+    heapq.heapify(heap)
+    covered = set()
+    order = []
+    while heap:
+        neg_gain, idx = heapq.heappop(heap)
+        gain = len(units[idx] - covered)
+        if heap and gain < -heap[0][0]:
+            heapq.heappush(heap, (-gain, idx)) # stale score, re-queue
+            continue
+        covered |= units[idx]
+        order.append(idx)
+    return order
+
+
+class SpeakerSession:
+    """Per speaker prompt queue. All operations are O(1)."""
+    def __init__(self, speaker: str, queue: deque) -> None:
+        self.speaker = speaker
+        self.queue = queue
+        self.current = None # prompt index handed out and not yet recorded or skipped
+        self.recorded = 0
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+
+class PromptScheduler:
+    """
+    Hands out prompts to speakers for recording sessions.
+
+        prompts     List of prompt texts (the corpus, held in memory)
+        recorded    Optional {speaker: [prompt text, ...]} of already recorded prompts,
+                    e.g. from the dataset manifest, which are not served again
+        lookahead   Number of queued prompts the least recorded one is picked from
+    """
+    def __init__(self, prompts: List[str], recorded: Dict[str, List[str]] = None, lookahead: int = 32) -> None:
+        self.prompts = prompts
+        self.index = {prompt: idx for idx, prompt in enumerate(prompts)}
+        self.order = coverage_order(prompts)
+        self.counts = [0] * len(prompts) # number of recordings per prompt, across all speakers
+        self.lookahead = max(1, lookahead)
+        self.sessions = dict()
+        self._counts_lock = threading.Lock()
+        self._sessions_lock = threading.Lock()
+        self.recorded = recorded if recorded is not None else dict()
+
+        for texts in self.recorded.values():
+            for text in texts:
+                if text in self.index:
+                    self.counts[self.index[text]] += 1
+
+    @classmethod
+    def from_file(cls, prompts_path: Union[str, Path], dataset=None) -> "PromptScheduler":
+        """Load the corpus from a text file and seed coverage from a DatasetStore, if given."""
+        recorded = dict()
+        if dataset is not None:
+            for clip in dataset.query():
+                recorded.setdefault(clip["speaker"], []).append(clip["prompt"])
+        return cls(load_prompts(prompts_path), recorded)
+
+    def session(self, speaker: str) -> SpeakerSession:
+        """Get (or create) the session of a speaker."""
+        session = self.sessions.get(speaker)
+        if session is not None:
+            return session
+
+        with self._sessions_lock:
+            if speaker not in self.sessions:
+                # Start every new speaker at a different offset of the coverage order
+                num = len(self.order)
+                offset = int(len(self.sessions) * GOLDEN_RATIO * num) % num if num > 0 else 0
+                done = set(self.index[p] for p in self.recorded.get(speaker, []) if p in self.index)
+                queue = deque(idx for idx in self.order[offset:] + self.order[:offset] if idx not in done)
+                self.sessions[speaker] = SpeakerSession(speaker, queue)
+            return self.sessions[speaker]
+
+    def pick(self, queue: deque) -> int:
+        """Remove and return the least recorded prompt among the first `lookahead` of a queue (the earliest on ties)."""
+        with self._counts_lock:
+            best = min(range(min(self.lookahead, len(queue))), key=lambda i: self.counts[queue[i]])
+        idx = queue[best]
+        del queue[best]
+        return idx
+
+    def next_prompt(self, speaker: str) -> Union[Dict, None]:
+        """
+        Get the prompt a speaker should record next.
+        Asking again without recording or skipping returns the same prompt.
+        Returns None when the speaker has recorded the whole corpus.
+        """
+        session = self.session(speaker)
+        with session.lock:
+            if session.current is None:
+                if not session.queue:
+                    return None
+                session.current = self.pick(session.queue)
+            idx = session.current
+        return {"index": idx, "prompt": self.prompts[idx], "remaining": len(session.queue)}
+
+    def skip(self, speaker: str) -> Union[Dict, None]:
+        """Put the current prompt at the back of the speaker's queue and return the next one."""
+        session = self.session(speaker)
+        with session.lock:
+            if session.current is not None:
+                session.queue.append(session.current)
+                session.current = None
+                session.skipped += 1
+        return self.next_prompt(speaker)
+
+    def mark_recorded(self, speaker: str, prompt_index: int = None) -> None:
+        """Record that a speaker recorded a prompt (by default their current prompt), it is not served to them again."""
+        session = self.session(speaker)
+        with session.lock:
+            if prompt_index is None or prompt_index == session.current:
+                prompt_index = session.current
+                session.current = None
+            elif prompt_index in session.queue:
+                session.queue.remove(prompt_index)
+            if prompt_index is None:
+                return
+            session.recorded += 1
+        with self._counts_lock:
+            self.counts[prompt_index] += 1
+
+    def coverage(self) -> Dict:
+        """Coverage stats of the corpus and per speaker."""
+        with self._counts_lock:
+            counts = list(self.counts)
+        return {
+            "prompts": len(self.prompts),
+            "prompts_recorded": sum(1 for c in counts if c > 0),
+            "recordings": sum(counts),
+            "speakers": {
+                speaker: {"recorded": s.recorded, "skipped": s.skipped, "remaining": len(s.queue)}
+                for speaker, s in list(self.sessions.items())
+            },
+        }
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Prompt scheduler for recording sessions.")
+    parser.add_argument("--prompts", type=Path, required=True, help="Prompt corpus, one prompt per line")
+    parser.add_argument("--speakers", type=str, nargs="+", default=["speaker"], help="Speakers to schedule prompts for")
+    parser.add_argument("--num", type=int, default=5, help="Number of prompts to show per speaker")
+    args = parser.parse_args()
+
+    scheduler = PromptScheduler.from_file(args.prompts)
+    for speaker in args.speakers:
+        print(f"--- {speaker} ---")
+        for i in range(args.num):
+            prompt = scheduler.next_prompt(speaker)
+            if prompt is None:
+                break
+            print(f"{prompt['index']}: {prompt['prompt']}")
+            scheduler.mark_recorded(speaker)
+    print(scheduler.coverage())
@@ -0,0 +1,533 @@
+#!/usr/bin/env python3
+"""
+Batch quality control of recorded clips.
+
+Clips recorded against a prompt are checked before they go into a dataset:
+    sample_rate         not the expected sample rate (--sample-rate)
+    channels            not mono
+    clipping            more than max_clipped samples at full scale
+    silent              (almost) no speech: a silence-only take or a dead microphone
+    noisy               speech level less than min_snr_db above the noise floor
+    long_silence        more than max_silence seconds of silence before or after the speech
+    too_short/too_long  duration outside min_duration .. max_duration
+    prompt_mismatch     word error rate of the Vosk transcript against the prompt above max_wer
+    unreadable          the file cannot be decoded
+
+Level, SNR and silence are measured on 20 ms frames in one vectorized pass
+per clip. Clips are checked on a pool of worker processes forked after the
+Vosk model is loaded, so the workers share one copy of it. Measurements and
+flags go into an SQLite report (indexed by flag, speaker and path) keyed by
+the hash of the clip and its prompt (the same take checked against another
+prompt is another result): a re-run only checks clips that are not in the
+report yet, and `reflag` re-applies changed thresholds to the stored
+measurements without decoding anything. Clip hashes are kept in the report by
+path, size and mtime (like featurestore.py), so a re-run only hashes new or
+changed files.
+
+python qc.py check --dataset-path datasets/mydataset --sample-rate 22050 --vosk-lang en-us --workers 8
+python qc.py check --wavs recordings/ --sample-rate 22050 --no-transcripts
+python qc.py report datasets/mydataset/qc.sqlite --flag prompt_mismatch
+python qc.py reflag datasets/mydataset/qc.sqlite --max-wer 0.5
+"""
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from logging import Logger
+from pathlib import Path
+from typing import List, Dict, Tuple, Union, Iterator
+
+import numpy as np
+
+import audioio
+from datasetstore import file_sha1
+
+REPORT_FILENAME = "qc.sqlite"
+
+DEFAULT_THRESHOLDS = {
+    "sample_rate": None, # expected sample rate, None: any
+    "max_clipped": 10,
+    "min_speech": 0.3, # seconds of speech
+    "min_peak_db": -40.0,
+    "min_snr_db": 15.0,
+    "max_silence": 1.5,
+    "min_duration": 0.5,
+    "max_duration": 20.0,
+    "max_wer": 0.35,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS clips (
+    path TEXT PRIMARY KEY,
+    sha1 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    sha1 TEXT NOT NULL,
+    path TEXT NOT NULL,
+    speaker TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    sample_rate INTEGER,
+    channels INTEGER,
+    duration REAL,
+    peak_db REAL,
+    rms_db REAL,
+    clipped INTEGER,
+    snr_db REAL,
+    speech REAL,
+    leading_silence REAL,
+    trailing_silence REAL,
+    transcript TEXT,
+    wer REAL,
+    error TEXT NOT NULL,
+    ok INTEGER NOT NULL,
+    checked REAL NOT NULL,
+    PRIMARY KEY (sha1, prompt)
+);
+CREATE INDEX IF NOT EXISTS results_path ON results (path);
+CREATE INDEX IF NOT EXISTS results_speaker ON results (speaker);
+CREATE INDEX IF NOT EXISTS results_ok ON results (ok);
+CREATE TABLE IF NOT EXISTS flags (
+    sha1 TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    flag TEXT NOT NULL,
+    PRIMARY KEY (sha1, prompt, flag)
+);
+CREATE INDEX IF NOT EXISTS flags_flag ON flags (flag);
+"""
+
+# Reports written before results were keyed by (sha1, prompt): moved to the new tables when opened
+MIGRATE_V1 = """
+DROP INDEX IF EXISTS results_path;
+DROP INDEX IF EXISTS results_speaker;
+DROP INDEX IF EXISTS results_ok;
+DROP INDEX IF EXISTS flags_flag;
+ALTER TABLE results RENAME TO results_v1;
+ALTER TABLE flags RENAME TO flags_v1;
+"""
+
+RESULT_FIELDS = ("sha1", "path", "speaker", "prompt", "sample_rate", "channels", "duration", "peak_db", "rms_db",
+    "clipped", "snr_db", "speech", "leading_silence", "trailing_silence", "transcript", "wer", "error", "ok", "checked")
+
+
+def normalize_words(text: str) -> List[str]:
+    """Lowercase words without punctuation, as Vosk transcribes them."""
+    return re.sub(r"[^\w']+", " ", text.lower()).replace("_", " ").split()
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    """Word level edit distance between prompt and transcript, relative to the prompt length."""
+    ref = normalize_words(reference)
+    hyp = normalize_words(hypothesis)
+    if len(ref) == 0:
+        return 0.0 if len(hyp) == 0 else 1.0
+    row = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        prev, row[0] = row[0], i
+        for j, h in enumerate(hyp, 1):
+            prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (r != h))
+    return row[-1] / len(ref)
+
+
+def levels(wav: np.ndarray, samplerate: int, frame_ms: float = 20.0, clip_level: float = 0.999,
+    threshold_db: float = 12.0, floor_db: float = -60.0) -> Dict:
+    """
+    Level, clipping, SNR and silence measurements of a mono float32 clip, framewise in one pass.
+    Frames more than threshold_db above the noise floor (10th percentile of the frame energies,
+    at least floor_db) are speech, the speech level is the 95th percentile.
+    """
+    frame_len = max(1, int(samplerate * frame_ms / 1000))
+    num_frames = len(wav) // frame_len
+    duration = len(wav) / samplerate
+    abs_wav = np.abs(wav)
+    peak = float(abs_wav.max()) if len(wav) > 0 else 0.0
+    result = {
+        "duration": duration,
+        "peak_db": float(20 * np.log10(peak + 1e-10)),
+        "rms_db": float(10 * np.log10(np.mean(wav * wav) + 1e-10)) if len(wav) > 0 else -100.0,
+        "clipped": int(np.count_nonzero(abs_wav >= clip_level)),
+        "snr_db": 0.0,
+        "speech": 0.0,
+        "leading_silence": duration,
+        "trailing_silence": duration,
+    }
+    if num_frames == 0:
+        return result
+
+    frames = wav[:num_frames * frame_len].reshape(num_frames, frame_len)
+    energy_db = 10.0 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+    noise_db, speech_db = np.percentile(energy_db, [10, 95])
+    speech = energy_db > max(noise_db, floor_db) + threshold_db
+    frame_s = frame_len / samplerate
+    result["snr_db"] = float(speech_db - noise_db)
+    result["speech"] = float(np.count_nonzero(speech) * frame_s)
+    idx = np.flatnonzero(speech)
+    if len(idx) > 0:
+        result["leading_silence"] = float(idx[0] * frame_s)
+        result["trailing_silence"] = float(duration - (idx[-1] + 1) * frame_s)
+    return result
+
+
+def flags_for(result: Dict, thresholds: Dict) -> List[str]:
+    """The QC flags of a result (measurements as returned by check_clip())."""
+    t = dict(DEFAULT_THRESHOLDS, **thresholds)
+    if result.get("error"):
+        return ["unreadable"]
+    flags = []
+    if t["sample_rate"] is not None and result["sample_rate"] != t["sample_rate"]:
+        flags.append("sample_rate")
+    if result["channels"] != 1:
+        flags.append("channels")
+    if result["clipped"] > t["max_clipped"]:
+        flags.append("clipping")
+    silent = result["speech"] < t["min_speech"] or result["peak_db"] < t["min_peak_db"]
+    if silent:
+        flags.append("silent")
+    elif result["snr_db"] < t["min_snr_db"]:
+        flags.append("noisy")
+    if not silent and max(result["leading_silence"], result["trailing_silence"]) > t["max_silence"]:
+        flags.append("long_silence")
+    if result["duration"] < t["min_duration"]:
+        flags.append("too_short")
+    if result["duration"] > t["max_duration"]:
+        flags.append("too_long")
+    if result.get("wer") is not None and result["wer"] > t["max_wer"]:
+        flags.append("prompt_mismatch")
+    return flags
+
+
+# Set in the parent before the pool is forked, the workers share the loaded model copy-on-write
+_vosk_model = None
+
+
+def transcribe(vosk_model, wav: np.ndarray, samplerate: int, blocksize: int = 1 << 15) -> str:
+    """Vosk transcript of a mono float32 clip (the recognizer resamples to the model's rate)."""
+    from vosk import KaldiRecognizer
+    kaldi_recognizer = KaldiRecognizer(vosk_model, samplerate)
+    pcm = (np.clip(wav, -1.0, 1.0) * 32767).astype("<i2")
+    words = []
+    for start in range(0, len(pcm), blocksize):
+        if kaldi_recognizer.AcceptWaveform(pcm[start:start + blocksize].tobytes()):
+            words.append(json.loads(kaldi_recognizer.Result())["text"])
+    words.append(json.loads(kaldi_recognizer.FinalResult())["text"])
+    return " ".join(w for w in words if w)
+
+
+def check_clip(job: Tuple[str, str, str, str]) -> Dict:
+    """Measure one (path, sha1, speaker, prompt) clip in a worker process."""
+    path, sha1, speaker, prompt = job
+    result = dict.fromkeys(RESULT_FIELDS)
+    result.update(sha1=sha1, path=path, speaker=speaker, prompt=prompt, error="")
+    try:
+        reader = audioio.AudioReader(path, mono=True)
+        result["sample_rate"] = reader.file_samplerate
+        result["channels"] = reader.file_channels
+        wav = reader.read()
+        result.update(levels(wav, reader.samplerate))
+        if _vosk_model is not None:
+            result["transcript"] = transcribe(_vosk_model, wav, reader.samplerate)
+            result["wer"] = word_error_rate(prompt, result["transcript"])
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def hash_clip(path: str) -> Union[str, None]:
+    try:
+        return file_sha1(path)
+    except OSError:
+        return None
+
+
+class QCReport:
+    """
+    SQLite report of checked clips: one row of measurements per clip hash and prompt, plus its flags.
+        report_path     Report database file (created if it does not exist)
+    """
+    def __init__(self, report_path: Union[str, Path]) -> None:
+        self.path = Path(report_path).resolve()
+        os.makedirs(self.path.parent, exist_ok=True)
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        flag_columns = [row[1] for row in self.db.execute("PRAGMA table_info(flags)")]
+        migrate = len(flag_columns) > 0 and "prompt" not in flag_columns
+        if migrate:
+            self.db.executescript(MIGRATE_V1)
+        self.db.executescript(SCHEMA)
+        if migrate:
+            self.db.execute(f"INSERT INTO results ({', '.join(RESULT_FIELDS)}) SELECT {', '.join(RESULT_FIELDS)} FROM results_v1")
+            self.db.execute("INSERT INTO flags (sha1, prompt, flag) SELECT flags_v1.sha1, results_v1.prompt, flags_v1.flag "
+                "FROM flags_v1 JOIN results_v1 ON flags_v1.sha1 = results_v1.sha1")
+            self.db.executescript("DROP TABLE results_v1; DROP TABLE flags_v1;")
+        self.db.commit()
+
+    def close(self) -> None:
+        self.db.close()
+
+    @property
+    def thresholds(self) -> Dict:
+        """The thresholds the stored flags were computed with."""
+        with self._lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'thresholds'").fetchone()
+        return dict(DEFAULT_THRESHOLDS, **json.loads(row[0])) if row is not None else dict(DEFAULT_THRESHOLDS)
+
+    def hashes(self, paths: List[str]) -> Dict[str, str]:
+        """path -> sha1 of the paths that were hashed before and did not change since (same size and mtime)."""
+        with self._lock:
+            known = {path: (sha1, size, mtime) for path, sha1, size, mtime in self.db.execute("SELECT path, sha1, size, mtime FROM clips")}
+        hashes = dict()
+        for path in paths:
+            if path not in known:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            sha1, size, mtime = known[path]
+            if (size, mtime) == (st.st_size, st.st_mtime):
+                hashes[path] = sha1
+        return hashes
+
+    def link(self, clips: List[Tuple[str, str]]) -> None:
+        """Record (path, sha1) of clips, with their current size and mtime."""
+        rows = []
+        for path, sha1 in clips:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            rows.append((path, sha1, st.st_size, st.st_mtime))
+        with self._lock:
+            self.db.executemany("INSERT OR REPLACE INTO clips (path, sha1, size, mtime) VALUES (?, ?, ?, ?)", rows)
+            self.db.commit()
+
+    def pending(self, keys: List[Tuple[str, str]], transcripts: bool = False, retry_errors: bool = False) -> List[Tuple[str, str]]:
+        """The (sha1, prompt) keys that still have to be checked (not yet, without a transcript that is wanted now, failed)."""
+        sql = "SELECT sha1, prompt FROM results WHERE 1"
+        if transcripts:
+            sql += " AND (transcript IS NOT NULL OR error != '')"
+        if retry_errors:
+            sql += " AND error = ''"
+        with self._lock:
+            done = {(row[0], row[1]) for row in self.db.execute(sql)}
+        return [key for key in keys if key not in done]
+
+    def put(self, results: List[Dict], thresholds: Dict) -> None:
+        """Store results and their flags."""
+        rows = []
+        flag_rows = []
+        for result in results:
+            flags = flags_for(result, thresholds)
+            result = dict(result, ok=int(len(flags) == 0), checked=time.time())
+            rows.append(tuple(result[field] for field in RESULT_FIELDS))
+            flag_rows += [(result["sha1"], result["prompt"], flag) for flag in flags]
+        with self._lock:
+            self.db.executemany(f"INSERT OR REPLACE INTO results ({', '.join(RESULT_FIELDS)}) "
+                f"VALUES ({', '.join('?' * len(RESULT_FIELDS))})", rows)
+            self.db.executemany("DELETE FROM flags WHERE sha1 = ? AND prompt = ?", [(row[0], row[3]) for row in rows])
+            self.db.executemany("INSERT OR IGNORE INTO flags (sha1, prompt, flag) VALUES (?, ?, ?)", flag_rows)
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('thresholds', ?)", (json.dumps(thresholds),))
+            self.db.commit()
+
+    def reflag(self, thresholds: Dict) -> int:
+        """Recompute the flags of every stored result with new thresholds. Returns the number of flagged clips."""
+        with self._lock:
+            results = [dict(row) for row in self.db.execute("SELECT * FROM results")]
+            self.db.execute("DELETE FROM flags")
+            self.db.commit()
+        self.put(results, thresholds)
+        return sum(1 for result in results if len(flags_for(result, thresholds)) > 0)
+
+    def query(self, flag: str = None, speaker: str = None) -> Iterator[Dict]:
+        """Results with their flags, optionally only those with a flag and / or of a speaker (both indexed)."""
+        sql = ("SELECT results.*, (SELECT group_concat(flag, ' ') FROM flags WHERE flags.sha1 = results.sha1 "
+            "AND flags.prompt = results.prompt) AS flags FROM results")
+        where, params = [], []
+        if flag is not None:
+            where.append("EXISTS (SELECT 1 FROM flags WHERE flags.sha1 = results.sha1 AND flags.prompt = results.prompt AND flag = ?)")
+            params.append(flag)
+        if speaker is not None:
+            where.append("speaker = ?")
+            params.append(speaker)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY path"
+        with self._lock:
+            rows = self.db.execute(sql, params).fetchall()
+        for row in rows:
+            yield dict(row)
+
+    def summary(self) -> Dict:
+        with self._lock:
+            total, ok = self.db.execute("SELECT COUNT(*), COALESCE(SUM(ok), 0) FROM results").fetchone()
+            flags = {flag: num for flag, num in self.db.execute("SELECT flag, COUNT(*) FROM flags GROUP BY flag ORDER BY flag")}
+        return {"clips": total, "ok": ok, "flagged": total - ok, "flags": flags}
+
+
+def run_checks(report: QCReport, clips: List[Tuple[str, str, str]], thresholds: Dict, known_hashes: Dict[str, str] = None,
+    vosk_model=None, workers: int = None, retry_errors: bool = False, batch: int = 64, logger: Logger = None) -> Dict:
+    """
+    Check the (path, speaker, prompt) clips that are not in the report yet, on a pool of forked worker processes.
+        known_hashes    path -> sha1 of clips whose hash is already known (e.g. from the dataset manifest),
+                        the others are hashed unless the report has their hash from an earlier run
+        vosk_model      Vosk Model for the prompt check, None: no transcripts
+    """
+    global _vosk_model
+    log = logger if logger is not None else logging.getLogger("QC")
+    known_hashes = known_hashes or dict()
+    start_time = time.time()
+    _vosk_model = vosk_model # before the pool forks
+    context = multiprocessing.get_context("fork")
+    counts = {"clips": len(clips), "hashed": 0, "checked": 0, "unreadable": 0, "flagged": 0}
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        unknown = [path for path, speaker, prompt in clips if path not in known_hashes]
+        hashes = report.hashes(unknown)
+        to_hash = [path for path in unknown if path not in hashes]
+        hashed = [(path, sha1) for path, sha1 in zip(to_hash, pool.map(hash_clip, to_hash, chunksize=32)) if sha1 is not None]
+        report.link(hashed)
+        hashes.update(hashed)
+        hashes.update(known_hashes)
+        counts["hashed"] = len(to_hash)
+
+        jobs = dict() # one job per (hash, prompt), duplicate takes of a prompt are checked once
+        for path, speaker, prompt in clips:
+            sha1 = hashes.get(path)
+            if sha1 is None:
+                log.warning(f"Cannot read {path}")
+                counts["unreadable"] += 1
+                continue
+            jobs.setdefault((sha1, prompt), (path, sha1, speaker, prompt))
+        pending = report.pending(list(jobs), transcripts=vosk_model is not None, retry_errors=retry_errors)
+        log.info(f"{len(clips)} clips, {len(to_hash)} hashed, {len(pending)} to check")
+
+        results = []
+        for result in pool.map(check_clip, [jobs[key] for key in pending], chunksize=4):
+            results.append(result)
+            counts["checked"] += 1
+            counts["flagged"] += 1 if len(flags_for(result, thresholds)) > 0 else 0
+            if len(results) >= batch:
+                report.put(results, thresholds)
+                results = []
+                log.info(f"[{counts['checked']}/{len(pending)}] {time.time() - start_time:.0f}s")
+        report.put(results, thresholds)
+
+    _vosk_model = None
+    counts["time"] = time.time() - start_time
+    return counts
+
+
+def add_threshold_args(parser) -> None:
+    parser.add_argument("--sample-rate", type=int, default=DEFAULT_THRESHOLDS["sample_rate"], help="Expected sample rate")
+    parser.add_argument("--max-clipped", type=int, default=DEFAULT_THRESHOLDS["max_clipped"], help="Full scale samples allowed")
+    parser.add_argument("--min-speech", type=float, default=DEFAULT_THRESHOLDS["min_speech"], help="Seconds of speech a take needs")
+    parser.add_argument("--min-peak-db", type=float, default=DEFAULT_THRESHOLDS["min_peak_db"], help="Takes quieter than this are silent")
+    parser.add_argument("--min-snr-db", type=float, default=DEFAULT_THRESHOLDS["min_snr_db"], help="Speech level above the noise floor")
+    parser.add_argument("--max-silence", type=float, default=DEFAULT_THRESHOLDS["max_silence"], help="Seconds of silence before / after the speech")
+    parser.add_argument("--min-duration", type=float, default=DEFAULT_THRESHOLDS["min_duration"])
+    parser.add_argument("--max-duration", type=float, default=DEFAULT_THRESHOLDS["max_duration"])
+    parser.add_argument("--max-wer", type=float, default=DEFAULT_THRESHOLDS["max_wer"], help="Word error rate of the transcript against the prompt")
+
+
+def thresholds_from_args(args) -> Dict:
+    return {key: getattr(args, key) for key in DEFAULT_THRESHOLDS}
+
+
+if __name__ == '__main__':
+    import argparse
+
+    import voskmodels
+
+    parser = argparse.ArgumentParser(description="Batch quality control of recorded clips.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    check_parser = subparsers.add_parser("check", help="Check the clips that are not in the report yet")
+    check_parser.add_argument("--dataset-path", type=Path, default=None, help="Dataset with a manifest (see datasetstore.py)")
+    check_parser.add_argument("--wavs", type=Path, default=None, help="Directory of <name>.wav + <name>.txt prompt files instead of --dataset-path")
+    check_parser.add_argument("--speaker", type=str, default="", help="Speaker of the --wavs clips")
+    check_parser.add_argument("--report", type=Path, default=None, help=f"Report file (default: {REPORT_FILENAME} in the dataset / wavs directory)")
+    check_parser.add_argument("--no-transcripts", action="store_true", help="Skip the Vosk prompt check")
+    check_parser.add_argument("--retry-errors", action="store_true", help="Check unreadable clips again")
+    check_parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    voskmodels.add_vosk_args(check_parser)
+    add_threshold_args(check_parser)
+
+    report_parser = subparsers.add_parser("report", help="Summary and flagged clips")
+    report_parser.add_argument("report", type=Path)
+    report_parser.add_argument("--flag", type=str, default=None, help="Only clips with this flag")
+    report_parser.add_argument("--speaker", type=str, default=None)
+    report_parser.add_argument("--all", action="store_true", help="List clips without flags too")
+
+    reflag_parser = subparsers.add_parser("reflag", help="Apply new thresholds to the stored measurements")
+    reflag_parser.add_argument("report", type=Path)
+    add_threshold_args(reflag_parser)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "check":
+        if (args.dataset_path is None) == (args.wavs is None):
+            parser.error("give --dataset-path or --wavs")
+        known_hashes = dict()
+        if args.dataset_path is not None:
+            from datasetstore import DatasetStore
+            dataset = DatasetStore(args.dataset_path)
+            clips = []
+            for clip in dataset.query():
+                path = str(dataset.abspath(clip["path"]))
+                clips.append((path, clip["speaker"], clip["prompt"]))
+                known_hashes[path] = clip["sha1"]
+            dataset.close()
+            report_path = args.report or args.dataset_path / REPORT_FILENAME
+        else:
+            clips = []
+            for wavfile in sorted(args.wavs.rglob("*.wav")):
+                txtfile = wavfile.with_suffix(".txt")
+                if not txtfile.exists():
+                    print(f"No prompt file for {wavfile}, skipping", file=sys.stderr)
+                    continue
+                clips.append((str(wavfile.resolve()), args.speaker, txtfile.read_text(encoding="utf-8").strip()))
+            report_path = args.report or args.wavs / REPORT_FILENAME
+
+        vosk_model = None
+        if not args.no_transcripts:
+            from vosk import SetLogLevel
+            SetLogLevel(-1)
+            vosk_model = voskmodels.load_from_args(args, logging.getLogger("Vosk"))
+
+        report = QCReport(report_path)
+        counts = run_checks(report, clips, thresholds_from_args(args), known_hashes, vosk_model,
+            workers=args.workers, retry_errors=args.retry_errors, logger=logging.getLogger("QC"))
+        print(json.dumps(dict(counts, report=str(report.path), **report.summary()), indent=2))
+        report.close()
+
+    elif args.command == "report":
+        report = QCReport(args.report)
+        for result in report.query(flag=args.flag, speaker=args.speaker):
+            if result["ok"] and not args.all:
+                continue
+            wer = f"{result['wer']:.2f}" if result["wer"] is not None else "-"
+            print(f"{result['flags'] or 'ok':24s}  snr {result['snr_db'] or 0:5.1f}  wer {wer:4s}  {result['path']}")
+            if result["flags"] and "prompt_mismatch" in result["flags"]:
+                print(f"{'':26s}prompt: {result['prompt']}\n{'':26s}heard:  {result['transcript']}")
+        print(json.dumps(dict(report.summary(), thresholds=report.thresholds), indent=2))
+        report.close()
+
+    elif args.command == "reflag":
+        report = QCReport(args.report)
+        flagged = report.reflag(thresholds_from_args(args))
+        print(json.dumps(dict(report.summary(), reflagged=flagged), indent=2))
+        report.close()
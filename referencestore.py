@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Cached reference features for voice conversion.
+
+Converting against a performer's reference recording needs the recording's
+speaker embedding (from the speaker encoder) and its linear spectrogram, both
+expensive compared to looking them up. The store keys them by (model, model
+generation, sha1 of the file), so a reference clip is only processed once per
+checkpoint, whatever its path, and optionally persists them as .npz files in a
+cache directory so they survive restarts. A reloaded model has a new generation
+(see ModelSpec.fingerprint), so it never gets features of the previous checkpoint.
+File hashes are memoized by (path, size, mtime).
+"""
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Callable, Union, Tuple
+
+import numpy as np
+
+from datasetstore import file_sha1
+
+
+class ReferenceStore:
+    """
+        cache_dir       Directory to persist features in (None: memory only)
+        max_entries     Number of references kept in memory
+    """
+    def __init__(self, cache_dir: Union[str, Path] = None, max_entries: int = 64) -> None:
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hashes = dict() # (path, size, mtime) -> sha1
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def file_hash(self, path: Union[str, Path]) -> str:
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        stamp = (path, st.st_size, st.st_mtime_ns)
+        sha1 = self.hashes.get(stamp)
+        if sha1 is None:
+            sha1 = file_sha1(path)
+            self.hashes[stamp] = sha1
+        return sha1
+
+    def cache_path(self, key: Tuple[str, str, str, str]) -> Union[Path, None]:
+        if self.cache_dir is None:
+            return None
+        model_id, generation, sha1, kind = key
+        return self.cache_dir / model_id / (generation or "default") / f"{sha1}.{kind}.npz"
+
+    def get(self, model_id: str, path: Union[str, Path], compute: Callable[[Path], Dict[str, np.ndarray]],
+        kind: str = "full", generation: str = "") -> Dict[str, np.ndarray]:
+        """
+        Features of the reference file at path for model_id. On a miss compute(path) is called,
+        it returns a dict of arrays (None values are left out).
+            kind        Name of the feature set, when several are computed for the same file
+            generation  Checkpoint of the model (e.g. ModelSpec.fingerprint()), features of other
+                        checkpoints of the same model are not used
+        """
+        key = (model_id, generation, self.file_hash(path), kind)
+        with self.lock:
+            features = self.entries.get(key)
+            if features is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return features
+
+        features = None
+        cache_path = self.cache_path(key)
+        if cache_path is not None and cache_path.exists():
+            with np.load(cache_path) as saved:
+                features = {name: saved[name] for name in saved.files}
+            self.disk_hits += 1
+
+        if features is None:
+            features = {name: value for name, value in compute(Path(path)).items() if value is not None}
+            self.misses += 1
+            if cache_path is not None:
+                os.makedirs(cache_path.parent, exist_ok=True)
+                tmp_path = cache_path.with_name(cache_path.name + ".tmp.npz")
+                np.savez(tmp_path, **features)
+                os.replace(tmp_path, cache_path)
+
+        with self.lock:
+            self.entries[key] = features
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return features
+
+    def forget_model(self, model_id: str) -> None:
+        """
+        Drop the in-memory features of model_id. The .npz files stay, they are keyed by the
+        model generation, so a reloaded checkpoint does not find them.
+        """
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == model_id]:
+                del self.entries[key]
+
+    def stats(self) -> Dict:
+        return {
+            "references": len(self.entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+CPU allocation between torch synthesis and the real-time audio path.
+
+By default torch runs its intra-op pool on every core, so while a sentence is
+synthesized the PortAudio callbacks, Kaldi and the asyncio loop in the same
+process compete with it for CPU, and playback underruns. The ResourceManager
+* sizes torch's thread pools per synthesis worker, and
+* with --reserve-cores N (opt-in, default 0) keeps N cores free of torch threads:
+    synthesis runs inside `with synthesis_affinity():` (see VoiceSynth), which
+    restricts the synthesizing thread to the remaining cores for the call, so
+    the pool threads torch starts from it (and the vocoder thread) inherit that
+    mask. The main thread and every other thread keep all cores. PortAudio
+    callbacks started from a synthesis thread move themselves back with
+    pin_audio_callback(), and streams opened inside `with audio_affinity():`
+    get their threads created with the full mask.
+
+Pinning uses os.sched_setaffinity and is skipped where that is not available.
+
+python resources.py --reserve-cores 1 --torch-threads 2             # show the plan for this machine
+python resources.py bench --model-path ../outputs/checkpoints/efam48_220k/ --configs 0:0 4:0 2:1 1:2
+"""
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import subprocess
+from contextlib import contextmanager
+from logging import Logger
+from typing import List, Dict, Set
+
+ACTIVE = None # the ResourceManager applied in this process, see apply()
+_callback_threads = threading.local()
+
+
+def available_cores() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+class ResourceManager:
+    """
+        torch_threads       Intra-op threads per synthesis worker (default: synthesis cores / workers)
+        interop_threads     Inter-op threads (default: 1, synthesis has no parallel ops to overlap)
+        reserve_cores       Cores kept free of torch threads, for audio callbacks, recognition and I/O
+                            (default: 0, nothing is pinned)
+        workers             Number of threads that may synthesize at the same time
+        pin                 Pin synthesis threads to the other cores when cores are reserved (Linux only)
+    """
+    def __init__(self, torch_threads: int = None, interop_threads: int = None, reserve_cores: int = 0,
+        workers: int = 1, pin: bool = True, logger: Logger = None) -> None:
+        self.log = logger if logger is not None else logging.getLogger("Resources")
+        self.cores = available_cores()
+        self.reserve_cores = min(max(0, reserve_cores), len(self.cores) - 1)
+        self.workers = max(1, workers)
+        self.pin = pin and self.reserve_cores > 0 and hasattr(os, "sched_setaffinity")
+
+        # reserve the highest numbered cores, core 0 tends to get the most interrupts
+        self.synth_cores = self.cores[:len(self.cores) - self.reserve_cores]
+        self.audio_cores = self.cores # audio threads may use any core, including the reserved ones
+        self.torch_threads = torch_threads if torch_threads else max(1, len(self.synth_cores) // self.workers)
+        self.interop_threads = interop_threads if interop_threads else 1
+
+    def apply(self) -> None:
+        """
+        Configure torch's thread pools. Call once, early in the main thread, before loading models.
+        Nothing is pinned here, synthesis threads are pinned by synthesis_affinity().
+        """
+        global ACTIVE
+        import torch
+
+        torch.set_num_threads(self.torch_threads)
+        try:
+            torch.set_num_interop_threads(self.interop_threads)
+        except RuntimeError as e:
+            self.log.warning(f"Could not set torch inter-op threads (already in use): {e}")
+        ACTIVE = self
+        self.log.info(f"Resources: {self.report()}")
+
+    def pin_synthesis_thread(self) -> None:
+        """Restrict the calling thread (and the threads it starts) to the synthesis cores."""
+        if self.pin:
+            os.sched_setaffinity(0, self.synth_cores)
+
+    def pin_audio_thread(self) -> None:
+        """Let the calling thread (and the threads it starts) run on all cores, including the reserved ones."""
+        if self.pin:
+            os.sched_setaffinity(0, self.audio_cores)
+
+    def report(self) -> Dict:
+        report = {
+            "cores": len(self.cores),
+            "reserved_cores": self.cores[len(self.synth_cores):],
+            "synthesis_cores": self.synth_cores,
+            "workers": self.workers,
+            "torch_threads": self.torch_threads,
+            "interop_threads": self.interop_threads,
+            "pinned": self.pin,
+        }
+        if "torch" in sys.modules:
+            torch = sys.modules["torch"]
+            report["torch_num_threads"] = torch.get_num_threads()
+            report["torch_num_interop_threads"] = torch.get_num_interop_threads()
+        return report
+
+
+def current_affinity() -> Set[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return os.sched_getaffinity(0)
+    return set(available_cores())
+
+
+@contextmanager
+def audio_affinity():
+    """
+    Run a block with the audio affinity, e.g. around opening a PortAudio stream or sd.play(),
+    so the callback thread PortAudio creates may run on the reserved cores.
+    Does nothing unless a ResourceManager was applied.
+    """
+    if ACTIVE is None or not ACTIVE.pin:
+        yield
+        return
+    previous = current_affinity()
+    ACTIVE.pin_audio_thread()
+    try:
+        yield
+    finally:
+        os.sched_setaffinity(0, previous)
+
+
+@contextmanager
+def synthesis_affinity():
+    """
+    Run a block (a synthesis call) restricted to the synthesis cores. Threads started inside
+    the block, including torch's pool threads the first time this thread runs a parallel op,
+    keep that mask; the calling thread gets its previous mask back afterwards.
+    Does nothing unless a ResourceManager that pins was applied.
+    """
+    if ACTIVE is None or not ACTIVE.pin:
+        yield
+        return
+    previous = current_affinity()
+    ACTIVE.pin_synthesis_thread()
+    try:
+        yield
+    finally:
+        os.sched_setaffinity(0, previous)
+
+
+def pin_audio_callback() -> None:
+    """
+    Call at the top of a PortAudio callback (or an audio playback thread): moves
+    the thread to the audio affinity the first time it runs (one check per call after that).
+    """
+    if ACTIVE is None or not ACTIVE.pin or getattr(_callback_threads, "pinned", False):
+        return
+    ACTIVE.pin_audio_thread()
+    _callback_threads.pinned = True
+
+
+def add_resource_args(parser) -> None:
+    """CPU allocation command line options shared by the entry points."""
+    parser.add_argument("--torch-threads", type=int, default=None, help="Torch intra-op threads per synthesis worker (default: synthesis cores / workers)")
+    parser.add_argument("--interop-threads", type=int, default=None, help="Torch inter-op threads (default: 1)")
+    parser.add_argument("--reserve-cores", type=int, default=0, help="Cores kept free of torch threads for audio and recognition, synthesis threads are pinned to the others (default: 0, no pinning)")
+    parser.add_argument("--no-pin", action="store_true", help="Only size torch's pools for --reserve-cores, do not pin threads to cores")
+
+
+def apply_from_args(args, workers: int = 1, logger: Logger = None) -> ResourceManager:
+    """Create and apply a ResourceManager from the add_resource_args() options."""
+    manager = ResourceManager(
+        torch_threads=args.torch_threads,
+        interop_threads=args.interop_threads,
+        reserve_cores=args.reserve_cores,
+        workers=workers,
+        pin=not args.no_pin,
+        logger=logger,
+    )
+    manager.apply()
+    return manager
+
+
+class DeadlineMonitor:
+    """
+    Stand-in for an audio callback: a thread that wakes up every `period` seconds
+    and counts wakeups that come later than one period (an underrun in a real stream).
+    """
+    def __init__(self, period: float = 256 / 48000) -> None:
+        self.period = period
+        self.running = False
+        self.wakeups = 0
+        self.underruns = 0
+        self.max_lateness = 0.0
+        self.thread = threading.Thread(target=self.monitorThread, daemon=True)
+
+    def monitorThread(self) -> None:
+        if ACTIVE is not None:
+            ACTIVE.pin_audio_thread()
+        deadline = time.perf_counter() + self.period
+        while self.running:
+            time.sleep(max(0.0, deadline - time.perf_counter()))
+            lateness = time.perf_counter() - deadline
+            self.wakeups += 1
+            if lateness > self.period:
+                self.underruns += 1
+            self.max_lateness = max(self.max_lateness, lateness)
+            deadline += self.period
+            if lateness > self.period:
+                deadline = time.perf_counter() + self.period
+
+    def start(self) -> None:
+        self.running = True
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+        self.thread.join()
+
+
+def run_benchmark(args) -> Dict:
+    """Synthesize the benchmark text with the current settings while an audio stream (or a stand-in) runs."""
+    import numpy as np
+    from pathlib import Path
+    from voicesynth import VoiceSynth
+    import modelspec
+
+    voice_synth = VoiceSynth(Path(args.output_path).resolve(), False, logging.getLogger("VoiceSynthesizer"))
+    voice_synth.load_specs(modelspec.specs_from_args(args, name="vits"))
+
+    underflows = [0]
+    def callback(outdata, frames, time_info, status):
+        if status.output_underflow:
+            underflows[0] += 1
+        outdata.fill(0)
+
+    monitor = DeadlineMonitor(args.blocksize / args.samplerate)
+    stream = None
+    if args.device is not None:
+        import sounddevice as sd
+        with audio_affinity():
+            stream = sd.OutputStream(samplerate=args.samplerate, blocksize=args.blocksize, channels=1,
+                dtype="float32", device=args.device, callback=callback)
+            stream.start()
+    monitor.start()
+
+    rtfs = []
+    for idx in range(args.repeat):
+        start_time = time.time()
+        wav, sr, _ = voice_synth.synthesize(args.text, f"bench{idx}.wav", "vits", clean_text=False)
+        rtfs.append((time.time() - start_time) / (len(wav) / sr))
+
+    monitor.stop()
+    if stream is not None:
+        stream.close()
+
+    result = ACTIVE.report() if ACTIVE is not None else {}
+    result.update({
+        "rtf_mean": float(np.mean(rtfs)),
+        "rtf_min": float(np.min(rtfs)),
+        "deadline_misses": monitor.underruns,
+        "wakeups": monitor.wakeups,
+        "max_lateness_ms": monitor.max_lateness * 1000,
+        "device_underflows": underflows[0] if stream is not None else None,
+    })
+    return result
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="CPU allocation between torch and the audio pipeline.")
+    add_resource_args(parser)
+    subparsers = parser.add_subparsers(dest="command")
+
+    bench_parser = subparsers.add_parser("bench", help="Compare thread configurations: RTF and audio deadline misses")
+    bench_parser.add_argument("--model-path", type=str, required=True, help="Path to root directory of TTS model (model_file.pth, config.json)")
+    bench_parser.add_argument("--configs", type=str, nargs="+", default=["0:0", "2:1", "1:2"],
+        help="Configurations as torch_threads:reserve_cores, 0 threads = torch defaults without pinning")
+    bench_parser.add_argument("--text", type=str, default="The quick brown fox jumps over the lazy dog. She sells sea shells by the sea shore.")
+    bench_parser.add_argument("--repeat", type=int, default=5)
+    bench_parser.add_argument("--device", type=str, default=None, help="Also run a real output stream on this device and count its underflows")
+    bench_parser.add_argument("--samplerate", type=int, default=48000)
+    bench_parser.add_argument("--blocksize", type=int, default=256)
+    bench_parser.add_argument("--output-path", type=str, default="tmp/wav")
+    bench_parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS) # run one configuration, print JSON
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.command != "bench":
+        print(json.dumps(ResourceManager(args.torch_threads, args.interop_threads, args.reserve_cores,
+            pin=not args.no_pin).report(), indent=2))
+        sys.exit(0)
+
+    if args.single:
+        if args.torch_threads:
+            apply_from_args(args)
+        print(json.dumps(run_benchmark(args)))
+        sys.exit(0)
+
+    # Every configuration runs in a fresh process: torch's inter-op pool can only be configured once
+    results = []
+    for config in args.configs:
+        torch_threads, reserve_cores = (int(v) for v in config.split(":"))
+        cmd = [sys.executable, __file__, "--torch-threads", str(torch_threads), "--reserve-cores", str(reserve_cores)]
+        if torch_threads == 0:
+            cmd.append("--no-pin")
+        cmd += ["bench", "--single", "--model-path", args.model_path, "--text", args.text, "--repeat", str(args.repeat),
+            "--samplerate", str(args.samplerate), "--blocksize", str(args.blocksize), "--output-path", args.output_path]
+        if args.device is not None:
+            cmd += ["--device", args.device]
+        print(f"Running {config}...")
+        output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        results.append((config, json.loads(output.strip().splitlines()[-1])))
+
+    print(f"{'config':>8} {'rtf_mean':>9} {'rtf_min':>8} {'misses':>7} {'max_late_ms':>12} {'underflows':>11}")
+    for config, result in results:
+        print(f"{config:>8} {result['rtf_mean']:9.3f} {result['rtf_min']:8.3f} {result['deadline_misses']:7d} "
+            f"{result['max_lateness_ms']:12.2f} {str(result['device_underflows']):>11}")
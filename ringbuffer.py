@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Preallocated ring buffer of PCM blocks between the PortAudio callback and
+the recognition stage.
+
+The callback copies each block once, straight into a preallocated slot
+(instead of bytes(indata) into an unbounded queue.Queue), the consumer gets
+a memoryview of the slot and hands it to the recognizer without another copy.
+Memory use is constant. When the consumer falls behind and the buffer is full,
+incoming blocks are dropped and counted, so latency can never creep up
+silently by more than the size of the buffer.
+
+Single producer (the audio callback), single consumer (the recognition thread):
+the producer only advances the write counter, the consumer only advances the
+read counter, so the callback never waits on a lock.
+"""
+import sys
+import time
+import threading
+from typing import Tuple, Union, Dict
+
+import numpy as np
+
+
+class PCMRingBuffer:
+    """
+        num_blocks      Number of slots (one slot is always reserved for the block being read)
+        block_bytes     Size of a slot, i.e. the largest block the callback will deliver
+    """
+    def __init__(self, num_blocks: int, block_bytes: int) -> None:
+        if num_blocks < 2:
+            raise ValueError("PCMRingBuffer needs at least 2 blocks")
+        self.num_blocks = num_blocks
+        self.block_bytes = block_bytes
+        self.buffer = np.zeros((num_blocks, block_bytes), dtype=np.uint8)
+        self.lengths = np.zeros(num_blocks, dtype=np.int64)
+        self.timestamps = np.zeros(num_blocks, dtype=np.float64)
+        self.written = 0 # only advanced by the producer
+        self.read_count = 0 # only advanced by the consumer
+        self.available = threading.Semaphore(0)
+
+        # Overflow accounting
+        self.dropped_blocks = 0
+        self.dropped_bytes = 0
+        self.device_overflows = 0 # input overflows reported by PortAudio
+        self.high_water = 0 # highest number of queued blocks seen
+
+    @classmethod
+    def for_stream(cls, samplerate: int, blocksize: int, channels: int = 1, seconds: float = 5.0) -> "PCMRingBuffer":
+        """Ring buffer holding `seconds` of 16 bit audio delivered in blocks of `blocksize` frames."""
+        num_blocks = max(2, int(np.ceil(seconds * samplerate / blocksize)) + 1)
+        return cls(num_blocks, blocksize * channels * 2)
+
+    def __len__(self) -> int:
+        """Number of queued blocks."""
+        return self.written - self.read_count
+
+    def write(self, data, timestamp: float = None) -> bool:
+        """
+        Copy a block of 16 bit PCM (bytes-like) into the next free slot. Called from the PortAudio callback.
+        Returns False (and counts the drop) if the buffer is full.
+        """
+        return self.write_samples(np.frombuffer(data, dtype=np.int16), timestamp)
+
+    def write_samples(self, samples: np.ndarray, timestamp: float = None) -> bool:
+        """
+        Like write(), for int16 samples that need not be contiguous
+        (e.g. one channel of an interleaved multi-channel block), copied straight into the slot.
+        """
+        queued = self.written - self.read_count
+        if queued >= self.num_blocks - 1:
+            self.dropped_blocks += 1
+            self.dropped_bytes += len(samples) * 2
+            return False
+
+        slot = self.written % self.num_blocks
+        num = min(len(samples), self.block_bytes // 2)
+        self.buffer[slot, :num * 2].view(np.int16)[:] = samples[:num]
+        self.lengths[slot] = num * 2
+        self.timestamps[slot] = timestamp if timestamp is not None else time.time()
+        self.written += 1
+        if queued + 1 > self.high_water:
+            self.high_water = queued + 1
+        self.available.release()
+        return True
+
+    def callback(self, indata, frames, time_info, status) -> None:
+        """Drop-in sounddevice callback."""
+        if status:
+            if status.input_overflow:
+                self.device_overflows += 1
+            print(status, file=sys.stderr)
+        self.write(indata)
+
+    def read(self, timeout: float = None) -> Union[Tuple[memoryview, float], None]:
+        """
+        Wait for the next block. Returns (memoryview of the slot, capture timestamp),
+        or None on timeout. The view stays valid until the next call to read().
+        """
+        if not self.available.acquire(timeout=timeout):
+            return None
+        slot = self.read_count % self.num_blocks
+        view = memoryview(self.buffer[slot, :self.lengths[slot]])
+        timestamp = float(self.timestamps[slot])
+        self.read_count += 1
+        return view, timestamp
+
+    def stats(self) -> Dict:
+        return {
+            "blocks_written": self.written,
+            "blocks_read": self.read_count,
+            "queued": len(self),
+            "high_water": self.high_water,
+            "capacity": self.num_blocks - 1,
+            "dropped_blocks": self.dropped_blocks,
+            "dropped_bytes": self.dropped_bytes,
+            "device_overflows": self.device_overflows,
+        }
+
+
+_vosk_internals = None # (_c, _ffi) once checked, False if they are not available
+
+
+def vosk_internals():
+    """vosk's cffi library and ffi objects, or False if this vosk version does not have them."""
+    global _vosk_internals
+    if _vosk_internals is None:
+        try:
+            from vosk import _c, _ffi
+            if not (hasattr(_c, "vosk_recognizer_accept_waveform") and hasattr(_ffi, "from_buffer")):
+                raise AttributeError("vosk_recognizer_accept_waveform")
+            _vosk_internals = (_c, _ffi)
+        except (ImportError, AttributeError):
+            _vosk_internals = False
+    return _vosk_internals
+
+
+def accept_waveform(recognizer, data) -> bool:
+    """
+    KaldiRecognizer.AcceptWaveform without converting a memoryview to bytes first.
+    Falls back to the public API (with a copy) if the vosk internals are not available.
+    """
+    if isinstance(data, bytes):
+        return recognizer.AcceptWaveform(data)
+    internals = vosk_internals()
+    handle = getattr(recognizer, "_handle", None)
+    if not internals or handle is None:
+        return recognizer.AcceptWaveform(bytes(data))
+    _c, _ffi = internals
+    res = _c.vosk_recognizer_accept_waveform(handle, _ffi.from_buffer(data), len(data))
+    if res < 0:
+        raise Exception("Failed to process waveform")
+    return res != 0
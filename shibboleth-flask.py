@@ -17,6 +17,7 @@ The website should run at localhost:3000
 import sys
 import os
 import json
+import tempfile
 from pathlib import Path
 import numpy as np
 import flask
@@ -24,6 +25,12 @@ from werkzeug.utils import secure_filename
 from datetime import datetime
 
 from voicesynth import VoiceSynth
+from datasetstore import DatasetStore
+from promptscheduler import PromptScheduler
+import resources
+import profiling
+import modelspec
+import hotreload
 
 app = flask.Flask(__name__)
 app.app_context()
@@ -85,9 +92,30 @@ parser.add_argument(
     help="Audio write / temp file output directory.",
 )
 
+parser.add_argument("--models", type=Path, default=None, help="Model manifest (see modelspec.py) instead of --model-path, --voice picks the model to speak with.")
 parser.add_argument("--use-cuda", type=bool, help="Run model on CUDA.", default=False)
 
+parser.add_argument(
+    "--dataset-path",
+    type=Path,
+    default="datasets/collected",
+    help="Dataset root directory where uploaded recordings and their manifest are stored.",
+)
+
+parser.add_argument(
+    "--prompts",
+    type=Path,
+    default=None,
+    help="Prompt corpus (one prompt per line) to schedule for recording sessions.",
+)
+
+resources.add_resource_args(parser)
+profiling.add_profile_args(parser)
+hotreload.add_reload_args(parser)
+
 args = parser.parse_args(remaining_args)
+resources.apply_from_args(args, logger=logging.getLogger("Resources"))
+PROFILER = profiling.start_from_args(args, logging.getLogger("Profiler"))
 
 DEFAULT_MODELS = {
     "effiamir": {
@@ -102,33 +130,55 @@ DEFAULT_MODELS = {
 }
 
 # Check if model-path is set. Confirm files exist.
-if args.model_path is None:
+if args.models is None and args.model_path is None:
     print(f"No model_path specified, using voice '{args.voice}': {DEFAULT_MODELS[args.voice]}")
     args.model_path = DEFAULT_MODELS[args.voice]['path']
-
-if args.model_path.exists():
-    for checkpoint in args.model_path.glob('*.pth'):
-        TTS_MODEL_PATH = checkpoint
-    for config in args.model_path.glob('*.json'):
-        TTS_CONFIG_PATH = config
-else:
-    raise Error(f"Model Path Does Not Exist: {args.model_path}")
+MODEL_SPECS = modelspec.specs_from_args(args, name="vits")
+MODEL_ID = modelspec.default_model(MODEL_SPECS, args.voice)
 
 # Set up TTS model.
 AUDIO_WRITE_PATH = args.output_path.resolve() # audio renders go here
-TTS_MODEL_TYPE = "vits"
 USE_CUDA = args.use_cuda
-tts_model_spec = { 'tts_model_root_path': args.model_path, 'tts': None }
-tts_model_spec['tts'] = {
-    "vits": [
-        TTS_MODEL_PATH.name,
-        TTS_CONFIG_PATH.name,
-        None, None, None, None, None, None
-    ]
-}
 
 VOICE_SYNTH = VoiceSynth(AUDIO_WRITE_PATH, USE_CUDA, logging.getLogger("VoiceSynthesizer"))
-VOICE_SYNTH.load_models(tts_model_spec)
+VOICE_SYNTH.load_specs(MODEL_SPECS)
+VOICE_SYNTH.profiler = PROFILER
+WATCHER = hotreload.watch_from_args(args, VOICE_SYNTH, MODEL_ID, logging.getLogger("ModelWatcher"))
+
+DATASET = DatasetStore(args.dataset_path)
+PROMPTS = None
+if args.prompts is not None:
+    PROMPTS = PromptScheduler.from_file(args.prompts, dataset=DATASET)
+    print(f"Loaded {len(PROMPTS.prompts)} prompts from {args.prompts}")
+
+# Profiling (only with --profile): stacks of all threads, or a memory snapshot now
+@app.route('/debug/stacks', methods = ['GET'])
+def debug_stacks():
+    if PROFILER is None:
+        flask.abort(404)
+    return flask.Response(PROFILER.dump_stacks(), mimetype="text/plain")
+
+@app.route('/debug/snapshot', methods = ['POST'])
+def debug_snapshot():
+    if PROFILER is None:
+        flask.abort(404)
+    return flask.Response(PROFILER.snapshot(), mimetype="text/plain")
+
+# Hot model reload: {"model": ..., "path": <checkpoint>, "token": ...} loads and swaps in a new checkpoint in the
+# background. Refused unless the server was started with --admin-token (see hotreload.authorized)
+@app.route('/admin/reload', methods = ['POST'])
+def admin_reload():
+    command = dict(flask.request.json or {}, admin="reload")
+    if not hotreload.authorized(command, flask.request.remote_addr, args.admin_token):
+        flask.abort(403)
+    reply = hotreload.handle_admin(command, VOICE_SYNTH, MODEL_ID, logging.getLogger("HotReload"))
+    return flask.jsonify(reply), (400 if "error" in reply else 202)
+
+@app.route('/admin/models', methods = ['GET'])
+def admin_models():
+    if not hotreload.authorized({"admin": "models", "token": flask.request.args.get("token", "")}, flask.request.remote_addr, args.admin_token):
+        flask.abort(403)
+    return flask.jsonify(hotreload.handle_admin({"admin": "models"}, VOICE_SYNTH, MODEL_ID))
 
 # Serve Static Files
 @app.route("/<path:name>")
@@ -156,15 +206,75 @@ def recv_text():
     # Synthesize & Play Audio
     wav,sr,wavfile = synthesize(text=txt, filenum=FILE_NUM, synth=VOICE_SYNTH)
     flask.g.FILE_NUM +=1
-    sd.play(wav, sr)
+    with resources.audio_affinity():
+        sd.play(wav, sr)
     return flask.jsonify({'response': "Success!", 'received': txt})
 
 
+# Upload a recorded clip (form fields: file, prompt, speaker, optional prompt index) into the dataset.
+# With a prompt corpus the prompt is marked recorded and the reply includes the speaker's next prompt.
+@app.route('/dataset/upload', methods = ['POST'])
+def upload_clip():
+    clip = flask.request.files['file']
+    prompt = flask.request.form.get('prompt', '')
+    speaker = secure_filename(flask.request.form.get('speaker', 'unknown')) or 'unknown'
+    fd, upload_path = tempfile.mkstemp(suffix=".upload", dir=str(DATASET.root)) # same filesystem, moved into place
+    os.close(fd)
+    try:
+        clip.save(upload_path)
+    except Exception:
+        os.remove(upload_path)
+        raise
+    try:
+        row, new = DATASET.store_clip(upload_path, prompt, speaker)
+    except ValueError as e: # store_clip() has deleted the upload
+        return flask.jsonify({'error': str(e)}), 400
+    reply = {'response': "Success", 'path': row['path'], 'duplicate': not new}
+    if PROMPTS is not None:
+        index = flask.request.form.get('index', type=int)
+        if index is None or not (0 <= index < len(PROMPTS.prompts)) or PROMPTS.prompts[index] != row['prompt']:
+            index = PROMPTS.index.get(row['prompt'])
+        if new and index is not None:
+            PROMPTS.mark_recorded(speaker, index)
+        reply['next'] = PROMPTS.next_prompt(speaker)
+    print(f"{'Stored' if new else 'Already have'} clip {row['path']} for speaker '{speaker}': '{row['prompt']}'")
+    return flask.jsonify(reply)
+
+
+@app.route('/dataset/stats', methods = ['GET'])
+def dataset_stats():
+    return flask.jsonify({'speakers': DATASET.speakers(), 'total': DATASET.count()})
+
+
+# Prompt scheduling for recording sessions (form/query field: speaker)
+@app.route('/prompt/next', methods = ['GET'])
+def next_prompt():
+    if PROMPTS is None:
+        return flask.jsonify({'error': "No prompt corpus loaded, start the server with --prompts"}), 404
+    speaker = secure_filename(flask.request.args.get('speaker', 'unknown')) or 'unknown'
+    return flask.jsonify(PROMPTS.next_prompt(speaker))
+
+
+@app.route('/prompt/skip', methods = ['POST'])
+def skip_prompt():
+    if PROMPTS is None:
+        return flask.jsonify({'error': "No prompt corpus loaded, start the server with --prompts"}), 404
+    speaker = secure_filename(flask.request.form.get('speaker', 'unknown')) or 'unknown'
+    return flask.jsonify(PROMPTS.skip(speaker))
+
+
+@app.route('/prompt/coverage', methods = ['GET'])
+def prompt_coverage():
+    if PROMPTS is None:
+        return flask.jsonify({'error': "No prompt corpus loaded, start the server with --prompts"}), 404
+    return flask.jsonify(PROMPTS.coverage())
+
+
 def synthesize(text: str, filenum: int, synth: VoiceSynth):
     print(f"Generating: >>{text}<<")
     filename = f"testoutput{filenum}.wav"
     wav, sr, outfile = synth.synthesize(
-        text, filename, "vits",
+        text, filename, MODEL_ID,
         speaker_name=None,
         language_name=None,
         clean_text=False,
@@ -173,4 +283,5 @@ def synthesize(text: str, filenum: int, synth: VoiceSynth):
     return wav, sr, outfile
 
 
-app.run(port=3000, debug=True, host=SERVE_HOST, ssl_context='adhoc')
+# No reloader: it would run this module (model loading, profiler, model watcher) a second time
+app.run(port=3000, debug=True, use_reloader=False, host=SERVE_HOST, ssl_context='adhoc')
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+'''
+Shibboleth headless performance mode.
+Runs the Vosk -> TTS speech loop without a GUI, from a microphone, a wav file
+or a raw PCM pipe, writing synthesized speech to an audio device or a file.
+
+python shibboleth-headless.py --model-path ../outputs/checkpoints/efam48_220k/
+python shibboleth-headless.py --model-path ../outputs/checkpoints/efam48_220k/ --input-wav exampleaudio/test-sentence.wav --output-file tmp/out.wav
+python shibboleth-headless.py --model-path ../outputs/checkpoints/efam48_220k/ --input-wav exampleaudio/test-sentence.wav --realtime --loop --duration 36000 --output-file /dev/null --stats-file soak.csv
+arecord -f S16_LE -r 16000 -c 1 | python shibboleth-headless.py --model-path ... --input-pipe --samplerate 16000
+
+Several performers from one process (one shared Vosk model, one recognizer per stream):
+python shibboleth-headless.py --model-path ... --input-device 2 --channels 4
+python shibboleth-headless.py --model-path ... --input-wav performer1.wav performer2.wav --output-file tmp/out.wav
+'''
+import os
+import sys
+import json
+import logging
+import argparse
+from pathlib import Path
+
+from voicesynth import VoiceSynth
+from vosk import KaldiRecognizer, SetLogLevel
+import engine
+import voskmodels
+import resources
+import profiling
+import deadline
+import modelspec
+
+def int_or_str(text):
+    """Helper function for argument parsing."""
+    try:
+        return int(text)
+    except ValueError:
+        return text
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument(
+        "-l", "--list-devices",
+        action="store_true",
+        help="Show list of audio devices and exit"
+    )
+
+    namespace, remaining_args = parser.parse_known_args()
+
+    if namespace.list_devices:
+        import sounddevice as sd
+        print(sd.query_devices())
+        parser.exit(0)
+
+    parser.add_argument("-h", "--help", action="help", help="Show this help message and exit")
+
+    # Input
+    parser.add_argument("--input-device", type=int_or_str, help="Input audio device (numeric ID or substring)")
+    parser.add_argument("--input-wav", type=Path, nargs="+", default=None, help="Read input from audio files instead of a microphone, one stream per file")
+    parser.add_argument("--channels", type=int, default=1, help="Number of input device channels, each channel is recognized as a separate stream")
+    parser.add_argument("--input-pipe", action="store_true", help="Read raw 16 bit mono PCM at --samplerate from stdin")
+    parser.add_argument("--realtime", action="store_true", help="Pace --input-wav at real time, like a microphone")
+    parser.add_argument("--loop", action="store_true", help="Loop --input-wav forever (soak testing)")
+    parser.add_argument("-r", "--samplerate", type=int, help="Input sampling rate (default: device rate, 16000 for files and pipes)")
+    parser.add_argument("-b", "--blocksize", type=int, help="blocksize")
+    parser.add_argument("--vad", action="store_true", help="Skip silent blocks and end utterances with a voice activity detector")
+    parser.add_argument("--vad-hangover", type=float, default=600.0, help="Silence (ms) after which the VAD ends an utterance")
+
+    # Output
+    parser.add_argument("--output-device", type=int_or_str, help="Output audio device (numeric ID or substring)")
+    parser.add_argument("--output-file", type=Path, default=None, help="Write all synthesized speech to this wav file instead of playing it")
+    parser.add_argument("--no-output", action="store_true", help="Discard synthesized speech")
+
+    # Models
+    parser.add_argument(
+        "--model-path",
+        type=Path,
+        default=None,
+        help='Path to root directory of TTS model. Files expected in this dir: model_file.pth, config.json, and more depending on model type'
+    )
+    parser.add_argument("--models", type=Path, default=None, help="Model manifest (see modelspec.py) instead of --model-path")
+    parser.add_argument("--voice", type=str, default=None, help="Model of the manifest to speak with (default: the first preloaded one)")
+    voskmodels.add_vosk_args(parser)
+    parser.add_argument(
+        "--output-path",
+        type=Path,
+        default="tmp/wav",
+        help="Audio write / temp file output directory.",
+    )
+    parser.add_argument("--use-cuda", type=bool, help="Run model on CUDA.", default=False)
+    resources.add_resource_args(parser)
+    profiling.add_profile_args(parser)
+    parser.add_argument("--audio-bank", type=Path, default=None, help="Pre-rendered audio bank (see audiobank.py), known lines are played from it without synthesis")
+    deadline.add_deadline_args(parser)
+
+    # Run control & reporting
+    parser.add_argument("--duration", type=float, default=None, help="Stop after this many seconds")
+    parser.add_argument("--stats-file", type=Path, default=None, help="Append per utterance latency stats to this CSV file")
+
+    args = parser.parse_args(remaining_args)
+    if args.model_path is None and args.models is None:
+        parser.error("Either --model-path or --models is needed")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+    log = logging.getLogger("ShibbolethHeadless")
+    resources.apply_from_args(args, logger=logging.getLogger("Resources"))
+    profiler = profiling.start_from_args(args, logging.getLogger("Profiler"))
+
+    SetLogLevel(-1)
+    print("Initializing VOSK model...")
+    vosk_model = voskmodels.load_from_args(args, logging.getLogger("Vosk"))
+
+    # Set up the audio sources, one per stream
+    if args.input_wav is not None:
+        sources = [
+            engine.WavFileSource(path, samplerate=args.samplerate or 16000,
+                blocksize=args.blocksize, realtime=args.realtime, loop=args.loop)
+            for path in args.input_wav
+        ]
+    elif args.input_pipe:
+        sources = [engine.PcmPipeSource(samplerate=args.samplerate or 16000, blocksize=args.blocksize)]
+    elif args.channels > 1:
+        # NOTE: sounddevice must be imported after the VOSK model is initialized
+        sources = engine.MultiChannelMicrophoneSource(device=args.input_device, channels=args.channels,
+            samplerate=args.samplerate, blocksize=args.blocksize).sources
+    else:
+        sources = [engine.MicrophoneSource(device=args.input_device, samplerate=args.samplerate, blocksize=args.blocksize)]
+    for source in sources:
+        print(f"Input: {type(source).__name__} at {source.samplerate} Hz, blocksize {source.blocksize}")
+
+    # Set up the audio sink for a stream
+    def make_sink(idx: int):
+        if args.no_output:
+            return engine.NullSink()
+        elif args.output_file is not None:
+            if len(sources) == 1:
+                return engine.FileSink(args.output_file)
+            return engine.FileSink(args.output_file.with_name(f"{args.output_file.stem}_stream{idx}{args.output_file.suffix}"))
+        else:
+            return engine.DeviceSink(device=args.output_device)
+
+    # Set up TTS model
+    model_specs = modelspec.specs_from_args(args, name="vits")
+    model_id = modelspec.default_model(model_specs, args.voice)
+    voice_synth = VoiceSynth(args.output_path.resolve(), args.use_cuda, logging.getLogger("VoiceSynthesizer"))
+    voice_synth.load_specs(model_specs)
+    voice_synth.profiler = profiler
+    if args.audio_bank is not None:
+        voice_synth.load_bank(args.audio_bank)
+    deadline_synth = deadline.from_args(args, voice_synth, logging.getLogger("Deadline"))
+
+    vad_options = {"hangover_ms": args.vad_hangover} if args.vad else None
+
+    if len(sources) == 1:
+        source = sources[0]
+        kaldi_recognizer = KaldiRecognizer(vosk_model, source.samplerate)
+        kaldi_recognizer.SetWords(True)
+        gate = engine.VoiceActivityGate(source.samplerate, **vad_options) if args.vad else None
+        speech_engine = engine.SpeechEngine(kaldi_recognizer, voice_synth, make_sink(0), log, model_id=model_id,
+            stats_path=args.stats_file, vad=gate, deadline_synth=deadline_synth, deadline=args.deadline)
+        engines = [speech_engine]
+        multi_engine = None
+    else:
+        multi_engine = engine.MultiStreamEngine(vosk_model, voice_synth, make_sink, log, model_id=model_id,
+            stats_path=args.stats_file, vad_options=vad_options, deadline_synth=deadline_synth, deadline=args.deadline)
+        engines = multi_engine.engines
+
+    try:
+        if multi_engine is None:
+            speech_engine.run(source, max_duration=args.duration)
+        else:
+            multi_engine.run(sources, max_duration=args.duration)
+    except KeyboardInterrupt:
+        print("Exit by KeyboardInterrupt")
+    finally:
+        if multi_engine is None:
+            speech_engine.sink.close()
+        for speech_engine, source in zip(engines, sources):
+            print(f"--- {speech_engine.name} ---")
+            print(json.dumps(engine.summarize(speech_engine.stats), indent=2))
+            if hasattr(source, "stats"):
+                print(f"Input buffer: {source.stats()}")
+            if speech_engine.vad is not None:
+                print(f"VAD: {speech_engine.vad.stats()}")
+        if deadline_synth is not None:
+            print(f"Deadline: {json.dumps(deadline_synth.metrics(), indent=2)}")
+        if profiler is not None:
+            profiler.stop()
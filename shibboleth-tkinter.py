@@ -12,11 +12,17 @@ import logging
 from pathlib import Path
 from typing import Callable
 
-from tkinter import Tk, Button, Text, INSERT, END
+from tkinter import Tk, Button, Text, Label, StringVar, END
 import tkinter.ttk as ttk
 
 from voicesynth import VoiceSynth
-from vosk import Model, KaldiRecognizer, SetLogLevel
+from ringbuffer import PCMRingBuffer, accept_waveform
+from vad import VoiceActivityGate, AUDIO, END as VAD_END # tkinter has an END too
+import voskmodels
+import modelspec
+import resources
+import profiling
+from vosk import KaldiRecognizer, SetLogLevel
 
 def int_or_str(text):
     """Helper function for argument parsing."""
@@ -28,11 +34,18 @@ def int_or_str(text):
 class GuiWrapper:
     """
     Configure and build the gui.
-    Also includes a function called by a worker thread to read
-    incoming commands from worker threads in the command queue
+    Worker threads hand messages to the gui with post(), which wakes up the
+    Tk event loop with a virtual event only when there is something new to show.
+    All messages that arrived since the last wakeup are handled in one batch.
     """
-    def __init__(self, window: Tk, command_queue: queue, button_callback: Callable):
+    MESSAGE_EVENT = "<<ShibbolethMessage>>"
+
+    def __init__(self, window: Tk, command_queue: queue, button_callback: Callable, max_lines: int = 500):
+        self.window = window
         self.queue = command_queue
+        self.max_lines = max_lines # oldest transcriptions are dropped from the text widget beyond this
+        self._wakeup_pending = threading.Event()
+
         # See: https://tkdocs.com/tutorial/text.html
         # See: https://www.tutorialspoint.com/python/tk_text.htm
         # width is in characters, not pixels!
@@ -40,53 +53,94 @@ class GuiWrapper:
         self.text.pack()
         self.text.configure(font = ("Helvetica", 20, "bold"))
 
+        # Live partial transcription & synthesis progress
+        self.partial = StringVar(window, value="")
+        self.partial_label = Label(window, textvariable=self.partial, font=("Helvetica", 20), fg="gray")
+        self.partial_label.pack()
+        self.status = StringVar(window, value="")
+        self.status_label = Label(window, textvariable=self.status, font=("Helvetica", 12))
+        self.status_label.pack()
+
         # Set up the GUI
         self.quitbut = Button(window, text='QUIT', command=button_callback)
         self.quitbut.pack()
         # Add more GUI stuff here depending on your specific needs
 
-    def updateFromQueue(self):
+        self.window.bind(self.MESSAGE_EVENT, self.updateFromQueue)
+
+    def post(self, kind: str, msg: str):
+        """
+        Called from worker threads. kind is one of
+            text        a final transcription, appended to the text widget
+            partial     the current partial transcription (replaces the previous one)
+            status      synthesis progress / status line (replaces the previous one)
+        """
+        self.queue.put((kind, msg))
+        if not self._wakeup_pending.is_set():
+            self._wakeup_pending.set()
+            self.window.event_generate(self.MESSAGE_EVENT, when="tail")
+
+    def updateFromQueue(self, event=None):
         """Handle all messages currently in the queue, if any."""
-        while self.queue.qsize(  ):
+        self._wakeup_pending.clear()
+        lines = []
+        partial = None
+        status = None
+        while True:
             try:
-                msg = self.queue.get(0)
-                # Check contents of message and do whatever is needed. As a
-                # simple test, print it (in real life, you would
-                # suitably update the GUI's display in a richer fashion).
-                self.text.insert(INSERT, msg)
+                kind, msg = self.queue.get_nowait()
             except queue.Empty:
-                # just on general principles, although we don't
-                # expect this branch to be taken in this case
-                pass
+                break
+            if kind == "text":
+                lines.append(msg)
+            elif kind == "partial":
+                partial = msg
+            elif kind == "status":
+                status = msg
+
+        # Only the latest partial / status is shown, rapid updates in between are dropped.
+        if partial is not None:
+            self.partial.set(partial)
+        if status is not None:
+            self.status.set(status)
+
+        if lines:
+            self.text.insert(END, "".join(lines))
+            num_lines = int(self.text.index("end-1c").split(".")[0])
+            if num_lines > self.max_lines:
+                self.text.delete("1.0", f"{num_lines - self.max_lines + 1}.0")
+            self.text.see(END)
 
 class App:
     """
     The main application logic.
     * Builds the gui from the Tkinter root window
     * Sets up any worker threads to run background tasks
-    * Runs a periodic call to the GuiWrapper to update the gui from whatever
-        results the background tasks are producing
+    * Background tasks post their results to the GuiWrapper, which updates
+        the gui from the Tk event loop when results arrive
     """
-    def __init__(self, window: Tk, kaldi_recognizer, voice_synth, tts_model_spec, args):
+    def __init__(self, window: Tk, kaldi_recognizer, voice_synth, model_specs, args):
         """
         Build the GUI
         Start all the background threads
-        Start a periodic update function in the main thread (which will also be used by Tkinter)
         """
         self.window = window
 
         self.kaldi_recognizer = kaldi_recognizer
         self.voice_synth = voice_synth
-        self.tts_model_spec = tts_model_spec
+        self.model_specs = model_specs
 
         self.args = args
 
         self.filenum = 0
-        self.audio_queue = queue.Queue() # used by audio thread to transmit incoming mic frames
+        # used by audio thread to transmit incoming mic frames, holds at most 5 seconds of audio
+        self.audio_ring = PCMRingBuffer.for_stream(args.samplerate, args.blocksize, seconds=5.0)
+        # optional voice activity gate in front of the recognizer
+        self.vad = VoiceActivityGate(args.samplerate, hangover_ms=args.vad_hangover) if args.vad else None
         self.message_queue = queue.Queue() # used to pass transcribed text messages to Tkinter thread
 
         # Build the gui
-        self.gui = GuiWrapper(self.window, self.message_queue, self.endApplicationFunc)
+        self.gui = GuiWrapper(self.window, self.message_queue, self.endApplicationFunc, max_lines=args.max_lines)
 
         # Used by worker threads and main thread
         self.running = True
@@ -97,25 +151,6 @@ class App:
         self.textgen_thread = threading.Thread(target=self.textgenThread)
         self.textgen_thread.start(  )
 
-        # Start periodic updates on the GUI
-        self.update_every = 200 # update the gui every 200ms
-        self.periodicUpdateGUI()
-
-    def periodicUpdateGUI(self):
-        """
-        Loops until self.running == False
-        Update the gui every self.update_every ms
-        """
-        self.gui.updateFromQueue()
-
-        # Tkinter's after method allows you to schedule callbacks on the event loop.
-        if self.running:
-            self.window.after(self.update_every, self.periodicUpdateGUI)
-        else:
-            # This is a brutal stop of the system. You may want to do
-            # some cleanup before actually shutting it down.
-            sys.exit(1)
-
     def textgenThread(self):
         """
         This function runs inside a thread.
@@ -124,7 +159,7 @@ class App:
         to yield control pretty regularly, by select or otherwise.
         """
 
-        self.voice_synth.load_models(self.tts_model_spec)
+        self.voice_synth.load_specs(self.model_specs)
 
         try:
             # Open the input audio stream from the microphone and let's go!
@@ -141,19 +176,43 @@ class App:
                 print("Press Ctrl+C to stop the recording")
                 print("#" * 80)
 
+                self.gui.post("status", "Listening...")
+                last_partial = ""
+                dropped = 0
                 while self.running:
-                    data = self.audio_queue.get()
-                    if self.kaldi_recognizer.AcceptWaveform(data):
-                        txt = json.loads(self.kaldi_recognizer.Result())
-                        txt = txt['text']
+                    block = self.audio_ring.read(timeout=0.5)
+                    if block is None:
+                        continue
+                    data, captured = block
+                    if self.audio_ring.dropped_blocks != dropped:
+                        dropped = self.audio_ring.dropped_blocks
+                        print(f"Recognition falling behind, dropped {dropped} audio blocks so far", file=sys.stderr)
+                    if self.vad is None:
+                        actions = [(AUDIO, data)]
+                    else:
+                        actions = self.vad.process(data) # empty for silent blocks
+
+                    for action, audio in actions:
+                        if action == VAD_END:
+                            txt = json.loads(self.kaldi_recognizer.FinalResult())['text']
+                        elif accept_waveform(self.kaldi_recognizer, audio):
+                            txt = json.loads(self.kaldi_recognizer.Result())['text']
+                        else:
+                            j = json.loads(self.kaldi_recognizer.PartialResult())
+                            if j['partial'] != last_partial:
+                                last_partial = j['partial']
+                                self.gui.post("partial", last_partial)
+                            continue
+
+                        last_partial = ""
+                        self.gui.post("partial", "")
                         if len(txt) > 0:
+                            self.gui.post("text", txt + '\n')
+                            self.gui.post("status", f"Synthesizing: {txt}")
                             wav, sr, outfile = self.synthesize(txt)
-                            self.message_queue.put(txt + '\n')
-                            sd.play(wav, sr)
-                    else:
-                        j = json.loads(self.kaldi_recognizer.PartialResult())
-                        # print(j['partial'])
-                        # Don't do anything with partial results for now!
+                            self.gui.post("status", f"Speaking ({len(wav) / sr:.1f}s)")
+                            with resources.audio_affinity():
+                                sd.play(wav, sr)
 
         except KeyboardInterrupt:
             print("\nDone")
@@ -165,7 +224,7 @@ class App:
         # TODO: Do I even need a temp directory?
         #   Maybe writing tmp file is not needed...
         wav, sr, outfile = self.voice_synth.synthesize(
-            text, filename, "vits",
+            text, filename, self.args.model_id,
             speaker_name=None,
             language_name=None,
             clean_text=False,
@@ -177,14 +236,18 @@ class App:
 
     def processMicrophoneInput(self, indata, frames, time, status):
         """This is called (from a separate thread) for each audio block."""
-        if status:
-            print(status, file=sys.stderr)
-
-        self.audio_queue.put(bytes(indata))
+        resources.pin_audio_callback()
+        self.audio_ring.callback(indata, frames, time, status)
 
 
     def endApplicationFunc(self):
+        """
+        Stop the worker threads and the Tk event loop.
+        This is a brutal stop of the system. You may want to do
+        some cleanup before actually shutting it down.
+        """
         self.running = 0
+        sys.exit(1)
 
 if __name__ == "__main__":
     # python test_vosk_coqui_communication.py --model-path ../../../outputs/checkpoints/hifi54_390k/
@@ -224,14 +287,21 @@ if __name__ == "__main__":
 
     parser.add_argument("-b", "--blocksize", type=int, help="blocksize")
 
+    parser.add_argument("--vad", action="store_true", help="Skip silent blocks and end utterances with a voice activity detector")
+
+    parser.add_argument("--vad-hangover", type=float, default=600.0, help="Silence (ms) after which the VAD ends an utterance")
+
     parser.add_argument(
         "--model-path",
         type=Path,
         default=None,
-        required=(not INPUT_ONLY),
+        required=False,
         help='Path to root directory of TTS model. Files expected in this dir: model_file.pth, config.json, and more depending on model type'
     )
 
+    parser.add_argument("--models", type=Path, default=None, help="Model manifest (see modelspec.py) instead of --model-path, --model-id picks the model to speak with.")
+    parser.add_argument("--model-id", type=str, default=None, help="Model of the --models manifest to speak with (default: its first preloaded model).")
+
     parser.add_argument(
         "--model-type",
         type=str,
@@ -249,7 +319,19 @@ if __name__ == "__main__":
 
     parser.add_argument("--use-cuda", type=bool, help="Run model on CUDA.", default=False)
 
+    voskmodels.add_vosk_args(parser)
+    resources.add_resource_args(parser)
+    profiling.add_profile_args(parser)
+
+    parser.add_argument("--max-lines", type=int, default=500, help="Number of transcribed lines kept in the text display.")
+
     args = parser.parse_args(remaining_args)
+    if args.models is None and args.model_path is None and not INPUT_ONLY:
+        parser.error("Either --model-path or --models is needed")
+    if args.model_type != "vits":
+        parser.error(f"Model type '{args.model_type}' is not yet supported")
+    resources.apply_from_args(args, logger=logging.getLogger("Resources"))
+    profiler = profiling.start_from_args(args, logging.getLogger("Profiler"))
 
     # Log Level of VOSK
     # You can set log level to -1 to disable debug messages from vosk
@@ -258,10 +340,9 @@ if __name__ == "__main__":
     print("Initializing VOSK model...")
 
     # VOSK Speech Recognition Model
-    vosk_model = Model(lang="en-us")
-    # You can also init model by name or with a folder path
-    # model = Model(model_name="vosk-model-en-us-0.21")
-    # model = Model("models/en")
+    # Resolved from the local vosk cache (no download unless --allow-download), see voskmodels.py
+    # You can also select a model by name or with a folder path using --vosk-model
+    vosk_model = voskmodels.load_from_args(args, logging.getLogger("Vosk"))
 
     # NOTE: There is a very strange incompatibility between the VOSK model loading and sounddevice!
     #       sounddevice must be imported after the model is initialized
@@ -287,27 +368,13 @@ if __name__ == "__main__":
         print(f"No blocksize specified, using {args.blocksize}")
 
     AUDIO_WRITE_PATH = args.output_path.resolve() # audio renders go here
-    TTS_MODEL_TYPE = args.model_type
-    TTS_MODEL_PATH = args.model_path.resolve() # path to root directory of model
     USE_CUDA = args.use_cuda
 
-    # TODO: Break this out into a json model config file.
-    # Build a Model Spec depending on type.
-    modelroot = str(TTS_MODEL_PATH.parent)
-    modelsubdir = TTS_MODEL_PATH.name
-    tts_model_spec = { 'tts_model_root_path': modelroot, 'tts': None }
-    if TTS_MODEL_TYPE == "vits":
-        tts_model_spec['tts'] = {
-            "vits": [
-                os.path.join(modelsubdir, "model_file.pth"),
-                os.path.join(modelsubdir, "config.json"),
-                None, None, None, None, None, None
-            ]
-        }
-    elif TTS_MODEL_TYPE == "capacitron":
-        raise Error("Capacitron support is not yet implemented")
-    else:
-        raise Error(f"Unknown model type '{TTS_MODEL_TYPE}'")
+    # Model Specs from the --models manifest, or the --model-path directory, see modelspec.py
+    model_specs = []
+    if args.models is not None or args.model_path is not None:
+        model_specs = modelspec.specs_from_args(args, name=args.model_type)
+        args.model_id = modelspec.default_model(model_specs, args.model_id)
 
     print("Initializing Kaldi recognizer...")
     # Create the Kaldi Recognizer
@@ -316,6 +383,7 @@ if __name__ == "__main__":
     kaldi_recognizer.SetPartialWords(True)
 
     voice_synth = VoiceSynth(AUDIO_WRITE_PATH, USE_CUDA, logging.getLogger("VoiceSynthesizer"))
+    voice_synth.profiler = profiler
 
     window = Tk()
     window.title("Shibboleth")
@@ -325,7 +393,7 @@ if __name__ == "__main__":
             window=window,
             kaldi_recognizer=kaldi_recognizer,
             voice_synth=voice_synth,
-            tts_model_spec=tts_model_spec,
+            model_specs=model_specs,
             args=args
         )
         window.mainloop() # run the Tk event loop
@@ -333,3 +401,5 @@ if __name__ == "__main__":
         print("Exit by KeyboardInterrupt")
     finally:
         app.running = 0
+        if profiler is not None:
+            profiler.stop()
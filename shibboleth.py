@@ -3,12 +3,15 @@
 import sys
 import os
 import json
+import time
+import logging
 from pathlib import Path
 import asyncio
 import websockets
 import sounddevice as sd
 import numpy as np
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 import torch
 
@@ -16,21 +19,46 @@ from TTS.utils.synthesizer import Synthesizer
 torch.set_grad_enabled(False) # we're only doing inference
 
 import voicesynth
+import resources
+import profiling
+import deadline
+import modelspec
+import hotreload
+import audiobank
 import librosa # this is necessary for some reason on some systems, and breaks others... also depends when you import it..
 
 class ShibbolethWSS(object):
     async def handler(self, websocket, path):
         print(f"Got: {websocket} : {path}")
         async for message in websocket:
+            received = time.time() # arrival, so the time spent queued behind other lines counts against the deadline
             print(f"RCV: {message}")
             if message == "Handshake!":
                 pass # ignore...
+            elif message.startswith("{") and "\"admin\"" in message:
+                await websocket.send(json.dumps(self.admin(message, websocket.remote_address[0])))
             else:
-                if message.strip() != "":
-                    self.synthesize_and_play(text=message)
-                else:
-                    print("...ignoring empty text...")
-                await websocket.send(message) # echo message back to the client
+                # synthesized one at a time on the synthesis thread, the loop keeps receiving meanwhile
+                asyncio.ensure_future(self.speak(websocket, message, received))
+
+    async def speak(self, websocket, message: str, received: float):
+        """Synthesize and play a message on the synthesis thread, then echo it back to the client."""
+        reply = message
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.synthesis_pool, self.speak_text, message, received)
+        except Exception as e:
+            logging.getLogger("ShibbolethWSS").exception(f"Speaking >{message}< failed")
+            reply = json.dumps({"error": str(e), "text": message})
+        try:
+            await websocket.send(reply) # echo message back to the client
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    def speak_text(self, text: str, received: float):
+        if text.strip() != "":
+            self.synthesize_and_play(text=text, received=received)
+        else:
+            print("...ignoring empty text...")
 
     async def main(self, synth, system_samplerate, system_device, ws_bind_ip, args):
         self.voicesynth = synth
@@ -38,6 +66,15 @@ class ShibbolethWSS(object):
         self.device_samplerate = system_samplerate
         self.device = system_device
         self.ws_bind_host, self.ws_bind_port = ws_bind_ip
+        self.splice = args.splice
+        self.stream = args.stream
+        self.model_id = args.model_id
+        self.admin_token = args.admin_token
+        self.watcher = hotreload.watch_from_args(args, synth, self.model_id, logging.getLogger("ModelWatcher"))
+        self.deadline = args.deadline
+        self.deadline_synth = deadline.from_args(args, synth, logging.getLogger("Deadline"))
+        # one thread: lines are spoken in arrival order, echoes go out in the same order
+        self.synthesis_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="synthesis")
 
         if args.test:
             testtext = "Please say the words as I repeat them. Shibboleths have been used throughout history in many societies as passwords, simple ways of self-identification, signaling loyalty and affinity, maintaining traditional segregation, or protecting from real or perceived threats."
@@ -47,25 +84,84 @@ class ShibbolethWSS(object):
         async with websockets.serve(self.handler, self.ws_bind_host, self.ws_bind_port):
             await asyncio.Future()  # run forever
 
-    def synthesize_and_play(self, text: str):
-        wav,sr,wavfile = self.synthesize(text=text)
+    def admin(self, message: str, remote_host: str) -> dict:
+        """Admin commands (see hotreload.handle_admin), sent as JSON {"admin": ...}."""
+        try:
+            command = json.loads(message)
+        except ValueError:
+            return {"error": "admin commands are JSON"}
+        if not hotreload.authorized(command, remote_host, self.admin_token):
+            return {"admin": command.get("admin"), "error": "not authorized"}
+        return hotreload.handle_admin(command, self.voicesynth, self.model_id, logging.getLogger("HotReload"))
+
+    def synthesize_and_play(self, text: str, received: float = None):
+        if self.stream and self.deadline_synth is None and not self.banked(text):
+            self.stream_and_play(text)
+            return
+        wav,sr,wavfile = self.synthesize(text=text, received=received)
 
         # If DEV_SAMPLERATE != sr then we have a problem and need to resample...
         if(self.device_samplerate != sr):
             wav = librosa.resample(wav, orig_sr=sr, target_sr=self.device_samplerate)
             print(f"Resampling from {sr} to {self.device_samplerate}")
-        sd.play(data=wav, samplerate=self.device_samplerate)
-
-    def synthesize(self, text: str):
+        with resources.audio_affinity():
+            sd.play(data=wav, samplerate=self.device_samplerate)
+
+    def banked(self, text: str) -> bool:
+        """Whether text is in the audio bank, banked lines are played from it instead of streamed."""
+        bank = self.voicesynth.audio_bank
+        if bank is None:
+            return False
+        return audiobank.line_key(self.voicesynth.prepare_text(text, False, None), (self.model_id, None, None)) in bank
+
+    def stream_and_play(self, text: str):
+        """
+        Play text while it is synthesized (see VoiceSynth.synthesize_stream), VITS audio starts after
+        the first window of the first sentence is decoded instead of after the whole line.
+        Blocks until the line has played, so the next line starts after it instead of cutting it off.
+        """
+        print(f"Streaming: >>{text}<<")
+        self.voicesynth.require_model(self.model_id)
+        sr = self.voicesynth.tts[self.model_id]["sr"]
+        start_time = time.time()
+        first = True
+        with resources.audio_affinity():
+            stream = sd.OutputStream(samplerate=self.device_samplerate, channels=1, dtype="float32", device=self.device)
+            stream.start()
+        try:
+            for chunk in self.voicesynth.synthesize_stream(text, self.model_id):
+                if self.device_samplerate != sr:
+                    chunk = librosa.resample(chunk, orig_sr=sr, target_sr=self.device_samplerate)
+                if first:
+                    print(f"Time to first audio: {time.time() - start_time:.3f}s")
+                    first = False
+                stream.write(np.ascontiguousarray(chunk, dtype=np.float32)[:, None])
+        finally:
+            stream.close()
+
+    def synthesize(self, text: str, received: float = None):
         print(f"Generating: >>{text}<<")
         filename = f"testoutput{self.filenum}.wav"
-        wav, sr, outfile = self.voicesynth.synthesize(
-            text, filename, "vits",
-            speaker_name=None,
-            language_name=None,
-            clean_text=False,
-            rewrite_words=None
-        )
+        if self.deadline_synth is not None and received is not None:
+            wav, sr, outfile, tier = self.deadline_synth.synthesize(
+                text, filename, self.model_id, received + self.deadline,
+                speaker_name=None,
+                language_name=None,
+                clean_text=False,
+                rewrite_words=None,
+                splice=self.splice
+            )
+            if tier != "full":
+                print(f"Deadline: spoke '{tier}', {self.deadline_synth.metrics()['tiers']}")
+        else:
+            wav, sr, outfile = self.voicesynth.synthesize(
+                text, filename, self.model_id,
+                speaker_name=None,
+                language_name=None,
+                clean_text=False,
+                rewrite_words=None,
+                splice=self.splice
+            )
         self.filenum += 1
         return wav, sr, outfile
 
@@ -133,9 +229,22 @@ if __name__ == "__main__":
         help="Audio write / temp file output directory.",
     )
 
+    parser.add_argument("--models", type=Path, default=None, help="Model manifest (see modelspec.py) instead of --model-path, --voice picks the model to speak with.")
     parser.add_argument("--use-cuda", type=bool, help="Run model on CUDA.", default=False)
 
+    resources.add_resource_args(parser)
+    profiling.add_profile_args(parser)
+
+    parser.add_argument("--splice", action="store_true", help="Render text clause by clause, reusing clauses that were rendered before.")
+    parser.add_argument("--audio-bank", type=Path, default=None, help="Pre-rendered audio bank (see audiobank.py), known lines are played from it without synthesis.")
+    parser.add_argument("--stream", action="store_true", help="Play VITS lines while they are decoded, in windows of the latent sequence (see windowed.py). Not combined with --deadline.")
+    parser.add_argument("--splice-cache-mb", type=int, default=256, help="Memory for rendered clauses when using --splice (MB).")
+    deadline.add_deadline_args(parser)
+    hotreload.add_reload_args(parser)
+
     args = parser.parse_args(remaining_args)
+    resources.apply_from_args(args, logger=logging.getLogger("Resources"))
+    PROFILER = profiling.start_from_args(args, logging.getLogger("Profiler"))
 
     DEFAULT_MODELS = {
         "effiamir": {
@@ -171,49 +280,28 @@ if __name__ == "__main__":
     print(f"Using Device Sample Rate: {DEV_SAMPLERATE}")
 
     # Check if model-path is set. Confirm files exist.
-    if args.model_path is None:
+    if args.models is None and args.model_path is None:
         print(f"No model_path specified, using voice '{VOICE}': {DEFAULT_MODELS[args.voice]}")
         args.model_path = DEFAULT_MODELS[VOICE]['path']
-
-    if args.model_path.exists():
-        for checkpoint in args.model_path.glob('*.pth'):
-            TTS_MODEL_PATH = checkpoint
-        for config in args.model_path.glob('*.json'):
-            TTS_CONFIG_PATH = config
-    else:
-        raise Error(f"Model Path Does Not Exist: {args.model_path}")
+    MODEL_SPECS = modelspec.specs_from_args(args, name="vits")
+    args.model_id = modelspec.default_model(MODEL_SPECS, VOICE)
 
     # Set up TTS model.
     AUDIO_WRITE_PATH = args.output_path.resolve() # audio renders go here
-    TTS_MODEL_TYPE = "vits"
-    TTS_MODEL_NAME = args.voice
     USE_CUDA = args.use_cuda
 
-    # print(f"Loading model: {TTS_MODEL_PATH}\nWith Config: {TTS_CONFIG_PATH}\n")
-    # VOICE_SYNTH = Synthesizer(
-    #     str(TTS_MODEL_PATH),
-    #     str(TTS_CONFIG_PATH),
-    #     use_cuda=USE_CUDA,
-    # )
-    # print("Done loading model")
-
-    tts_model_spec = { 'tts_model_root_path': args.model_path, 'tts': None }
-    tts_model_spec['tts'] = {
-        "vits": [
-            TTS_MODEL_PATH.name,
-            TTS_CONFIG_PATH.name,
-            None, None, None, None, None, None
-        ]
-    }
-    VOICE_SYNTH = None
     VOICE_SYNTH = voicesynth.VoiceSynth(AUDIO_WRITE_PATH, USE_CUDA, logging.getLogger("VoiceSynthesizer"))
-    #VOICE_SYNTH.load_model(TTS_MODEL_NAME, TTS_MODEL_PATH, TTS_CONFIG_PATH)
-    VOICE_SYNTH.load_models(tts_model_spec)
+    VOICE_SYNTH.load_specs(MODEL_SPECS)
+    VOICE_SYNTH.profiler = PROFILER
+    if args.splice:
+        VOICE_SYNTH.enable_splicing(args.splice_cache_mb * 1024 * 1024)
+    if args.audio_bank is not None:
+        VOICE_SYNTH.load_bank(args.audio_bank)
 
     text = "Starting the Shibboleth, this is just a test. Please say the words as I repeat them."
     filename = f"testoutput.wav"
     wav, sr, outfile = VOICE_SYNTH.synthesize(
-        text, filename, "vits",
+        text, filename, args.model_id,
         speaker_name=None,
         language_name=None,
         clean_text=False,
@@ -227,3 +315,8 @@ if __name__ == "__main__":
         asyncio.run(shib.main(VOICE_SYNTH, DEV_SAMPLERATE, DEVICE, BIND_IP, args))
     except KeyboardInterrupt as ke:
         print("Received CTRL+C ... exit server.")
+    finally:
+        if getattr(shib, "deadline_synth", None) is not None:
+            print(json.dumps(shib.deadline_synth.metrics(), indent=2))
+        if PROFILER is not None:
+            PROFILER.stop()
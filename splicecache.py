@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Phrase-level audio splicing cache.
+
+Text is split at clause boundaries (punctuation). Rendered clause audio is
+kept in a bounded LRU store keyed by (voice, clause text), the voice being
+(model id, model generation, speaker, language), so when a script
+reuses a phrase inside a different sentence only the clauses that have not
+been heard before go to the model. The pieces are joined with a short pause
+(depending on the punctuation) and short crossfades, so the joins do not click.
+"""
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Tuple, Dict, Hashable
+
+import numpy as np
+
+# Split after clause punctuation followed by whitespace, keeping the punctuation with the clause
+CLAUSE_REGEX = re.compile(r"(?<=[,;:.!?—])\s+")
+
+# Pause after a clause, by its final punctuation (seconds)
+PAUSES = {",": 0.12, ";": 0.2, ":": 0.2, "—": 0.2, ".": 0.4, "!": 0.4, "?": 0.4}
+DEFAULT_PAUSE = 0.12
+
+
+def split_clauses(text: str) -> List[str]:
+    return [c.strip() for c in CLAUSE_REGEX.split(text.strip()) if c.strip() != ""]
+
+
+def clause_key(clause: str) -> str:
+    """Clauses that only differ in case or spacing sound the same."""
+    return " ".join(clause.lower().split())
+
+
+def trim_padding(wav: np.ndarray, threshold: float = 1e-4) -> np.ndarray:
+    """Strip leading/trailing (near) silence, e.g. the zero padding pr_synthesize adds after every sentence."""
+    voiced = np.flatnonzero(np.abs(wav) > threshold)
+    if len(voiced) == 0:
+        return wav[:0]
+    return wav[voiced[0]:voiced[-1] + 1]
+
+
+def splice(pieces: List[np.ndarray], pauses: List[float], sr: int, fade_ms: float = 8.0) -> np.ndarray:
+    """
+    Join clause renders: every piece gets a short fade in/out and is followed by its pause.
+    Consecutive pieces overlap by the fade length, so pieces that end or start on
+    a voiced sample crossfade instead of clicking.
+    """
+    fade = int(sr * fade_ms / 1000)
+    ramp = np.linspace(0.0, 1.0, fade, dtype=np.float32) if fade > 0 else None
+
+    total = sum(len(p) for p in pieces) + sum(int(sr * p) for p in pauses)
+    out = np.zeros(total + fade, dtype=np.float32)
+    pos = 0
+    for piece, pause in zip(pieces, pauses):
+        piece = np.asarray(piece, dtype=np.float32).copy()
+        if ramp is not None and len(piece) > 2 * fade:
+            piece[:fade] *= ramp
+            piece[-fade:] *= ramp[::-1]
+        start = max(0, pos - fade) if pos > 0 else 0
+        out[start:start + len(piece)] += piece
+        pos = start + len(piece) + int(sr * pause)
+    return out[:pos]
+
+
+class ClauseCache:
+    """
+    LRU store of rendered clause audio, bounded by total bytes.
+        max_bytes       Upper bound of the audio held in memory
+    """
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.store = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> np.ndarray:
+        with self.lock:
+            wav = self.store.get(key)
+            if wav is None:
+                self.misses += 1
+                return None
+            self.store.move_to_end(key)
+            self.hits += 1
+            return wav
+
+    def put(self, key: Hashable, wav: np.ndarray) -> None:
+        wav = np.asarray(wav, dtype=np.float32)
+        if wav.nbytes > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.store:
+                self.size -= self.store.pop(key).nbytes
+            self.store[key] = wav
+            self.size += wav.nbytes
+            while self.size > self.max_bytes:
+                _, evicted = self.store.popitem(last=False)
+                self.size -= evicted.nbytes
+
+    def forget_model(self, model_id: str) -> int:
+        """
+        Drop all clauses rendered by model_id (e.g. after it was reloaded). Returns the number dropped.
+        Clauses of the old model put after this are never looked up: the voice includes the model generation.
+        """
+        with self.lock:
+            keys = [key for key in self.store if key[0][0] == model_id]
+            for key in keys:
+                self.size -= self.store.pop(key).nbytes
+        return len(keys)
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def stats(self) -> Dict:
+        return {"clauses": len(self.store), "bytes": self.size, "hits": self.hits, "misses": self.misses}
+
+
+def plan(text: str, voice: Hashable, cache: ClauseCache) -> List[Tuple[str, Tuple, np.ndarray]]:
+    """
+    Split text into clauses and look each up in the cache.
+    Returns [(clause, cache key, cached audio or None), ...]
+    """
+    steps = []
+    for clause in split_clauses(text):
+        key = (voice, clause_key(clause))
+        steps.append((clause, key, cache.get(key)))
+    return steps
+
+
+def pause_after(clause: str) -> float:
+    return PAUSES.get(clause[-1], DEFAULT_PAUSE) if clause else DEFAULT_PAUSE
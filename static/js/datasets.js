@@ -1,24 +1,46 @@
 // Handle file loading.
 // Dataset management.
 // Managing utterances & audio files...
+// Recordings are uploaded to the server's dataset (POST /dataset/upload, see shibboleth-flask.py),
+// which names the clips and records them in its manifest.
 'use strict';
 
 const DatasetManager = function(args) {
+  const uploadUrl = (args && args.uploadUrl) ? args.uploadUrl : "/dataset/upload";
   let fileCount = 0;
 
   const func = ()=>{};
 
-  // The clip name should be generated based on enumeration in the existing dataset + label information...
-  const generateAudioFileName = ()=>{
+  // Local name of a recording until it is uploaded, the server assigns the dataset clip name.
+  const generateAudioFileName = (speaker)=>{
     fileCount++;
-    return "mydatasetrecording" + fileCount;
+    return (speaker || "recording") + "_take" + fileCount;
   };
 
+  // Upload a recording with its prompt (and the prompt's index in the server's corpus), resolves to
+  // the server's reply ({response, path, duplicate, next}), rejects with the error message.
+  const upload = (audioBlob, clipName, prompt, speaker, promptIndex)=>{
+    const formData = new FormData();
+    formData.append('file', audioBlob, clipName);
+    formData.append('prompt', prompt || "");
+    formData.append('speaker', speaker || "unknown");
+    if(promptIndex !== undefined) {
+      formData.append('index', promptIndex);
+    }
+    return fetch(uploadUrl, { method: "POST", body: formData })
+      .then((res) => res.json().then((reply) => {
+        if(!res.ok) {
+          throw new Error(reply.error || ("HTTP error " + res.status));
+        }
+        return reply;
+      }));
+  };
 
   return {
     count: fileCount,
     func: func,
     generateAudioFileName: generateAudioFileName,
+    upload: upload,
   };
 }
 
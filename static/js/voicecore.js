@@ -3,6 +3,7 @@
 // Handle recording/stopping recording to files.
 // Handle playback of files.
 // Handle playback on a visualizer (if provided)
+// Handle streaming microphone audio to the server while recording (createStreamer)
 'use strict';
 // More info on modules: https://developer.mozilla.org/en-US/docs/Web/JavaScript/Guide/Modules
 
@@ -98,6 +99,15 @@ const VoiceCore = function(args) {
   }
 
 
+  // Stream the first audio channel to a streamingest.py server (call after getMicrophoneAccess succeeded)
+  const createStreamer = (streamArgs)=>{
+    if(!audioCtx || audioChannels.length == 0) {
+      throw "Error: No microphone access, call getMicrophoneAccess first!";
+    }
+    return new PCMStreamer(Object.assign({ audioCtx: audioCtx, sourceNode: audioChannels[0], logger: log }, streamArgs));
+  }
+
+
   return {
     // Parameters...
     log: log,
@@ -110,6 +120,7 @@ const VoiceCore = function(args) {
 
     // Functions...
     getMicrophoneAccess: getMicrophoneAccess,
+    createStreamer: createStreamer,
   }
 }
 
@@ -181,4 +192,153 @@ const AudioVisualizer = function(args) {
   }
 }
 
-export { VoiceCore, AudioVisualizer };
+// Streams microphone audio as small 16 bit PCM frames over a websocket (see streamingest.py),
+// receives partial / final transcripts and plays synthesized speech sent back by the server.
+const PCMStreamer = function(args) {
+  // Class params -------------------------------------------
+  const url = (args.url) ? args.url : (()=>{throw "Error: No websocket url provided to PCMStreamer!"})();
+  const sourceNode = (args.sourceNode) ? args.sourceNode : (()=>{throw "Error: No source node provided to PCMStreamer!"})();
+  const audioCtx = (args.audioCtx) ? args.audioCtx : (()=>{throw "Error: No AudioContext provided to PCMStreamer!"})();
+  const targetRate = (args.sampleRate) ? args.sampleRate : 16000; // vosk models are trained on 16kHz
+  const frameSize = (args.frameSize) ? args.frameSize : 2048; // samples per frame at the context rate, ~43ms at 48kHz
+  const log = (args.logger) ? args.logger : console.log;
+  const onPartial = (args.onPartial) ? args.onPartial : ()=>{};
+  const onFinal = (args.onFinal) ? args.onFinal : ()=>{};
+  const onAudio = (args.onAudio) ? args.onAudio : ()=>{};
+
+  let socket = undefined;
+  let processor = undefined;
+  let pendingAudio = undefined; // header of the next binary (audio) message
+  let playbackTime = 0;
+  let carry = 0.0; // read position of the next output sample, counted from the previous frame's last sample (0 <= carry < ratio)
+  let last = undefined; // last input sample of the previous frame
+
+  // Resample to targetRate (linear interpolation) and convert to 16 bit PCM.
+  // Positions are counted on the previous frame's last sample followed by this frame, so every
+  // output sample between two frames interpolates real samples and the carry never goes negative.
+  const toPCM = (input)=>{
+    const ratio = audioCtx.sampleRate / targetRate;
+    const prev = (last === undefined) ? input[0] : last;
+    const length = Math.max(0, Math.ceil((input.length - carry) / ratio));
+    const pcm = new Int16Array(length);
+    for(let i = 0; i < length; i++) {
+      let pos = carry + i * ratio;
+      let idx = Math.floor(pos);
+      let frac = pos - idx;
+      let current = (idx === 0) ? prev : input[idx - 1];
+      let next = (idx < input.length) ? input[idx] : input[input.length - 1];
+      let v = current * (1.0 - frac) + next * frac;
+      v = Math.max(-1.0, Math.min(1.0, v));
+      pcm[i] = (v < 0) ? v * 0x8000 : v * 0x7FFF;
+    }
+    carry = carry + length * ratio - input.length;
+    last = input[input.length - 1];
+    return pcm;
+  };
+
+  // Queue synthesized speech back to back on the audio context.
+  const play = (pcm, sampleRate)=>{
+    const buffer = audioCtx.createBuffer(1, pcm.length, sampleRate);
+    const channel = buffer.getChannelData(0);
+    for(let i = 0; i < pcm.length; i++) {
+      channel[i] = pcm[i] / 0x8000;
+    }
+    const source = audioCtx.createBufferSource();
+    source.buffer = buffer;
+    source.connect(audioCtx.destination);
+    playbackTime = Math.max(playbackTime, audioCtx.currentTime);
+    source.start(playbackTime);
+    playbackTime += buffer.duration;
+  };
+
+  const onMessage = (event)=>{
+    if(typeof event.data !== "string") { // synthesized speech for the last audio header
+      if(pendingAudio) {
+        play(new Int16Array(event.data), pendingAudio.sampleRate);
+        onAudio(pendingAudio);
+        pendingAudio = undefined;
+      }
+      return;
+    }
+    const msg = JSON.parse(event.data);
+    if(msg.type === "partial") {
+      onPartial(msg.text);
+    } else if(msg.type === "final") {
+      onFinal(msg.text, msg.latency);
+    } else if(msg.type === "audio") {
+      pendingAudio = msg;
+    } else if(msg.type === "error") {
+      log("Streaming error: ", msg.message);
+    }
+  };
+
+  const start = ()=>{
+    if(processor) {
+      stop();
+    }
+    if(socket) { // the connection of a previous start(), its onclose must not stop the new stream
+      socket.onclose = null;
+      socket.onmessage = null;
+      socket.close();
+      socket = undefined;
+    }
+    return new Promise((resolve, reject)=>{
+      socket = new WebSocket(url);
+      socket.binaryType = "arraybuffer";
+      socket.onmessage = onMessage;
+      socket.onerror = (e)=>{ log("Streaming connection error"); reject(e); };
+      socket.onclose = ()=>{ stop(); };
+      socket.onopen = ()=>{
+        socket.send(JSON.stringify({ type: "start", sampleRate: targetRate }));
+        // NOTE: ScriptProcessorNode is deprecated in favour of AudioWorklet, but needs no separate worklet file
+        processor = audioCtx.createScriptProcessor(frameSize, 1, 1);
+        processor.onaudioprocess = (e)=>{
+          if(socket && socket.readyState === WebSocket.OPEN) {
+            socket.send(toPCM(e.inputBuffer.getChannelData(0)).buffer);
+          }
+        };
+        sourceNode.connect(processor);
+        processor.connect(audioCtx.destination); // the processor only runs while connected, its output is silent
+        log("Streaming to " + url);
+        resolve();
+      };
+    });
+  };
+
+  const stop = ()=>{
+    if(processor) {
+      sourceNode.disconnect(processor);
+      processor.disconnect();
+      processor.onaudioprocess = null;
+      processor = undefined;
+      carry = 0.0;
+      last = undefined;
+    }
+    if(socket && socket.readyState === WebSocket.OPEN) {
+      socket.send(JSON.stringify({ type: "end" })); // flush the last utterance, speech still arrives
+    }
+  };
+
+  const close = ()=>{
+    stop();
+    if(socket) {
+      socket.close();
+      socket = undefined;
+    }
+  };
+
+  return {
+    // Parameters...
+    log: log,
+    url: url,
+    sampleRate: targetRate,
+
+    // Functions...
+    start: start,
+    stop: stop,
+    close: close,
+    isStreaming: ()=>{ return processor !== undefined; },
+  }
+}
+
+export { VoiceCore, AudioVisualizer, PCMStreamer };
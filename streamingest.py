@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Live microphone streaming from the browser to server-side recognition.
+
+The browser (VoiceCore.createStreamer() in js/voicecore.js) sends small
+frames of 16 bit PCM while the performer speaks, instead of a WAV file once
+the recording is done. Every connection gets its own vosk KaldiRecognizer,
+fed frame by frame, and partial transcripts are pushed back as soon as they
+change. Finished utterances are synthesized and either sent back to the
+browser (remote performers) or played on the server's audio device, the
+same recognize-and-speak loop as shibboleth-tkinter.py.
+
+Protocol (one websocket per microphone):
+    client -> server    {"type": "start", "sampleRate": 16000}      once, before any audio
+                        <binary>                                    mono 16 bit little endian PCM frames
+                        {"type": "end"}                             flush the recognizer (stop recording)
+    server -> client    {"type": "ready", "sampleRate": 16000}
+                        {"type": "partial", "text": ...}            whenever the partial transcript changes
+                        {"type": "final", "text": ..., "latency": ...}  end of an utterance, latency from its last frame
+                        {"type": "audio", "text": ..., "sampleRate": 22050, "samples": n, "tier": ...}
+                        <binary>                                    the synthesized utterance, 16 bit PCM (--speak remote)
+                        {"type": "error", "message": ...}
+
+python streamingest.py --port 8766 --model-path ../outputs/checkpoints/efam48_220k/ --speak remote
+"""
+import json
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from logging import Logger
+from typing import Dict
+
+import numpy as np
+import websockets
+
+from ringbuffer import accept_waveform
+
+
+class StreamSession:
+    """Recognition state of one streaming connection."""
+    def __init__(self, websocket, kaldi_recognizer, samplerate: int) -> None:
+        self.websocket = websocket
+        self.kaldi_recognizer = kaldi_recognizer
+        self.samplerate = samplerate
+        self.last_partial = ""
+        self.last_frame = time.time()
+        self.frames = 0
+        self.bytes = 0
+        self.utterances = 0
+        self.speech_lock = asyncio.Lock() # utterances of one connection are spoken in order
+        self.speech_tasks = set()
+
+
+class StreamIngestServer:
+    """
+        vosk_model      The shared vosk Model (every connection gets its own KaldiRecognizer)
+        voice_synth     VoiceSynth to speak finished utterances with (None: recognition only)
+        model_id        Model of voice_synth to speak with
+        speak           "remote": send the speech back to the browser, "local": play it on the
+                        server's output device, "none": only send transcripts
+        max_workers     Threads for recognition and synthesis (vosk and torch release the GIL)
+    """
+    def __init__(self, vosk_model, voice_synth=None, model_id: str = "vits", speak: str = "remote",
+        deadline_synth=None, deadline: float = None, max_workers: int = 4, logger: Logger = None) -> None:
+        if speak not in ("remote", "local", "none"):
+            raise ValueError(f"Unknown speak mode '{speak}', use remote, local or none")
+        self.vosk_model = vosk_model
+        self.voice_synth = voice_synth
+        self.model_id = model_id
+        self.speak = speak if voice_synth is not None else "none"
+        self.deadline_synth = deadline_synth
+        self.deadline = deadline
+        self.log = logger if logger is not None else logging.getLogger("StreamIngest")
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self.synth_lock = threading.Lock()
+        self.filenum = 0
+        self.sessions = 0
+        self.active = 0
+        self.utterances = 0
+        self.latencies = []
+
+    def start_session(self, websocket, message: Dict) -> StreamSession:
+        from vosk import KaldiRecognizer
+        samplerate = int(message.get("sampleRate", 16000))
+        kaldi_recognizer = KaldiRecognizer(self.vosk_model, samplerate)
+        kaldi_recognizer.SetWords(True)
+        return StreamSession(websocket, kaldi_recognizer, samplerate)
+
+    async def handler(self, websocket, path=None):
+        loop = asyncio.get_running_loop()
+        session = None
+        self.sessions += 1
+        self.active += 1
+        try:
+            async for message in websocket:
+                if isinstance(message, str):
+                    try:
+                        control = json.loads(message)
+                    except ValueError:
+                        await websocket.send(json.dumps({"type": "error", "message": "expected a JSON control message"}))
+                        continue
+                    if control.get("type") == "start":
+                        session = await loop.run_in_executor(self.pool, self.start_session, websocket, control)
+                        await websocket.send(json.dumps({"type": "ready", "sampleRate": session.samplerate}))
+                    elif control.get("type") == "end" and session is not None:
+                        text = json.loads(await loop.run_in_executor(self.pool, session.kaldi_recognizer.FinalResult))["text"]
+                        await self.finish_utterance(session, text)
+                    continue
+
+                if session is None:
+                    await websocket.send(json.dumps({"type": "error", "message": "send {\"type\": \"start\"} before audio"}))
+                    continue
+                session.frames += 1
+                session.bytes += len(message)
+                session.last_frame = time.time()
+                if await loop.run_in_executor(self.pool, accept_waveform, session.kaldi_recognizer, message):
+                    text = json.loads(session.kaldi_recognizer.Result())["text"]
+                    await self.finish_utterance(session, text)
+                else:
+                    partial = json.loads(session.kaldi_recognizer.PartialResult())["partial"]
+                    if partial != session.last_partial:
+                        session.last_partial = partial
+                        await websocket.send(json.dumps({"type": "partial", "text": partial}))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self.active -= 1
+            if session is not None:
+                for task in list(session.speech_tasks):
+                    task.cancel()
+                self.log.info(f"Stream closed: {session.frames} frames, {session.bytes / 2 / session.samplerate:.1f}s of audio, {session.utterances} utterances")
+
+    async def finish_utterance(self, session: StreamSession, text: str) -> None:
+        session.last_partial = ""
+        if len(text) == 0:
+            return
+        latency = time.time() - session.last_frame
+        session.utterances += 1
+        self.utterances += 1
+        self.latencies.append(latency)
+        await session.websocket.send(json.dumps({"type": "final", "text": text, "latency": latency}))
+        if self.speak != "none":
+            # speak without holding up recognition of the next utterance
+            task = asyncio.ensure_future(self.speak_utterance(session, text, session.last_frame))
+            session.speech_tasks.add(task)
+            task.add_done_callback(session.speech_tasks.discard)
+
+    def synthesize(self, text: str, captured: float):
+        with self.synth_lock:
+            filename = f"stream{self.filenum % 100}.wav" # keep a small rolling set of files
+            self.filenum += 1
+            if self.deadline_synth is not None:
+                return self.deadline_synth.synthesize(text, filename, self.model_id, captured + self.deadline,
+                    clean_text=False, rewrite_words=None)
+            wav, sr, outfile = self.voice_synth.synthesize(text, filename, self.model_id,
+                clean_text=False, rewrite_words=None)
+            return wav, sr, outfile, "full"
+
+    def play_local(self, wav: np.ndarray, sr: int) -> None:
+        import sounddevice as sd
+        import resources
+        with resources.audio_affinity():
+            sd.play(wav, sr)
+
+    async def speak_utterance(self, session: StreamSession, text: str, captured: float) -> None:
+        loop = asyncio.get_running_loop()
+        async with session.speech_lock:
+            try:
+                wav, sr, outfile, tier = await loop.run_in_executor(self.pool, self.synthesize, text, captured)
+            except Exception as e:
+                self.log.exception(f"Synthesis of '{text}' failed")
+                await session.websocket.send(json.dumps({"type": "error", "message": f"synthesis failed: {e}"}))
+                return
+            if self.speak == "local":
+                await loop.run_in_executor(self.pool, self.play_local, wav, sr)
+                return
+            pcm = (np.clip(np.asarray(wav, dtype=np.float32), -1.0, 1.0) * 32767).astype("<i2")
+            await session.websocket.send(json.dumps({"type": "audio", "text": text, "sampleRate": sr,
+                "samples": len(pcm), "tier": tier, "latency": time.time() - captured}))
+            await session.websocket.send(pcm.tobytes())
+
+    def stats(self) -> Dict:
+        latency = np.array(self.latencies) if len(self.latencies) > 0 else np.zeros(1)
+        return {
+            "sessions": self.sessions,
+            "active": self.active,
+            "utterances": self.utterances,
+            "final_latency_p50": float(np.percentile(latency, 50)),
+            "final_latency_p95": float(np.percentile(latency, 95)),
+        }
+
+    async def main(self, host: str, port: int, ssl_context=None) -> None:
+        print(f"Streaming ingest listening on {'wss' if ssl_context is not None else 'ws'}://{host}:{port}, speak: {self.speak}")
+        async with websockets.serve(self.handler, host, port, max_size=2 ** 20, ssl=ssl_context):
+            await asyncio.Future()  # run forever
+
+
+if __name__ == '__main__':
+    import argparse
+    from pathlib import Path
+    from vosk import SetLogLevel
+
+    import voskmodels
+    import resources
+    import profiling
+    import deadline
+    import modelspec
+
+    parser = argparse.ArgumentParser(description="Recognize (and speak) microphone audio streamed from the browser.")
+    parser.add_argument("--host", type=str, default="localhost", help="Websockets Server Host (default is localhost)")
+    parser.add_argument("-p", "--port", type=int, default=8766, help="Websockets Server port (default is 8766)")
+    parser.add_argument("--certfile", type=Path, default=None, help="TLS certificate, pages served over https can only connect to wss://")
+    parser.add_argument("--keyfile", type=Path, default=None, help="TLS private key for --certfile")
+    parser.add_argument("--speak", type=str, default="remote", choices=["remote", "local", "none"], help="Where to speak recognized utterances")
+    parser.add_argument("--model-path", type=Path, default=None, help="TTS model directory (without it or --models only transcripts are sent)")
+    parser.add_argument("--models", type=Path, default=None, help="Model manifest (see modelspec.py) instead of --model-path")
+    parser.add_argument("--voice", type=str, default=None, help="Model of the manifest to speak with")
+    parser.add_argument("--output-path", type=Path, default="tmp/wav", help="Audio write / temp file output directory.")
+    parser.add_argument("--use-cuda", type=bool, help="Run model on CUDA.", default=False)
+    parser.add_argument("--workers", type=int, default=4, help="Threads for recognition and synthesis")
+    voskmodels.add_vosk_args(parser)
+    resources.add_resource_args(parser)
+    profiling.add_profile_args(parser)
+    deadline.add_deadline_args(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+    resources.apply_from_args(args, workers=args.workers, logger=logging.getLogger("Resources"))
+    profiler = profiling.start_from_args(args, logging.getLogger("Profiler"))
+
+    SetLogLevel(-1)
+    vosk_model = voskmodels.load_from_args(args, logging.getLogger("Vosk"))
+
+    voice_synth = None
+    deadline_synth = None
+    model_id = None
+    if args.model_path is not None or args.models is not None:
+        from voicesynth import VoiceSynth
+        model_specs = modelspec.specs_from_args(args, name="vits")
+        model_id = modelspec.default_model(model_specs, args.voice)
+        voice_synth = VoiceSynth(args.output_path.resolve(), args.use_cuda, logging.getLogger("VoiceSynthesizer"))
+        voice_synth.load_specs(model_specs)
+        voice_synth.profiler = profiler
+        deadline_synth = deadline.from_args(args, voice_synth, logging.getLogger("Deadline"))
+
+    server = StreamIngestServer(vosk_model, voice_synth, model_id=model_id, speak=args.speak,
+        deadline_synth=deadline_synth, deadline=args.deadline, max_workers=args.workers)
+    ssl_context = None
+    if args.certfile is not None:
+        import ssl
+        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ssl_context.load_cert_chain(args.certfile, args.keyfile)
+    try:
+        asyncio.run(server.main(args.host, args.port, ssl_context))
+    except KeyboardInterrupt:
+        print("Received CTRL+C ... exit server.")
+    finally:
+        print(json.dumps(server.stats(), indent=2))
+        if profiler is not None:
+            profiler.stop()
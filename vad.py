@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Voice activity detection gate in front of Kaldi recognition.
+
+Every block is split into short frames and classified in one vectorized pass
+(frame energy against an adaptive noise floor, plus zero-crossing rate to
+catch quiet fricatives). Silent blocks are never sent to the recognizer. When
+speech starts, a short pre-roll of the preceding silence is sent first so word
+onsets are not clipped, and after enough trailing silence the gate decides the
+utterance has ended, so the recognizer can be finalized right away instead of
+waiting for Kaldi's own endpointing.
+"""
+from collections import deque
+from typing import List, Tuple, Union, Dict
+
+import numpy as np
+
+AUDIO = "audio"
+END = "end"
+
+
+class VoiceActivityGate:
+    """
+        samplerate      Sample rate of the 16 bit mono PCM blocks
+        frame_ms        Analysis frame length
+        threshold_db    Frames this much louder than the noise floor are speech
+        preroll_ms      Silence sent ahead of the first speech block
+        hangover_ms     Trailing silence after which an utterance is ended
+        min_speech_ms   Speech shorter than this (clicks, bumps) does not open the gate
+        min_floor_db    Lowest noise floor, so digital silence does not make every sound speech
+    """
+    def __init__(self, samplerate: int, frame_ms: float = 20.0, threshold_db: float = 12.0,
+        preroll_ms: float = 300.0, hangover_ms: float = 600.0, min_speech_ms: float = 60.0,
+        zcr_range: Tuple[float, float] = (0.25, 0.6), min_floor_db: float = -65.0) -> None:
+        self.samplerate = samplerate
+        self.frame_len = max(1, int(samplerate * frame_ms / 1000))
+        self.threshold_db = threshold_db
+        self.preroll_bytes = int(samplerate * preroll_ms / 1000) * 2
+        self.hangover_frames = int(np.ceil(hangover_ms / frame_ms))
+        self.min_speech_frames = max(1, int(np.ceil(min_speech_ms / frame_ms)))
+        self.zcr_range = zcr_range
+        self.min_floor_db = min_floor_db
+
+        self.noise_floor_db = -60.0
+        self.in_speech = False
+        self.speech_run = 0 # consecutive speech frames
+        self.silence_run = 0 # consecutive silent frames while in speech
+        self.preroll = deque()
+        self.preroll_size = 0
+
+        self.blocks_total = 0
+        self.blocks_passed = 0
+        self.utterances = 0
+
+    def classify(self, pcm: np.ndarray) -> np.ndarray:
+        """Per frame speech / non-speech decision for a block of int16 samples."""
+        num_frames = len(pcm) // self.frame_len
+        if num_frames == 0:
+            return np.zeros(0, dtype=bool)
+        frames = pcm[:num_frames * self.frame_len].reshape(num_frames, self.frame_len).astype(np.float32) / 32768.0
+        energy_db = 10.0 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+        signs = np.signbit(frames)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / self.frame_len
+
+        loud = energy_db > self.noise_floor_db + self.threshold_db
+        fricative = (energy_db > self.noise_floor_db + self.threshold_db / 2) \
+            & (zcr > self.zcr_range[0]) & (zcr < self.zcr_range[1])
+        speech = loud | fricative
+
+        # Track the noise floor with minimum statistics: fall fast, rise slowly.
+        level = float(np.percentile(energy_db, 10))
+        if level < self.noise_floor_db:
+            self.noise_floor_db = max(level, self.min_floor_db)
+        else:
+            self.noise_floor_db += 0.05 * (level - self.noise_floor_db)
+        return speech
+
+    def process(self, data) -> List[Tuple[str, Union[bytes, memoryview, None]]]:
+        """
+        Run a block through the gate. Returns a list of actions for the recognizer:
+            (AUDIO, data)   feed this audio to the recognizer
+            (END, None)     the utterance ended, finalize the recognizer
+        An empty list means the block was silence and can be skipped.
+        """
+        self.blocks_total += 1
+        speech = self.classify(np.frombuffer(data, dtype=np.int16))
+        actions = []
+
+        was_in_speech = self.in_speech
+        ended = False
+        for is_speech in speech:
+            if self.in_speech:
+                if is_speech:
+                    self.silence_run = 0
+                else:
+                    self.silence_run += 1
+                    if self.silence_run >= self.hangover_frames:
+                        self.in_speech = False
+                        self.speech_run = 0
+                        ended = True
+            else:
+                self.speech_run = self.speech_run + 1 if is_speech else 0
+                if self.speech_run >= self.min_speech_frames:
+                    self.in_speech = True
+                    self.silence_run = 0
+
+        if was_in_speech or self.in_speech or ended:
+            if not was_in_speech:
+                # speech started in this block: send the pre-roll first
+                for preroll_block in self.preroll:
+                    actions.append((AUDIO, preroll_block))
+                self.preroll.clear()
+                self.preroll_size = 0
+            actions.append((AUDIO, data))
+            self.blocks_passed += 1
+            if ended and not self.in_speech:
+                actions.append((END, None))
+                self.utterances += 1
+        else:
+            # keep a copy, the caller's buffer (e.g. a ring buffer slot) gets reused
+            self.preroll.append(bytes(data))
+            self.preroll_size += len(data)
+            while self.preroll_size - len(self.preroll[0]) >= self.preroll_bytes and len(self.preroll) > 1:
+                self.preroll_size -= len(self.preroll.popleft())
+        return actions
+
+    def stats(self) -> Dict:
+        return {
+            "blocks_total": self.blocks_total,
+            "blocks_passed": self.blocks_passed,
+            "blocks_skipped": self.blocks_total - self.blocks_passed,
+            "utterances": self.utterances,
+            "noise_floor_db": self.noise_floor_db,
+        }
@@ -1,19 +1,77 @@
 #!/usr/bin/env python3
 import os, sys, time
+import gc
 import random
 from pathlib import Path
 import logging
 import librosa
 import soundfile
 from logging import Logger
-from typing import List, Union, Any, Dict
+from typing import List, Union, Any, Dict, Iterator
 import numpy as np
 import torch
-from TTS.tts.utils.synthesis import synthesis, trim_silence
+from TTS.tts.utils.synthesis import synthesis, transfer_voice, trim_silence, embedding_to_torch, id_to_torch
 from TTS.utils.synthesizer import Synthesizer
+from TTS.vocoder.utils.generic_utils import interpolate_vocoder_input
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+import splicecache
+import audiobank
+import audioio
+import referencestore
+import profiling
+import modelspec
+import resources
+import windowed
 
 torch.set_grad_enabled(False) # we're only doing inference
 
+
+def normalize_affine(ap) -> Union[tuple, None]:
+    """
+    AudioProcessor.normalize() on dB spectrograms is x * scale + offset, clipped to (low, high)
+    when clip_norm is set. Returns (scale, offset, low, high), or None if the processor
+    normalizes with mean/var stats (mel_scaler), which is not a single affine transform.
+    """
+    if not ap.signal_norm:
+        return 1.0, 0.0, -np.inf, np.inf
+    if hasattr(ap, "mel_scaler"):
+        return None
+    span = -ap.min_level_db
+    if ap.symmetric_norm:
+        scale = 2 * ap.max_norm / span
+        offset = scale * (-ap.ref_level_db - ap.min_level_db) - ap.max_norm
+        low, high = -ap.max_norm, ap.max_norm
+    else:
+        scale = ap.max_norm / span
+        offset = scale * (-ap.ref_level_db - ap.min_level_db)
+        low, high = 0.0, ap.max_norm
+    if not ap.clip_norm:
+        low, high = -np.inf, np.inf
+    return scale, offset, low, high
+
+
+def mel_bridge(tts_ap, vocoder_ap) -> Union[tuple, None]:
+    """
+    Fuse vocoder_ap.normalize(tts_ap.denormalize(x)) into one affine transform plus a clip.
+    denormalize() is the inverse of normalize() with its input clipped to the same range,
+    so the round trip is clip(a * clip(x, tts range) + b, vocoder range) = clip(a * x + b, low, high).
+    Returns (a, b, low, high), or None when either side uses mean/var stats.
+    """
+    tts_norm = normalize_affine(tts_ap)
+    vocoder_norm = normalize_affine(vocoder_ap)
+    if tts_norm is None or vocoder_norm is None:
+        return None
+    tts_scale, tts_offset, tts_low, tts_high = tts_norm
+    vocoder_scale, vocoder_offset, vocoder_low, vocoder_high = vocoder_norm
+    a = vocoder_scale / tts_scale
+    b = vocoder_offset - a * tts_offset
+    low = max(vocoder_low, a * tts_low + b)
+    high = min(vocoder_high, a * tts_high + b)
+    return a, b, low, high
+
 class VoiceSynth:
 
     def __init__(self, audio_write_path: str, use_cuda: bool, logger: Logger) -> None:
@@ -21,7 +79,14 @@ class VoiceSynth:
         self.use_cuda = use_cuda
         self.log = logger
         self.tts = dict() # synthesizers / loaded models
-
+        self.model_specs = dict() # modelspec.ModelSpec of every known model, loaded or not
+        self.load_lock = threading.Lock()
+        self.reload_lock = threading.Lock() # one reload_model() at a time
+        self.clause_cache = None # see enable_splicing()
+        self.audio_bank = None # see load_bank()
+        self.pipeline_vocoder = True # overlap acoustic model and vocoder on multi-sentence input
+        self.references = referencestore.ReferenceStore() # voice conversion reference features, see set_reference_cache()
+        self.profiler = None # a profiling.Profiler counts the allocations of every pr_synthesize call
 
         # Create audio write dir if does not exist...
         if self.audio_write_path.suffix != '':
@@ -36,30 +101,13 @@ class VoiceSynth:
         """
         Load a single model given a model checkpoint path and config file path.
         """
-        self.log.info(f"LOADING MODEL: {model_path}\nWITH CONFIG: {model_config_path}")
-
-        # Load model
-        self.tts[name] = dict()
-        print(f"Loading model {name}: {model_path}\nWith Config: {model_config_path}\n")
-        self.tts[name]["tts"] = Synthesizer(
-            str(model_path),
-            str(model_config_path),
-            use_cuda=self.use_cuda,
-        )
-        print(f"Done loading model: {name}")
-        self.tts[name]["model"] = self.tts[name]['tts'].tts_model
-        #self.tts[modelname]["ap"] = self.tts[modelname]["tts"].ap # TTS 0.5.0
-        self.tts[name]["ap"] = self.tts[name]["tts"].tts_model.ap # TTS > 0.6.0
-        self.tts[name]["config"] = self.tts[name]['tts'].tts_config
-        self.tts[name]["sr"] = self.tts[name]["ap"].sample_rate
-        self.tts[name]["arch"] = self.tts[name]["config"].model
-
-
+        self.load_specs([modelspec.ModelSpec(name, str(model_path), str(model_config_path))])
 
-    def load_models(self, model_specs: dict) -> None:
+    def load_models(self, model_specs: dict, max_workers: int = None) -> None:
         """
         Instantiate models from a model specs dict.
             model_specs     A dict of model specs, see example code below for format
+                            (modelspec.ModelSpec / load_specs() is the named-field form of the same)
         """
         # PARSE COQUI TTS MODELS
 
@@ -70,54 +118,149 @@ class VoiceSynth:
             tts_model_specs = dict()
             tts_model_root = None
 
-        for modelname, spec in tts_model_specs.items():
-            model_path = os.path.join(tts_model_root, spec[0])
-            model_config_path = os.path.join(tts_model_root, spec[1])
-            speakers_file_path = spec[2]
-            language_ids_file_path = spec[3]
-            vocoder_model_path = spec[4]
-            vocoder_config_path = spec[5]
-            encoder_model_path = spec[6]
-            encoder_config_path = spec[7]
-
-            self.log.info(f"LOADING MODEL at {spec}")
-
-            if speakers_file_path is not None:
-                speakers_file_path = os.path.join(tts_model_root, speakers_file_path)
-            if language_ids_file_path is not None:
-                language_ids_file_path = os.path.join(tts_model_root, language_ids_file_path)
-            if vocoder_model_path is not None:
-                vocoder_model_path = os.path.join(tts_model_root, vocoder_model_path)
-            if vocoder_config_path is not None:
-                vocoder_config_path = os.path.join(tts_model_root, vocoder_config_path)
-            if encoder_model_path is not None:
-                encoder_model_path = os.path.join(tts_model_root, encoder_model_path)
-            if encoder_config_path is not None:
-                encoder_config_path = os.path.join(tts_model_root, encoder_config_path)
-
-            # Load model
-            self.tts[modelname] = dict()
-            print(f"Loading model: {model_path}\nWith Config: {model_config_path}\n")
-            self.tts[modelname]["tts"] = Synthesizer(
-                str(model_path),
-                str(model_config_path),
-                use_cuda=self.use_cuda,
-            )
-            print(f"Done loading model: {modelname}")
-            self.tts[modelname]["model"] = self.tts[modelname]['tts'].tts_model
-            #self.tts[modelname]["ap"] = self.tts[modelname]["tts"].ap # TTS 0.5.0
-            self.tts[modelname]["ap"] = self.tts[modelname]["tts"].tts_model.ap # TTS > 0.6.0
-            self.tts[modelname]["config"] = self.tts[modelname]['tts'].tts_config
-            self.tts[modelname]["sr"] = self.tts[modelname]["ap"].sample_rate
-            self.tts[modelname]["arch"] = self.tts[modelname]["config"].model
+        specs = [modelspec.ModelSpec.from_legacy(modelname, spec, tts_model_root) for modelname, spec in tts_model_specs.items()]
+        self.load_specs(specs, max_workers=max_workers)
+
+    def load_specs(self, specs: List[modelspec.ModelSpec], max_workers: int = None, verify: bool = True) -> None:
+        """
+        Validate and load models (see modelspec.py), preloaded models concurrently on a thread pool,
+        so startup takes about as long as the slowest model. The others are loaded on first use.
+            max_workers     Models loaded at the same time (default: all)
+            verify          Check the specs' sha256 checksums before loading
+        """
+        modelspec.validate(specs)
+        for spec in specs:
+            self.model_specs[spec.name] = spec
+        preload = [spec for spec in specs if spec.preload]
+        if len(preload) == 0:
+            return
 
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=max_workers or len(preload), thread_name_prefix="modelload") as pool:
+            futures = [pool.submit(self.load_spec, spec, verify) for spec in preload]
+            for future in futures:
+                future.result() # raise the first loading error
+        self.log.info(f"Loaded {len(preload)} models in {time.time() - start_time:.1f}s")
 
-    def synthesize(self, text: str, filename: str, model_id: str,
-        speaker_name: str = None, language_name: str = None,
-        clean_text: bool = True, rewrite_words: Dict[str, str] = None):
+    def load_spec(self, spec: modelspec.ModelSpec, verify: bool = True) -> None:
         """
-        Synthesize an utterance & save to tmp directory
-        Uses pr_synthesize as a helper function.
+        Load one model. self.tts[spec.name] is only set once the model is fully loaded.
+        """
+        self.tts[spec.name] = self.build_model(spec, verify)
+
+    def build_model(self, spec: modelspec.ModelSpec, verify: bool = True) -> Dict[str, Any]:
+        """
+        Load the model of a spec, returns its self.tts entry.
+        """
+        start_time = time.time()
+        self.log.info(f"LOADING MODEL {spec.name} at {spec.paths()}")
+        if verify:
+            spec.verify_checksums()
+
+        entry = dict()
+        entry["tts"] = Synthesizer(
+            str(spec.model_path),
+            str(spec.config_path),
+            tts_speakers_file=spec.speakers_file or "",
+            tts_languages_file=spec.language_ids_file or "",
+            vocoder_checkpoint=spec.vocoder_path or "",
+            vocoder_config=spec.vocoder_config_path or "",
+            encoder_checkpoint=spec.encoder_path or "",
+            encoder_config=spec.encoder_config_path or "",
+            use_cuda=self.use_cuda,
+        )
+        entry["model"] = entry["tts"].tts_model
+        #entry["ap"] = entry["tts"].ap # TTS 0.5.0
+        entry["ap"] = entry["tts"].tts_model.ap # TTS > 0.6.0
+        entry["config"] = entry["tts"].tts_config
+        entry["sr"] = entry["ap"].sample_rate
+        entry["arch"] = entry["config"].model
+        entry["generation"] = spec.fingerprint() # keys the clause and reference caches, changes on reload
+        self.log.info(f"Done loading model {spec.name} in {time.time() - start_time:.1f}s")
+        return entry
+
+    def reload_model(self, spec: modelspec.ModelSpec, warmup_text: str = "Warming up the new voice.",
+        speaker_name: str = None, language_name: str = None) -> None:
+        """
+        Replace a loaded model with a new checkpoint without downtime. The new model is loaded and
+        warmed up next to the old one, then swapped into self.tts in one assignment: requests that
+        already started finish on the old model, new ones get the new model. The old model's memory
+        is released once the last request using it is done. Clauses (splicing) and reference features
+        of the model are dropped, the audio bank is kept (it is pre-rendered on purpose).
+            spec            The new checkpoint, spec.name is the model id to replace
+            speaker_name    Speaker for the warm-up (default: the model's first speaker, if any)
+        """
+        modelspec.validate([spec])
+        with self.reload_lock:
+            start_time = time.time()
+            entry = self.build_model(spec)
+            synth = entry["tts"]
+            if speaker_name is None:
+                speaker_name = self.first_speaker(synth)
+            if language_name is None and getattr(synth.tts_model, "language_manager", None) is not None:
+                language_name = next(iter(synth.tts_model.language_manager.ids), None)
+            self.pr_synthesize(synth, warmup_text, speaker_name, language_name, None, None)
+
+            old = self.tts.get(spec.name)
+            self.tts[spec.name] = entry
+            self.model_specs[spec.name] = spec
+            if self.clause_cache is not None:
+                self.clause_cache.forget_model(spec.name)
+            self.references.forget_model(spec.name)
+            self.log.info(f"Swapped in model {spec.name} from {spec.model_path} in {time.time() - start_time:.1f}s")
+
+            del old, entry, synth
+            gc.collect()
+            if self.use_cuda:
+                torch.cuda.empty_cache()
+
+    def first_speaker(self, synth: Synthesizer) -> Union[str, None]:
+        """
+        A speaker name the model can be conditioned on: the first d-vector speaker of models
+        with a d-vector file, the first speaker id of the others, None if there is none.
+        """
+        speaker_manager = getattr(synth.tts_model, "speaker_manager", None)
+        if speaker_manager is None:
+            return None
+        if getattr(synth.tts_config, "use_d_vector_file", False):
+            names = getattr(speaker_manager, "speaker_names", None) or getattr(speaker_manager, "embeddings_by_names", None)
+        else:
+            names = getattr(speaker_manager, "ids", None)
+        return next(iter(names), None) if names else None
+
+    def require_model(self, model_id: str) -> None:
+        """Load a model that was not preloaded, on first use."""
+        if model_id in self.tts:
+            return
+        with self.load_lock:
+            if model_id not in self.tts:
+                if model_id not in self.model_specs:
+                    raise ValueError(f"Unknown model '{model_id}', loaded: {list(self.tts)}")
+                self.load_spec(self.model_specs[model_id])
+
+    def enable_splicing(self, max_bytes: int = 256 * 1024 * 1024) -> None:
+        """
+        Keep rendered clause audio (up to max_bytes) for synthesize(..., splice=True).
+        """
+        self.clause_cache = splicecache.ClauseCache(max_bytes)
+
+    def load_bank(self, path: Union[str, Path]) -> None:
+        """
+        Memory-map a pre-rendered audio bank (see audiobank.py).
+        synthesize() plays lines found in the bank without running the model.
+        """
+        self.audio_bank = audiobank.AudioBank(path)
+        self.log.info(f"Loaded audio bank {path}: {len(self.audio_bank)} lines")
+
+    def set_reference_cache(self, cache_dir: Union[str, Path] = None, max_entries: int = 64) -> None:
+        """
+        Persist voice conversion reference features (embeddings, spectrograms) in cache_dir.
+        """
+        self.references = referencestore.ReferenceStore(cache_dir, max_entries)
+
+    def prepare_text(self, text: str, clean_text: bool = True, rewrite_words: Dict[str, str] = None) -> str:
+        """
+        Text preprocessing applied before synthesis.
         """
         if clean_text:
             text = cleanup_text_for_tts(text)
@@ -125,20 +268,426 @@ class VoiceSynth:
         if rewrite_words is not None:
             for key in rewrite_words:
                 text = text.replace(key, rewrite_words[key])
+        return text
 
-        self.log.info(f"Synthesizing Text >{text}<")
-
-        wav = self.pr_synthesize(self.tts[model_id]["tts"], text, speaker_name, language_name, None, None)
+    def synthesize(self, text: str, filename: str, model_id: str,
+        speaker_name: str = None, language_name: str = None,
+        clean_text: bool = True, rewrite_words: Dict[str, str] = None,
+        splice: bool = False, griffin_lim: bool = False):
+        """
+        Synthesize an utterance & save to tmp directory
+        Uses pr_synthesize as a helper function.
+            splice      Render clause by clause, reusing previously rendered clauses
+                        (needs enable_splicing())
+            griffin_lim Use Griffin-Lim instead of the model's vocoder (faster, lower quality)
+        """
+        text = self.prepare_text(text, clean_text, rewrite_words)
+        self.require_model(model_id)
+        model = self.tts[model_id] # requests finish on this model, even if it is reloaded meanwhile
+
+        sr = model["sr"]
+        banked = None
+        if self.audio_bank is not None:
+            banked = self.audio_bank.lookup(text, (model_id, speaker_name, language_name))
+
+        if banked is not None:
+            self.log.info(f"Playing Text from audio bank >{text}<")
+            wav, sr = banked
+        elif splice and self.clause_cache is not None and not griffin_lim:
+            self.log.info(f"Synthesizing Text >{text}<")
+            with resources.synthesis_affinity():
+                wav = self.pr_synthesize_spliced(model_id, text, speaker_name, language_name)
+        else:
+            self.log.info(f"Synthesizing Text >{text}<")
+            with resources.synthesis_affinity():
+                wav = self.pr_synthesize(model["tts"], text, speaker_name, language_name, None, None,
+                    griffin_lim=griffin_lim)
 
         # Save temp wav file.
         wav = np.array(wav)
         savepath = os.path.abspath(os.path.join(self.audio_write_path, filename))
-        sr = self.tts[model_id]["sr"]
-        self.tts[model_id]["ap"].save_wav(wav, savepath, sr)
+        model["ap"].save_wav(wav, savepath, sr)
+        self.log.debug(f"Wrote file: {savepath}")
+        return wav, sr, savepath
+
+
+    def convert(self, reference_wav: Union[str, Path], filename: str, model_id: str,
+        speaker_name: str = None, reference_speaker_name: str = None, stream: bool = False):
+        """
+        Voice conversion: say what is said in reference_wav with the voice of speaker_name & save to tmp directory.
+            reference_speaker_name  Speaker of the reference recording, if the model knows it
+                                    (otherwise its embedding is computed from the recording, once)
+            stream                  Convert the recording in chunks (for long recordings)
+        Returns (wav, sr, savepath) like synthesize().
+        """
+        self.log.info(f"Converting >{reference_wav}< to voice {model_id}:{speaker_name}")
+        self.require_model(model_id)
+        model = self.tts[model_id]
+        if stream:
+            wav = np.concatenate(list(self.convert_stream(reference_wav, model_id, speaker_name, reference_speaker_name)))
+        else:
+            with resources.synthesis_affinity():
+                wav = self.pr_synthesize(model["tts"], None, speaker_name, None, None, None,
+                    reference_wav=str(reference_wav), reference_speaker_name=reference_speaker_name)
+
+        wav = np.array(wav)
+        savepath = os.path.abspath(os.path.join(self.audio_write_path, filename))
+        sr = model["sr"]
+        model["ap"].save_wav(wav, savepath, sr)
         self.log.debug(f"Wrote file: {savepath}")
         return wav, sr, savepath
 
+    def convert_stream(self, reference_wav: Union[str, Path], model_id: str, speaker_name: str = None,
+        reference_speaker_name: str = None, chunk_seconds: float = 10.0, context_seconds: float = 0.5,
+        fade_ms: float = 10.0) -> Iterator[np.ndarray]:
+        """
+        Convert a long reference recording chunk by chunk, without loading it (or its
+        spectrogram) at once. Every chunk is converted with the end of the previous
+        chunk as context, the context part of the output is dropped and the chunks are
+        crossfaded over fade_ms. Yields float32 waveform chunks.
+        """
+        synth = self.tts[model_id]["tts"]
+        sr = self.tts[model_id]["sr"]
+        if not hasattr(synth.tts_model, "voice_conversion"):
+            raise ValueError(f"Model {model_id} ({self.tts[model_id]['arch']}) does not support chunked voice conversion")
+
+        speaker_id, speaker_embedding = self.speaker_condition(synth, speaker_name, None)
+        reference_speaker_id, reference_embedding = self.reference_condition(synth, reference_wav, reference_speaker_name,
+            spectrogram=False)
+
+        chunk_len = int(chunk_seconds * sr)
+        context_len = int(context_seconds * sr)
+        fade = int(fade_ms * sr / 1000)
+
+        context = np.zeros(0, dtype=np.float32)
+        held = None # end of the previous output, crossfaded with the start of the next one
+
+        def emit(piece: np.ndarray, last: bool):
+            nonlocal context, held
+            source = np.concatenate([context, piece])
+            with resources.synthesis_affinity():
+                out = self.convert_spec(synth, self.reference_spec(synth, source), speaker_id, speaker_embedding,
+                    reference_speaker_id, reference_embedding)
+            skip = int(round(len(context) * len(out) / len(source)))
+            context = source[-context_len:] if context_len > 0 else context
+
+            if held is not None:
+                if skip >= len(held):
+                    ramp = np.linspace(0.0, 1.0, len(held), dtype=np.float32)
+                    yield held * (1.0 - ramp) + out[skip - len(held):skip] * ramp
+                else:
+                    yield held
+            if last or len(out) - skip <= fade:
+                held = None
+                yield out[skip:]
+            else:
+                held = out[len(out) - fade:]
+                yield out[skip:len(out) - fade]
+
+        pending = np.zeros(0, dtype=np.float32)
+        reader = audioio.AudioReader(reference_wav, samplerate=sr, mono=True)
+        for block in reader.blocks():
+            pending = np.concatenate([pending, block[:, 0]])
+            while len(pending) >= chunk_len + chunk_len // 4: # never leave a very short last chunk
+                yield from emit(pending[:chunk_len], last=False)
+                pending = pending[chunk_len:]
+        if len(pending) > 0:
+            yield from emit(pending, last=True)
+        elif held is not None:
+            yield held
+
+    def reference_spec(self, synth: Synthesizer, wav: np.ndarray) -> np.ndarray:
+        """Linear spectrogram [1, C, T] of a reference waveform, as VITS voice conversion takes it."""
+        from TTS.tts.models.vits import wav_to_spec
+        audio = synth.tts_config.audio
+        y = torch.from_numpy(np.ascontiguousarray(wav, dtype=np.float32)).unsqueeze(0)
+        spec = wav_to_spec(y, audio.fft_size, audio.hop_length, audio.win_length, center=False)
+        return spec.cpu().numpy()
+
+    def reference_features(self, synth: Synthesizer, reference_wav: Union[str, Path], spectrogram: bool = True) -> Dict[str, np.ndarray]:
+        """
+        Cached features of a reference recording: "spec" (if spectrogram is set and the
+        model converts from spectrograms) and "embedding" (if the model has a speaker encoder).
+        """
+        model_key, generation = next(((name, m["generation"]) for name, m in self.tts.items() if m["tts"] is synth),
+            (f"model{id(synth)}", ""))
+        speaker_manager = getattr(synth.tts_model, "speaker_manager", None)
+        with_spec = spectrogram and hasattr(synth.tts_model, "voice_conversion")
+
+        def compute(path: Path) -> Dict[str, np.ndarray]:
+            features = {"embedding": None, "spec": None}
+            if speaker_manager is not None and getattr(speaker_manager, "encoder", None) is not None:
+                features["embedding"] = np.asarray(speaker_manager.compute_embedding_from_clip(str(path)))
+            if with_spec:
+                wav, _ = audioio.load(path, samplerate=synth.tts_model.ap.sample_rate)
+                features["spec"] = self.reference_spec(synth, wav)
+            return features
+
+        kind = "full" if with_spec else "embedding"
+        return self.references.get(model_key, reference_wav, compute, kind=kind, generation=generation)
+
+    def reference_condition(self, synth: Synthesizer, reference_wav: Union[str, Path], reference_speaker_name: str = None,
+        spectrogram: bool = True) -> tuple:
+        """
+        Speaker id or embedding of the reference recording. Returns (reference_speaker_id, reference_embedding).
+            spectrogram     Compute (and cache) the reference spectrogram along with the embedding
+        """
+        speaker_manager = getattr(synth.tts_model, "speaker_manager", None)
+        if not (synth.tts_speakers_file or hasattr(speaker_manager, "ids")):
+            return None, None
+        if reference_speaker_name and isinstance(reference_speaker_name, str):
+            if synth.tts_config.use_d_vector_file:
+                # get the speaker embedding from the saved d_vectors.
+                embedding = speaker_manager.get_embeddings_by_name(reference_speaker_name)[0]
+                return None, np.array(embedding)[None, :]  # [1 x embedding_dim]
+            # get speaker idx from the speaker name
+            return speaker_manager.ids[reference_speaker_name], None
+        features = self.reference_features(synth, reference_wav, spectrogram=spectrogram)
+        return None, features.get("embedding")
+
+    def convert_spec(self, synth: Synthesizer, spec: np.ndarray, speaker_id, speaker_embedding,
+        reference_speaker_id, reference_embedding) -> np.ndarray:
+        """Run VITS voice conversion on a reference spectrogram [1, C, T]."""
+        device_type = "cuda" if synth.use_cuda else "cpu"
+        y = torch.from_numpy(spec).to(device_type)
+        y_lengths = torch.tensor([y.size(-1)]).to(device_type)
+        if reference_speaker_id is not None:
+            speaker_cond_src = id_to_torch(reference_speaker_id, cuda=synth.use_cuda)
+        else:
+            speaker_cond_src = embedding_to_torch(reference_embedding, cuda=synth.use_cuda)
+        if speaker_id is not None:
+            speaker_cond_tgt = id_to_torch(speaker_id, cuda=synth.use_cuda)
+        else:
+            speaker_cond_tgt = embedding_to_torch(speaker_embedding, cuda=synth.use_cuda)
+        wav, _, _ = synth.tts_model.voice_conversion(y, y_lengths, speaker_cond_src, speaker_cond_tgt)
+        return wav.detach().cpu().numpy().squeeze().astype(np.float32)
 
+    def voice_conversion(self, synth: Synthesizer, reference_wav: Union[str, Path], speaker_id, speaker_embedding,
+        reference_speaker_name: str = None, bridge: tuple = None) -> np.ndarray:
+        """
+        Convert a reference recording to the target speaker. Models that convert from
+        spectrograms (VITS) use the cached reference features, other models go through
+        TTS's transfer_voice (the reference embedding is still cached).
+        """
+        reference_speaker_id, reference_embedding = self.reference_condition(synth, reference_wav, reference_speaker_name)
+
+        if hasattr(synth.tts_model, "voice_conversion"):
+            features = self.reference_features(synth, reference_wav)
+            return self.convert_spec(synth, features["spec"], speaker_id, speaker_embedding,
+                reference_speaker_id, reference_embedding)
+
+        use_gl = synth.vocoder_model is None
+        outputs = transfer_voice(
+            model=synth.tts_model,
+            CONFIG=synth.tts_config,
+            use_cuda=synth.use_cuda,
+            reference_wav=str(reference_wav),
+            speaker_id=speaker_id,
+            d_vector=speaker_embedding,
+            use_griffin_lim=use_gl,
+            reference_speaker_id=reference_speaker_id,
+            reference_d_vector=reference_embedding,
+        )
+        waveform = outputs
+        if not use_gl:
+            mel_postnet_spec = outputs[0].detach().cpu().numpy()
+            waveform = self.vocode(synth, mel_postnet_spec, bridge)
+        elif synth.use_cuda:
+            waveform = waveform.cpu()
+        return waveform.squeeze()
+
+    def synthesize_stream(self, text: str, model_id: str, speaker_name: str = None, language_name: str = None,
+        window: int = 80, context: int = None, first_window: int = 32) -> Iterator[np.ndarray]:
+        """
+        Synthesize text as a stream of float32 chunks, the first one as early as possible.
+        VITS sentences are decoded in overlapping windows of the latent sequence (see windowed.py),
+        so the first audio of a sentence does not wait for the whole sentence to be decoded.
+        Other models yield one chunk per sentence.
+            context     Latent frames decoded around each window (default: the decoder's receptive field)
+        """
+        self.require_model(model_id)
+        model = self.tts[model_id]
+        synth = model["tts"]
+        gap = np.zeros(10000, dtype=np.float32) # same pause between sentences as pr_synthesize()
+        if not hasattr(synth.tts_model, "waveform_decoder"):
+            for sen in synth.split_into_sentences(text):
+                with resources.synthesis_affinity():
+                    wav = self.pr_synthesize(synth, sen, speaker_name, language_name, None, None)
+                yield np.asarray(wav, dtype=np.float32)
+            return
+
+        speaker_id, speaker_embedding = self.speaker_condition(synth, speaker_name, None)
+        speaker_id = id_to_torch(speaker_id, cuda=synth.use_cuda) if speaker_id is not None else None
+        d_vector = embedding_to_torch(speaker_embedding, cuda=synth.use_cuda) if speaker_embedding is not None else None
+        language_id = None
+        if language_name and getattr(synth.tts_model, "language_manager", None) is not None:
+            language_id = id_to_torch(synth.tts_model.language_manager.ids[language_name], cuda=synth.use_cuda)
+
+        for idx, sen in enumerate(synth.split_into_sentences(text)):
+            if idx > 0:
+                yield gap
+            with resources.synthesis_affinity():
+                latents = windowed.vits_latents(synth.tts_model, windowed.text_inputs(synth, sen, language_name),
+                    speaker_id, d_vector, language_id)
+            chunks = windowed.decode_windows(synth.tts_model, latents["z"], latents["g"],
+                window=window, context=context, first_window=first_window)
+            while True: # pinned while decoding a window, not while the consumer handles it
+                with resources.synthesis_affinity():
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                yield chunk
+
+    def pr_synthesize_spliced(self, model_id: str, text: str,
+        speaker_name: str = None, language_name: str = None) -> np.ndarray:
+        """
+        Synthesize text clause by clause. Clauses already rendered with the same
+        voice come from the clause cache, only the missing ones are synthesized.
+        The clauses are joined with short pauses and crossfades.
+        """
+        start_time = time.time()
+        model = self.tts[model_id]
+        voice = (model_id, model["generation"], speaker_name, language_name) # clauses of a reloaded model are not reused
+        steps = splicecache.plan(text, voice, self.clause_cache)
+        missing = sum(1 for step in steps if step[2] is None)
+        self.log.info(f"Splicing {len(steps)} clauses, {missing} to synthesize")
+
+        pieces = []
+        pauses = []
+        for clause, key, wav in steps:
+            if wav is None:
+                wav = self.pr_synthesize(model["tts"], clause, speaker_name, language_name, None, None)
+                wav = splicecache.trim_padding(np.array(wav, dtype=np.float32))
+                self.clause_cache.put(key, wav)
+            pieces.append(wav)
+            pauses.append(splicecache.pause_after(clause))
+
+        wav = splicecache.splice(pieces, pauses, model["sr"])
+        self.log.info(f" > Spliced in {time.time() - start_time}s, cache: {self.clause_cache.stats()}")
+        return wav
+
+    def vocode(self, synth: Synthesizer, mel_postnet_spec: np.ndarray, bridge: tuple = None) -> np.ndarray:
+        """
+        Run the vocoder on a tts model output spectrogram [T, C].
+            bridge      mel_bridge() of the two audio processors, if None the spectrogram is
+                        denormalized and renormalized with the audio processors
+        """
+        if bridge is not None:
+            a, b, low, high = bridge
+            vocoder_input = np.clip(mel_postnet_spec.T * a + b, low, high)
+        else:
+            # denormalize tts output based on tts audio config
+            mel_postnet_spec = synth.tts_model.ap.denormalize(mel_postnet_spec.T).T
+            # renormalize spectrogram based on vocoder config
+            vocoder_input = synth.vocoder_ap.normalize(mel_postnet_spec.T)
+        device_type = "cuda" if synth.use_cuda else "cpu"
+        # compute scale factor for possible sample rate mismatch
+        scale_factor = [
+            1,
+            synth.vocoder_config["audio"]["sample_rate"] / synth.tts_model.ap.sample_rate,
+        ]
+        if scale_factor[1] != 1:
+            self.log.info("Interpolating tts model output.")
+            vocoder_input = interpolate_vocoder_input(scale_factor, vocoder_input)
+        else:
+            vocoder_input = torch.tensor(vocoder_input).unsqueeze(0)  # pylint: disable=not-callable
+        # run vocoder model
+        # [1, T, C]
+        waveform = synth.vocoder_model.inference(vocoder_input.to(device_type))
+        if synth.use_cuda:
+            waveform = waveform.cpu()
+        return waveform.numpy().squeeze()
+
+    def trim_output(self, synth: Synthesizer, waveform: np.ndarray) -> np.ndarray:
+        try:
+            if synth.tts_config["do_trim_silence"] is True:
+                waveform = trim_silence(waveform, synth.tts_model.ap)
+        except KeyError:
+            pass
+        return waveform
+
+    def pipelined_vocode(self, synth: Synthesizer, sens: List[str], synthesis_args: Dict, bridge: tuple) -> List[float]:
+        """
+        Two stage pipeline: the tts model runs sentence k+1 (in this thread) while the
+        vocoder runs sentence k (in a worker thread). Torch releases the GIL in both.
+        """
+        mels = queue.Queue(maxsize=2) # at most one sentence waiting ahead of the vocoder
+        waveforms = []
+        failure = []
+
+        def vocoderThread():
+            try:
+                with torch.no_grad(): # grad mode is per thread, the module level set_grad_enabled(False) does not reach here
+                    while True:
+                        mel = mels.get()
+                        if mel is None:
+                            break
+                        waveforms.append(self.trim_output(synth, self.vocode(synth, mel, bridge)))
+            except Exception as e:
+                failure.append(e)
+                while mels.get() is not None: # unblock the producer
+                    pass
+
+        worker = threading.Thread(target=vocoderThread, name="vocoder", daemon=True)
+        worker.start()
+        try:
+            for sen in sens:
+                if failure:
+                    break
+                outputs = synthesis(model=synth.tts_model, text=sen, **synthesis_args)
+                mels.put(outputs["outputs"]["model_outputs"][0].detach().cpu().numpy())
+        finally:
+            mels.put(None)
+            worker.join()
+        if failure:
+            raise failure[0]
+
+        wavs = []
+        for waveform in waveforms:
+            wavs += list(waveform)
+            wavs += [0] * 10000
+        return wavs
+
+    def speaker_condition(self, synth: Synthesizer, speaker_name: str = None, speaker_wav: Union[str, List[str]] = None) -> tuple:
+        """
+        Speaker id or embedding (d_vector) to condition a multi-speaker model on.
+        Returns (speaker_id, speaker_embedding), both None for single speaker models.
+        """
+        speaker_embedding = None
+        speaker_id = None
+        if synth.tts_speakers_file or hasattr(synth.tts_model.speaker_manager, "ids"):
+            if speaker_name and isinstance(speaker_name, str):
+                if synth.tts_config.use_d_vector_file:
+                    # get the average speaker embedding from the saved d_vectors.
+                    speaker_embedding = synth.tts_model.speaker_manager.get_mean_embedding(
+                        speaker_name, num_samples=None, randomize=False
+                    )
+                    speaker_embedding = np.array(speaker_embedding)[None, :]  # [1 x embedding_dim]
+                else:
+                    # get speaker idx from the speaker name
+                    speaker_id = synth.tts_model.speaker_manager.ids[speaker_name]
+
+            elif not speaker_name and not speaker_wav:
+                self.log.error("[!] Look like you use a multi-speaker model. You need to define either a `speaker_name` or a `style_wav` to use a multi-speaker model.")
+                raise ValueError(
+                    "[!] Look like you use a multi-speaker model. You need to define either a `speaker_name` or a `style_wav` to use a multi-speaker model."
+                )
+            else:
+                speaker_embedding = None
+
+        else:
+            if speaker_name:
+                raise ValueError(
+                    f" [!] Missing speakers.json file path for selecting speaker {speaker_name}."
+                    "Define path for speaker.json if it is a multi-speaker model or remove defined speaker idx. "
+                )
+
+        # compute a new d_vector from the given clip.
+        if speaker_wav is not None:
+            speaker_embedding = synth.tts_model.speaker_manager.compute_embedding_from_clip(speaker_wav)
+        return speaker_id, speaker_embedding
+
+    @profiling.profiled("pr_synthesize")
     def pr_synthesize(self,
         synth: Synthesizer,
         text: str,
@@ -148,12 +697,14 @@ class VoiceSynth:
         style_wav: Union[str, List[str]] = None,
         reference_wav=None,
         reference_speaker_name=None,
+        griffin_lim: bool = False,
     ) -> List[int]:
         """TTS magic. Run all the models and generate speech.
 
         NOTE!: This method is based on TTS.synthesizer.Synthesizer.tts
         and should be checked for functional equivalence on a regular
-        basis with the latest and greatest in the TTS library.
+        basis with the latest and greatest in the TTS library
+        (python equivalence.py, also after changes to this method).
 
         LAST UPDATE MAY 8 2022 -- TTS 0.6.2
 
@@ -166,6 +717,7 @@ class VoiceSynth:
             style_wav ([type], optional): style waveform for GST. Defaults to None.
             reference_wav ([type], optional): reference waveform for voice conversion. Defaults to None.
             reference_speaker_name ([type], optional): spekaer id of reference waveform. Defaults to None.
+            griffin_lim (bool, optional): use Griffin-Lim even if the model has a vocoder. Defaults to False.
         Returns:
             List[int]: [description]
 
@@ -185,34 +737,7 @@ class VoiceSynth:
             self.log.info(f"Text splitted to sentences: {sens}")
 
         # handle multi-speaker
-        speaker_embedding = None
-        speaker_id = None
-        if synth.tts_speakers_file or hasattr(synth.tts_model.speaker_manager, "ids"):
-            if speaker_name and isinstance(speaker_name, str):
-                if synth.tts_config.use_d_vector_file:
-                    # get the average speaker embedding from the saved d_vectors.
-                    speaker_embedding = synth.tts_model.speaker_manager.get_mean_embedding(
-                        speaker_name, num_samples=None, randomize=False
-                    )
-                    speaker_embedding = np.array(speaker_embedding)[None, :]  # [1 x embedding_dim]
-                else:
-                    # get speaker idx from the speaker name
-                    speaker_id = self.tts_model.speaker_manager.ids[speaker_name]
-
-            elif not speaker_name and not speaker_wav:
-                self.log.error("[!] Look like you use a multi-speaker model. You need to define either a `speaker_name` or a `style_wav` to use a multi-speaker model.")
-                raise ValueError(
-                    "[!] Look like you use a multi-speaker model. You need to define either a `speaker_name` or a `style_wav` to use a multi-speaker model."
-                )
-            else:
-                speaker_embedding = None
-
-        else:
-            if speaker_name:
-                raise ValueError(
-                    f" [!] Missing speakers.json file path for selecting speaker {speaker_name}."
-                    "Define path for speaker.json if it is a multi-speaker model or remove defined speaker idx. "
-                )
+        speaker_id, speaker_embedding = self.speaker_condition(synth, speaker_name, speaker_wav)
 
         # handle multi-lingaul
         language_id = None
@@ -234,13 +759,27 @@ class VoiceSynth:
                     "Define path for language_ids.json if it is a multi-lingual model or remove defined language idx. "
                 )
 
-        # compute a new d_vector from the given clip.
-        if speaker_wav is not None:
-            speaker_embedding = synth.tts_model.speaker_manager.compute_embedding_from_clip(speaker_wav)
+        use_gl = synth.vocoder_model is None or griffin_lim
 
-        use_gl = synth.vocoder_model is None
+        bridge = None
+        if not use_gl:
+            bridge = mel_bridge(synth.tts_model.ap, synth.vocoder_ap)
+            if bridge is None:
+                self.log.debug("Audio configs use mean/var stats, keeping the denormalize/normalize round trip.")
+
+        if not reference_wav and not use_gl and self.pipeline_vocoder and len(sens) > 1:
+            wavs = self.pipelined_vocode(synth, sens, dict(
+                CONFIG=synth.tts_config,
+                use_cuda=synth.use_cuda,
+                speaker_id=speaker_id,
+                language_id=language_id,
+                style_wav=style_wav,
+                use_griffin_lim=use_gl,
+                d_vector=speaker_embedding,
+                do_trim_silence=False,
+            ), bridge)
 
-        if not reference_wav:
+        elif not reference_wav:
             for sen in sens:
                 # synthesize voice
                 outputs = synthesis(
@@ -255,103 +794,21 @@ class VoiceSynth:
                     d_vector=speaker_embedding,
                     do_trim_silence=False,
                 )
-                waveform = outputs["wav"]
-                mel_postnet_spec = outputs["outputs"]["model_outputs"][0].detach().cpu().numpy()
-                if not use_gl:
-                    # denormalize tts output based on tts audio config
-                    mel_postnet_spec = synth.tts_model.ap.denormalize(mel_postnet_spec.T).T
-                    device_type = "cuda" if synth.use_cuda else "cpu"
-                    # renormalize spectrogram based on vocoder config
-                    vocoder_input = synth.vocoder_ap.normalize(mel_postnet_spec.T)
-                    # compute scale factor for possible sample rate mismatch
-                    scale_factor = [
-                        1,
-                        synth.vocoder_config["audio"]["sample_rate"] / synth.tts_model.ap.sample_rate,
-                    ]
-                    if scale_factor[1] != 1:
-                        self.log.info("Interpolating tts model output.")
-                        vocoder_input = interpolate_vocoder_input(scale_factor, vocoder_input)
-                    else:
-                        vocoder_input = torch.tensor(vocoder_input).unsqueeze(0)  # pylint: disable=not-callable
-                    # run vocoder model
-                    # [1, T, C]
-                    waveform = synth.vocoder_model.inference(vocoder_input.to(device_type))
-                if synth.use_cuda and not use_gl:
-                    waveform = waveform.cpu()
-                if not use_gl:
-                    waveform = waveform.numpy()
-                waveform = waveform.squeeze()
+                if use_gl:
+                    waveform = outputs["wav"].squeeze()
+                else:
+                    mel_postnet_spec = outputs["outputs"]["model_outputs"][0].detach().cpu().numpy()
+                    waveform = self.vocode(synth, mel_postnet_spec, bridge)
 
                 # trim silence
-                try:
-                    if synth.tts_config["do_trim_silence"] is True:
-                        waveform = trim_silence(waveform, synth.tts_model.ap)
-                except KeyError:
-                    pass
+                waveform = self.trim_output(synth, waveform)
 
                 wavs += list(waveform)
                 wavs += [0] * 10000
 
         else: # VOICE CONVERSION
-            # get the speaker embedding or speaker id for the reference wav file
-            reference_speaker_embedding = None
-            reference_speaker_id = None
-            if synth.tts_speakers_file or hasattr(synth.tts_model.speaker_manager, "speaker_ids"):
-                if reference_speaker_name and isinstance(reference_speaker_name, str):
-                    if synth.tts_config.use_d_vector_file:
-                        # get the speaker embedding from the saved d_vectors.
-                        reference_speaker_embedding = synth.tts_model.speaker_manager.get_embeddings_by_name(
-                            reference_speaker_name
-                        )[0]
-                        reference_speaker_embedding = np.array(reference_speaker_embedding)[
-                            None, :
-                        ]  # [1 x embedding_dim]
-                    else:
-                        # get speaker idx from the speaker name
-                        reference_speaker_id = synth.tts_model.speaker_manager.ids[reference_speaker_name]
-                else:
-                    reference_speaker_embedding = synth.tts_model.speaker_manager.compute_embedding_from_clip(
-                        reference_wav
-                    )
-
-            outputs = transfer_voice(
-                model=synth.tts_model,
-                CONFIG=synth.tts_config,
-                use_cuda=synth.use_cuda,
-                reference_wav=reference_wav,
-                speaker_id=speaker_id,
-                d_vector=speaker_embedding,
-                use_griffin_lim=use_gl,
-                reference_speaker_id=reference_speaker_id,
-                reference_d_vector=reference_speaker_embedding,
-            )
-            waveform = outputs
-            if not use_gl:
-                mel_postnet_spec = outputs[0].detach().cpu().numpy()
-                # denormalize tts output based on tts audio config
-                mel_postnet_spec = synth.tts_model.ap.denormalize(mel_postnet_spec.T).T
-                device_type = "cuda" if synth.use_cuda else "cpu"
-                # renormalize spectrogram based on vocoder config
-                vocoder_input = synth.vocoder_ap.normalize(mel_postnet_spec.T)
-                # compute scale factor for possible sample rate mismatch
-                scale_factor = [
-                    1,
-                    synth.vocoder_config["audio"]["sample_rate"] / synth.tts_model.ap.sample_rate,
-                ]
-                if scale_factor[1] != 1:
-                    self.log.info(" > interpolating tts model output.")
-                    vocoder_input = interpolate_vocoder_input(scale_factor, vocoder_input)
-                else:
-                    vocoder_input = torch.tensor(vocoder_input).unsqueeze(0)  # pylint: disable=not-callable
-                # run vocoder model
-                # [1, T, C]
-                waveform = synth.vocoder_model.inference(vocoder_input.to(device_type))
-            if synth.use_cuda:
-                waveform = waveform.cpu()
-            if not use_gl:
-                waveform = waveform.numpy()
-            wavs = waveform.squeeze()
-
+            wavs = self.voice_conversion(synth, reference_wav, speaker_id, speaker_embedding,
+                reference_speaker_name, bridge)
 
         # compute stats
         process_time = time.time() - start_time
@@ -363,6 +820,7 @@ class VoiceSynth:
 
 if __name__ == '__main__':
     # python voicesynth.py --text "Hello World" --model-path ../../../outputs/checkpoints/hifi54_390k/
+    # python voicesynth.py --reference-wav performer.wav --speaker effi --model-path ../../../outputs/checkpoints/efam48_220k/
     # Make sure the model dir contains a model_file.pth and config.json
     import argparse
     from argparse import RawTextHelpFormatter
@@ -373,16 +831,24 @@ if __name__ == '__main__':
         description="""Voice Synthesizer\n\n""",
         formatter_class=RawTextHelpFormatter,
     )
-    parser.add_argument("--text", type=str, default=None, required=True, help="Text to generate speech.")
+    parser.add_argument("--text", type=str, default=None, help="Text to generate speech.")
+    parser.add_argument("--reference-wav", type=Path, default=None, help="Convert this recording to the voice of --speaker instead of synthesizing text.")
+    parser.add_argument("--speaker", type=str, default=None, help="Target speaker name (multi-speaker models).")
+    parser.add_argument("--reference-speaker", type=str, default=None, help="Speaker name of --reference-wav, if the model knows it.")
+    parser.add_argument("--stream", action="store_true", help="Convert --reference-wav in chunks (long recordings).")
+    parser.add_argument("--reference-cache", type=Path, default=None, help="Directory to keep reference features in between runs.")
 
     parser.add_argument(
         "--model-path",
         type=Path,
         default=None,
-        required=True,
+        required=False,
         help='Path to root directory of TTS model. Files expected in this dir: model_file.pth, config.json, and more depending on model type'
     )
 
+    parser.add_argument("--models", type=Path, default=None, help="Model manifest (see modelspec.py) instead of --model-path, --model-id picks the model to speak with.")
+    parser.add_argument("--model-id", type=str, default=None, help="Model of the --models manifest to speak with (default: its first preloaded model).")
+
     parser.add_argument(
         "--model-type",
         type=str,
@@ -399,46 +865,72 @@ if __name__ == '__main__':
     )
 
     parser.add_argument("--use-cuda", type=bool, help="Run model on CUDA.", default=False)
+    parser.add_argument("--no-vocoder-pipeline", action="store_true", help="Run the tts model and vocoder one sentence at a time (models with a separate vocoder).")
+    parser.add_argument("--windowed", action="store_true", help="Play --text while it is decoded, in windows of the latent sequence (VITS).")
 
     args = parser.parse_args()
+    if args.text is None and args.reference_wav is None:
+        parser.error("Either --text or --reference-wav is needed")
+    if args.models is None and args.model_path is None:
+        parser.error("Either --model-path or --models is needed")
+    if args.model_type != "vits":
+        parser.error(f"Model type '{args.model_type}' is not yet supported")
 
     TEXT = args.text
     AUDIO_WRITE_PATH = args.output.resolve() # audio renders go here
     MODEL_TYPE = args.model_type
-    MODEL_PATH = args.model_path.resolve() # path to root directory of model
     USE_CUDA = args.use_cuda
 
-    # Build a Model Spec depending on type.
-    modelroot = str(MODEL_PATH.parent)
-    modelsubdir = MODEL_PATH.name
-    model_spec = { 'tts_model_root_path': modelroot, 'tts': None }
-    if MODEL_TYPE == "vits":
-        model_spec['tts'] = {
-            "vits": [
-                os.path.join(modelsubdir, "model_file.pth"),
-                os.path.join(modelsubdir, "config.json"),
-                None, None, None, None, None, None
-            ]
-        }
-    elif MODEL_TYPE == "capacitron":
-        raise Error("Capacitron support is not yet implemented")
-    else:
-        raise Error(f"Unknown model type '{MODEL_TYPE}'")
+    # Model Specs from the --models manifest, or the --model-path directory, see modelspec.py
+    model_specs = modelspec.specs_from_args(args, name=MODEL_TYPE)
+    MODEL_ID = modelspec.default_model(model_specs, args.model_id)
 
     voicesynth = VoiceSynth(AUDIO_WRITE_PATH, USE_CUDA, logging.getLogger("VoiceSynthesizer"))
-    voicesynth.load_models(model_spec)
-
-    # Just synthesize one line of text and play the result.
-    print(f"Generating: >>{TEXT}<<")
-    filename = f"{MODEL_TYPE}_testoutput.wav"
-
-    wav, sr, outfile = voicesynth.synthesize(
-        TEXT, filename, "vits",
-        speaker_name=None,
-        language_name=None,
-        clean_text=False,
-        rewrite_words=None
-    )
+    voicesynth.load_specs(model_specs)
+    voicesynth.pipeline_vocoder = not args.no_vocoder_pipeline
+
+    if args.reference_wav is not None:
+        if args.reference_cache is not None:
+            voicesynth.set_reference_cache(args.reference_cache)
+        print(f"Converting: >>{args.reference_wav}<<")
+        filename = f"{MODEL_TYPE}_conversion.wav"
+        wav, sr, outfile = voicesynth.convert(
+            args.reference_wav, filename, MODEL_ID,
+            speaker_name=args.speaker,
+            reference_speaker_name=args.reference_speaker,
+            stream=args.stream
+        )
+    elif args.windowed:
+        # Play the chunks as they are decoded.
+        print(f"Generating (windowed): >>{TEXT}<<")
+        voicesynth.require_model(MODEL_ID)
+        sr = voicesynth.tts[MODEL_ID]["sr"]
+        start_time = time.time()
+        chunks = []
+        with sd.OutputStream(samplerate=sr, channels=1, dtype="float32") as stream:
+            for chunk in voicesynth.synthesize_stream(TEXT, MODEL_ID, speaker_name=args.speaker):
+                if len(chunks) == 0:
+                    print(f"Time to first audio: {time.time() - start_time:.3f}s")
+                chunks.append(chunk)
+                stream.write(chunk[:, None])
+        wav = np.concatenate(chunks)
+        outfile = os.path.abspath(os.path.join(AUDIO_WRITE_PATH, f"{MODEL_TYPE}_windowed.wav"))
+        voicesynth.tts[MODEL_ID]["ap"].save_wav(wav, outfile, sr)
+        print(outfile)
+        print("...DONE...")
+        sys.exit(0)
+    else:
+        # Just synthesize one line of text and play the result.
+        print(f"Generating: >>{TEXT}<<")
+        filename = f"{MODEL_TYPE}_testoutput.wav"
+
+        wav, sr, outfile = voicesynth.synthesize(
+            TEXT, filename, MODEL_ID,
+            speaker_name=args.speaker,
+            language_name=None,
+            clean_text=False,
+            rewrite_words=None
+        )
 
     print(outfile)
 
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Vosk model management.
+
+Models are resolved from a local cache directory (the same directories vosk
+itself downloads to), so starting the app never touches the network unless a
+download is explicitly allowed. Loading is timed.
+
+Kaldi reads the model files into its own heap, so the loaded model cannot be
+memory-mapped or shared by prefetching. prefetch() only warms the page cache:
+it maps the model files read-only and asks the kernel to read them ahead, so
+loading the model (in this or any other process) reads from memory instead of
+disk. To share one loaded model between worker processes, load it before
+forking them (see qc.py), the workers then share its pages copy-on-write.
+
+python voskmodels.py --list
+python voskmodels.py --vosk-lang en-us --prefetch
+"""
+import os
+import sys
+import re
+import mmap
+import time
+import logging
+from logging import Logger
+from pathlib import Path
+from typing import List, Union, Tuple
+
+# Same search order as vosk.Model
+DEFAULT_CACHE_DIRS = [
+    Path(os.environ["VOSK_MODEL_PATH"]) if "VOSK_MODEL_PATH" in os.environ else None,
+    Path("/usr/share/vosk"),
+    Path.home() / "AppData" / "Local" / "vosk",
+    Path.home() / ".cache" / "vosk",
+]
+
+
+def version_key(path: Path) -> Tuple[bool, Tuple[int, ...]]:
+    """
+    Sort key for the model directories of one language, the preferred model sorts last:
+    variants (e.g. vosk-model-en-us-0.22-lgraph) before plain models, then by version,
+    compared numerically (vosk-model-small-en-us-0.4 < vosk-model-small-en-us-0.15).
+    """
+    match = re.search(r"-(\d+(?:\.\d+)*)(-.*)?$", path.name)
+    if match is None:
+        return (False, ())
+    return (match.group(2) is None, tuple(int(part) for part in match.group(1).split(".")))
+
+
+class VoskModelCache:
+    """
+        cache_dirs      Directories to look for models in (default: the vosk download directories)
+        logger          Logger for load times
+    """
+    def __init__(self, cache_dirs: List[Union[str, Path]] = None, logger: Logger = None) -> None:
+        if cache_dirs is None:
+            cache_dirs = [d for d in DEFAULT_CACHE_DIRS if d is not None]
+        self.cache_dirs = [Path(d) for d in cache_dirs]
+        self.log = logger if logger is not None else logging.getLogger("VoskModelCache")
+        self.load_times = dict()
+
+    def list_models(self) -> List[Path]:
+        """All model directories in the cache directories."""
+        models = []
+        for cache_dir in self.cache_dirs:
+            if cache_dir.is_dir():
+                models += sorted(p for p in cache_dir.glob("vosk-model*") if p.is_dir())
+        return models
+
+    def resolve(self, name: Union[str, Path] = None, lang: str = None, prefer_small: bool = True) -> Path:
+        """
+        Find a model directory without network access.
+            name            A model directory path, or a model name (e.g. vosk-model-en-us-0.22)
+            lang            A language code (e.g. en-us), matched against the model names
+            prefer_small    For lang lookups prefer the small model, like vosk.Model(lang=...) does
+        """
+        if name is not None:
+            path = Path(name).expanduser()
+            if path.is_dir():
+                return path.resolve()
+            for model in self.list_models():
+                if model.name == str(name):
+                    return model
+            raise FileNotFoundError(f"Vosk model '{name}' not found in {[str(d) for d in self.cache_dirs]}")
+
+        if lang is not None:
+            candidates = [m for m in self.list_models() if f"-{lang}-" in m.name or m.name.endswith(f"-{lang}")]
+            if len(candidates) > 0:
+                small = sorted((m for m in candidates if "-small-" in m.name), key=version_key)
+                large = sorted((m for m in candidates if "-small-" not in m.name), key=version_key)
+                preferred, other = (small, large) if prefer_small else (large, small)
+                return (preferred or other)[-1]
+            raise FileNotFoundError(
+                f"No vosk model for language '{lang}' in {[str(d) for d in self.cache_dirs]}. "
+                "Download one from https://alphacephei.com/vosk/models and unpack it there."
+            )
+
+        raise ValueError("Either a model name/path or a language is needed to resolve a vosk model")
+
+    def prefetch(self, path: Union[str, Path]) -> int:
+        """
+        Map all model files read-only and ask the kernel to read them into the page cache,
+        so the following Model() load reads from memory. This does not share the loaded model.
+        Returns the number of bytes prefetched.
+        """
+        total = 0
+        for root, dirs, files in os.walk(path):
+            for filename in files:
+                filepath = os.path.join(root, filename)
+                size = os.path.getsize(filepath)
+                if size == 0:
+                    continue
+                with open(filepath, "rb") as f:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        if hasattr(mapped, "madvise") and hasattr(mmap, "MADV_WILLNEED"):
+                            mapped.madvise(mmap.MADV_WILLNEED)
+                        else:
+                            # touch one byte per page
+                            for offset in range(0, size, mmap.PAGESIZE):
+                                mapped[offset]
+                total += size
+        return total
+
+    def load(self, name: Union[str, Path] = None, lang: str = None, prefetch: bool = True,
+        allow_download: bool = False):
+        """
+        Resolve and load a vosk Model, logging how long it took.
+        Only if allow_download is set, no model name is given and no model for lang is found locally,
+        vosk may download the model. A model name that cannot be resolved is always an error.
+        """
+        from vosk import Model
+
+        try:
+            path = self.resolve(name=name, lang=lang)
+        except FileNotFoundError:
+            if not allow_download or name is not None or lang is None:
+                raise
+            self.log.warning(f"No local vosk model for '{lang}', letting vosk download one")
+            start_time = time.time()
+            model = Model(lang=lang)
+            self.load_times[lang] = time.time() - start_time
+            self.log.info(f"Downloaded and loaded vosk model for '{lang}' in {self.load_times[lang]:.2f}s")
+            return model
+
+        if prefetch:
+            start_time = time.time()
+            num_bytes = self.prefetch(path)
+            self.log.info(f"Prefetched {num_bytes / 1e6:.1f} MB of {path.name} in {time.time() - start_time:.2f}s")
+
+        print(f"Loading vosk model: {path}")
+        start_time = time.time()
+        model = Model(str(path))
+        self.load_times[str(path)] = time.time() - start_time
+        print(f"Done loading vosk model {path.name} in {self.load_times[str(path)]:.2f}s")
+        self.log.info(f"Loaded vosk model {path.name} in {self.load_times[str(path)]:.2f}s")
+        return model
+
+
+def add_vosk_args(parser) -> None:
+    """Vosk model command line options shared by the entry points."""
+    parser.add_argument("--vosk-model", type=str, default=None, help="Vosk model directory or name in the vosk cache (default: by --vosk-lang)")
+    parser.add_argument("--vosk-lang", type=str, default="en-us", help="Vosk model language, used when no --vosk-model is given")
+    parser.add_argument("--vosk-cache", type=Path, nargs="+", default=None, help="Directories to look for vosk models in")
+    parser.add_argument("--allow-download", action="store_true", help="Let vosk download a --vosk-lang model if none is found locally (never replaces a missing --vosk-model)")
+
+
+def load_from_args(args, logger: Logger = None):
+    """Load the vosk Model selected by the add_vosk_args() options."""
+    cache = VoskModelCache(args.vosk_cache, logger=logger)
+    return cache.load(name=args.vosk_model, lang=args.vosk_lang, allow_download=args.allow_download)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Vosk model cache.")
+    add_vosk_args(parser)
+    parser.add_argument("--list", action="store_true", help="List models in the cache and exit")
+    parser.add_argument("--prefetch", action="store_true", help="Prefetch the model into the page cache and exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    cache = VoskModelCache(args.vosk_cache)
+
+    if args.list:
+        for model in cache.list_models():
+            print(model)
+        sys.exit(0)
+
+    path = cache.resolve(name=args.vosk_model, lang=args.vosk_lang)
+    print(f"Resolved: {path}")
+    if args.prefetch:
+        start_time = time.time()
+        num_bytes = cache.prefetch(path)
+        print(f"Prefetched {num_bytes / 1e6:.1f} MB in {time.time() - start_time:.2f}s")
+    else:
+        cache.load(name=path, prefetch=True)
+        print(f"Load times: {cache.load_times}")
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Windowed (sub-sentence) decoding for VITS.
+
+VITS turns a sentence into a latent sequence z (text encoder, duration
+predictor, flow: cheap) and then runs the HiFi-GAN waveform decoder over
+all of z at once (expensive, most of the synthesis time). The decoder is
+purely convolutional, so a stretch of output only depends on z within its
+receptive field: decoding overlapping windows of z, each with `context`
+frames on both sides that are thrown away afterwards, gives the same audio
+as decoding z in one go, and the first window's audio exists long before
+the end of the sentence is decoded.
+
+The receptive field is computed from the decoder's configuration (see
+receptive_field(), 15 frames on each side for the standard VITS HiFi-GAN)
+and is the default context. measure_receptive_field() finds it by
+perturbing one latent frame instead.
+
+    time to first audio     latents + one window, independent of the sentence length
+    extra compute           about 2 * context / window of the decoder time (~38% for the standard VITS)
+    difference              float rounding only with context >= the receptive field, compare with
+                            python windowed.py --model-path ... --text "..."
+
+Windows meet with a short crossfade (fade_frames) to hide any remaining
+discontinuity at the seams.
+"""
+import math
+import time
+from typing import Iterator, Dict, Union
+
+import numpy as np
+import torch
+
+
+def text_inputs(synth, text: str, language_name: str = None) -> torch.Tensor:
+    """Token ids of text for the synthesizer's model, [1, T] (as TTS's synthesis() builds them)."""
+    model = synth.tts_model
+    if getattr(model, "tokenizer", None) is not None: # TTS >= 0.7
+        ids = np.asarray(model.tokenizer.text_to_ids(text, language=language_name), dtype=np.int32)
+    else: # TTS 0.6
+        from TTS.tts.utils.synthesis import text_to_seq
+        custom_symbols = model.make_symbols(synth.tts_config) if hasattr(model, "make_symbols") else None
+        ids = np.asarray(text_to_seq(text, synth.tts_config, custom_symbols=custom_symbols, language=language_name), dtype=np.int32)
+    inputs = torch.as_tensor(ids, dtype=torch.long).unsqueeze(0)
+    return inputs.cuda() if synth.use_cuda else inputs
+
+
+@torch.no_grad()
+def vits_latents(model, x: torch.Tensor, speaker_id=None, d_vector=None, language_id=None) -> Dict[str, torch.Tensor]:
+    """
+    Everything of Vits.inference() before the waveform decoder: returns {"z": [1, C, T_frames], "g": speaker conditioning or None}.
+
+    NOTE!: This is based on TTS.tts.models.vits.Vits.inference and should be
+    checked for functional equivalence with the TTS library in use (see
+    `python equivalence.py`, the full decode of these latents must match
+    the model's own output for the same noise).
+
+    LAST UPDATE -- TTS 0.6.2
+    """
+    from TTS.tts.utils.helpers import generate_path, sequence_mask
+
+    aux_input = {"speaker_ids": speaker_id, "d_vectors": d_vector, "language_ids": language_id}
+    sid, g, lid = model._set_cond_input(aux_input)
+    x_lengths = torch.tensor(x.shape[1:2]).to(x.device)
+
+    # speaker embedding
+    if model.args.use_speaker_embedding and sid is not None:
+        g = model.emb_g(sid).unsqueeze(-1)
+
+    # language embedding
+    lang_emb = None
+    if model.args.use_language_embedding and lid is not None:
+        lang_emb = model.emb_l(lid).unsqueeze(-1)
+
+    x, m_p, logs_p, x_mask = model.text_encoder(x, x_lengths, lang_emb=lang_emb)
+
+    g_dp = g if model.args.condition_dp_on_speaker else None
+    if model.args.use_sdp:
+        logw = model.duration_predictor(x, x_mask, g=g_dp, reverse=True,
+            noise_scale=model.inference_noise_scale_dp, lang_emb=lang_emb)
+    else:
+        logw = model.duration_predictor(x, x_mask, g=g_dp, lang_emb=lang_emb)
+
+    w = torch.exp(logw) * x_mask * model.length_scale
+    w_ceil = torch.ceil(w)
+    y_lengths = torch.clamp_min(torch.sum(w_ceil, [1, 2]), 1).long()
+    y_mask = sequence_mask(y_lengths, None).to(x_mask.dtype)
+    attn_mask = torch.unsqueeze(x_mask, 2) * torch.unsqueeze(y_mask, -1)
+    attn = generate_path(w_ceil.squeeze(1), attn_mask.squeeze(1).transpose(1, 2))
+
+    m_p = torch.matmul(attn.transpose(1, 2), m_p.transpose(1, 2)).transpose(1, 2)
+    logs_p = torch.matmul(attn.transpose(1, 2), logs_p.transpose(1, 2)).transpose(1, 2)
+
+    z_p = m_p + torch.randn_like(m_p) * torch.exp(logs_p) * model.inference_noise_scale
+    z = model.flow(z_p, y_mask, g=g, reverse=True)
+    z = (z * y_mask)[:, :, : model.max_inference_len]
+    return {"z": z, "g": g}
+
+
+def hop_length(model, z: torch.Tensor, g=None) -> int:
+    """Output samples per latent frame of the waveform decoder."""
+    upsample_rates = getattr(model.args, "upsample_rates_decoder", None)
+    if upsample_rates:
+        return int(np.prod(upsample_rates))
+    return int(model.waveform_decoder(z[:, :, :1], g=g).shape[-1])
+
+
+def receptive_field(model) -> int:
+    """
+    Latent frames on each side of a frame that reach its output in the HiFi-GAN waveform decoder,
+    an upper bound computed from the model's decoder arguments (TTS.vocoder.models.hifigan_generator):
+    conv_pre and conv_post, each transposed convolution upsampling layer and the resblocks after it,
+    every layer's reach divided by the upsampling up to it. Standard VITS (upsample rates 8,8,2,2,
+    kernels 16,16,4,4, resblock kernels 3,7,11, dilations 1,3,5): 15 frames.
+    Falls back to measure_receptive_field() for decoders without these arguments.
+    """
+    args = model.args
+    upsample_rates = getattr(args, "upsample_rates_decoder", None)
+    upsample_kernel_sizes = getattr(args, "upsample_kernel_sizes_decoder", None)
+    resblock_kernel_sizes = getattr(args, "resblock_kernel_sizes_decoder", None)
+    resblock_dilation_sizes = getattr(args, "resblock_dilation_sizes_decoder", None)
+    if not (upsample_rates and upsample_kernel_sizes and resblock_kernel_sizes and resblock_dilation_sizes):
+        return measure_receptive_field(model)
+
+    decoder = model.waveform_decoder
+    conv_pre = decoder.conv_pre.kernel_size[0] if hasattr(decoder, "conv_pre") else 7
+    conv_post = decoder.conv_post.kernel_size[0] if hasattr(decoder, "conv_post") else 7
+    resblock_type = str(getattr(args, "resblock_type_decoder", "1"))
+
+    def resblock_reach(kernel_size: int, dilations) -> float:
+        # ResBlock1: a dilated and an undilated convolution per dilation, ResBlock2: the dilated one only
+        reach = sum((kernel_size - 1) * d // 2 for d in dilations)
+        if resblock_type == "1":
+            reach += len(dilations) * ((kernel_size - 1) // 2)
+        return reach
+
+    frames = (conv_pre - 1) // 2
+    rate = 1 # output samples per latent frame so far
+    for upsample_rate, kernel_size in zip(upsample_rates, upsample_kernel_sizes):
+        frames += math.ceil((kernel_size - 1) / upsample_rate) / rate # every input sample a transposed conv output touches
+        rate *= upsample_rate
+        # parallel resblocks are averaged, the widest one counts
+        frames += max(resblock_reach(k, d) for k, d in zip(resblock_kernel_sizes, resblock_dilation_sizes)) / rate
+    frames += ((conv_post - 1) // 2) / rate
+    return int(math.ceil(frames))
+
+
+@torch.no_grad()
+def measure_receptive_field(model, g=None, frames: int = 96, channels: int = None) -> int:
+    """
+    Receptive field of the waveform decoder in latent frames (on each side), measured:
+    decodes random latents, changes the middle frame and finds the furthest output
+    sample that changes.
+    """
+    decoder = model.waveform_decoder
+    if channels is None:
+        channels = decoder.conv_pre.in_channels
+    parameter = next(decoder.parameters())
+    generator = torch.Generator().manual_seed(0)
+    z = torch.randn(1, channels, frames, generator=generator).to(parameter.device, parameter.dtype)
+    if g is None and hasattr(decoder, "cond_layer"): # multi-speaker decoders need a conditioning vector
+        g = torch.zeros(1, decoder.cond_layer.in_channels, 1).to(parameter.device, parameter.dtype)
+    center = frames // 2
+    changed = z.clone()
+    changed[:, :, center] += 1.0
+
+    a = decoder(z, g=g)[0, 0]
+    b = decoder(changed, g=g)[0, 0]
+    hop = a.shape[-1] // frames
+    moved = torch.nonzero(torch.abs(a - b) > 1e-6 * (torch.max(torch.abs(a)) + 1e-9)).flatten()
+    if len(moved) == 0:
+        return 0
+    first, last = int(moved[0]) // hop, int(moved[-1]) // hop
+    return max(center - first, last - center)
+
+
+@torch.no_grad()
+def decode_windows(model, z: torch.Tensor, g=None, window: int = 80, context: int = None, first_window: int = 32,
+    fade_frames: int = 1) -> Iterator[np.ndarray]:
+    """
+    Run the waveform decoder over overlapping windows of z and yield float32 audio chunks.
+        window          Latent frames per window (more: less overhead, later audio)
+        context         Frames decoded on each side of a window and dropped
+                        (default: receptive_field(model), exact output up to float rounding)
+        first_window    Size of the first window, smaller for an earlier first chunk
+        fade_frames     Frames crossfaded between windows
+    """
+    if context is None:
+        context = receptive_field(model)
+    num_frames = z.shape[2]
+    hop = hop_length(model, z, g)
+    fade = fade_frames * hop
+    ramp = np.linspace(0.0, 1.0, fade, endpoint=False, dtype=np.float32) if fade > 0 else None
+    tail = None # faded out end of the previous window
+    start = 0
+    size = first_window
+    while start < num_frames:
+        end = min(num_frames, start + size)
+        overlap_end = min(num_frames, end + fade_frames) # decode a little past the end for the crossfade
+        a = max(0, start - context)
+        b = min(num_frames, overlap_end + context)
+        o = model.waveform_decoder(z[:, :, a:b], g=g)
+        wav = o[0, 0, (start - a) * hop:(overlap_end - a) * hop].detach().cpu().numpy().astype(np.float32)
+
+        if tail is not None:
+            n = len(tail)
+            wav[:n] = tail * (1.0 - ramp[:n]) + wav[:n] * ramp[:n]
+        if overlap_end > end:
+            keep = (end - start) * hop
+            tail = wav[keep:]
+            wav = wav[:keep]
+        else:
+            tail = None
+        yield wav
+        start = end
+        size = window
+
+
+def snr_db(reference: np.ndarray, estimate: np.ndarray) -> float:
+    n = min(len(reference), len(estimate))
+    noise = np.sum((reference[:n] - estimate[:n]) ** 2)
+    if noise == 0:
+        return float("inf")
+    return float(10 * np.log10(np.sum(reference[:n] ** 2) / noise))
+
+
+@torch.no_grad()
+def compare(model, x: torch.Tensor, window: int = 80, context: int = None, first_window: int = 32, fade_frames: int = 1,
+    speaker_id=None, d_vector=None, language_id=None) -> Dict[str, float]:
+    """
+    Full vs windowed decoding of the same latents (same noise): audio difference and timing.
+    """
+    latents = vits_latents(model, x, speaker_id, d_vector, language_id)
+    z, g = latents["z"], latents["g"]
+
+    start_time = time.time()
+    full = model.waveform_decoder(z, g=g)[0, 0].detach().cpu().numpy().astype(np.float32)
+    full_time = time.time() - start_time
+
+    start_time = time.time()
+    first_chunk_time = None
+    chunks = []
+    for chunk in decode_windows(model, z, g, window, context, first_window, fade_frames):
+        if first_chunk_time is None:
+            first_chunk_time = time.time() - start_time
+        chunks.append(chunk)
+    windowed_time = time.time() - start_time
+    windowed = np.concatenate(chunks)
+
+    n = min(len(full), len(windowed))
+    return {
+        "frames": int(z.shape[2]),
+        "samples": len(full),
+        "length_difference": len(windowed) - len(full),
+        "max_abs_difference": float(np.max(np.abs(full[:n] - windowed[:n]))) if n > 0 else 0.0,
+        "snr_db": snr_db(full, windowed),
+        "full_decode_time": full_time,
+        "windowed_decode_time": windowed_time,
+        "windowed_first_chunk_time": first_chunk_time,
+        "extra_compute": windowed_time / full_time - 1.0 if full_time > 0 else 0.0,
+    }
+
+
+if __name__ == '__main__':
+    # python windowed.py --model-path ../outputs/checkpoints/efam48_220k/ --text "A long sentence ..."
+    import argparse
+    import logging
+    from pathlib import Path
+
+    from TTS.tts.utils.synthesis import embedding_to_torch, id_to_torch
+
+    import modelspec
+    from voicesynth import VoiceSynth
+
+    parser = argparse.ArgumentParser(description="Compare windowed and full VITS decoding (audio difference, time to first audio).")
+    parser.add_argument("--model-path", type=Path, required=True, help="VITS model directory")
+    parser.add_argument("--text", type=str, nargs="+", default=[
+        "Shibboleths have been used throughout history in many societies as passwords, simple ways of self-identification, "
+        "signaling loyalty and affinity, maintaining traditional segregation, or protecting from real or perceived threats"
+    ], help="Sentences to measure")
+    parser.add_argument("--speaker", type=str, default=None)
+    parser.add_argument("--window", type=int, default=80)
+    parser.add_argument("--context", type=int, nargs="+", default=None, help="Context sizes to compare (default: 0, 4, 8 and the receptive field)")
+    parser.add_argument("--first-window", type=int, default=32)
+    parser.add_argument("--fade-frames", type=int, default=1)
+    parser.add_argument("--use-cuda", type=bool, default=False)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    voice_synth = VoiceSynth("tmp/wav", args.use_cuda, logging.getLogger("VoiceSynthesizer"))
+    voice_synth.load_specs([modelspec.ModelSpec.from_model_dir("vits", args.model_path.resolve())])
+    synth = voice_synth.tts["vits"]["tts"]
+    speaker_id, d_vector = voice_synth.speaker_condition(synth, args.speaker, None)
+    if speaker_id is not None:
+        speaker_id = id_to_torch(speaker_id, cuda=args.use_cuda)
+    if d_vector is not None:
+        d_vector = embedding_to_torch(d_vector, cuda=args.use_cuda)
+
+    field = receptive_field(synth.tts_model)
+    print(f"Receptive field: {field} frames computed, {measure_receptive_field(synth.tts_model)} measured")
+    contexts = args.context if args.context is not None else [0, 4, 8, field]
+
+    print("chars,context,frames,max_abs_difference,snr_db,full_decode_time,windowed_first_chunk_time,windowed_decode_time,extra_compute")
+    for text in args.text:
+        x = text_inputs(synth, text)
+        for context in contexts:
+            result = compare(synth.tts_model, x, args.window, context, args.first_window, args.fade_frames, speaker_id, d_vector)
+            print(f"{len(text)},{context},{result['frames']},{result['max_abs_difference']:.2e},{result['snr_db']:.1f},"
+                f"{result['full_decode_time']:.3f},{result['windowed_first_chunk_time']:.3f},"
+                f"{result['windowed_decode_time']:.3f},{result['extra_compute']:.2f}")